@@ -38,6 +38,11 @@ export class ModelController {
     res.status(200).json(result);
   };
 
+  drift = async (_req: Request, res: Response): Promise<void> => {
+    const result = await this.mlServiceClient.getModelDrift();
+    res.status(200).json(result);
+  };
+
   retrain = async (_req: Request, res: Response): Promise<void> => {
     const result = await this.mlServiceClient.triggerRetrain();
     res.status(200).json(result);
@@ -262,6 +262,7 @@ router.get('/api/v1/model/info', authMiddleware, asyncHandler(modelController.in
 router.get('/api/v1/model/health', authMiddleware, asyncHandler(modelController.health));
 router.get('/api/v1/model/registry', authMiddleware, asyncHandler(modelController.registry));
 router.get('/api/v1/model/stats', authMiddleware, asyncHandler(modelController.stats));
+router.get('/api/v1/model/drift', authMiddleware, asyncHandler(modelController.drift));
 router.post('/api/v1/model/retrain', authMiddleware, roleMiddleware(['admin']), asyncHandler(modelController.retrain));
 router.patch('/api/v1/model/config', authMiddleware, roleMiddleware(['admin']), asyncHandler(modelController.updateConfig));
 
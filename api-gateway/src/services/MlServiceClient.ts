@@ -1,4 +1,6 @@
 import axios from 'axios';
+import { createInterface } from 'readline';
+import { Readable } from 'stream';
 import { env } from '../config/env';
 import { FraudExplanationItem } from '../models/FraudExplanation';
 
@@ -8,6 +10,10 @@ interface MlRequest {
   location: string;
   deviceId: string;
   timestamp: string;
+  // Idempotency key: retries carrying the same id replay the first score
+  transactionId?: string;
+  // Ask for model-based featureContributions (TreeSHAP + autoencoder error); off by default
+  explain?: boolean;
   graphContext?: {
     deviceId: string;
     ipAddress: string;
@@ -16,6 +22,24 @@ interface MlRequest {
   };
 }
 
+export interface MlScore {
+  fraudScore: number;
+  isFraud: boolean;
+  confidence: number;
+  modelScores: Record<string, number>;
+  modelWeights: Record<string, number>;
+  modelsRun?: string[];
+  explanations: FraudExplanationItem[];
+  graphScore?: number;
+  graphMetrics?: Record<string, unknown>;
+  // Unsigned shares of the blended attribution; signed per-model values are in modelContributions
+  featureContributions?: Array<{ feature: string; share: number }>;
+  modelContributions?: Record<string, { values: Record<string, number>; bias?: number; reconstructionError?: number }>;
+}
+
+// One line of a /predict/stream response: a score, a rejected input line, or the end of a broken stream
+export type MlStreamResult = MlScore | { line: number; error: unknown[] } | { error: string; fatal: true };
+
 export type MlRuntimeStatus = 'HEALTHY' | 'DEGRADED' | 'OFFLINE';
 
 export class MlServiceClient {
@@ -65,34 +89,14 @@ export class MlServiceClient {
     return false;
   }
 
-  async score(payload: MlRequest): Promise<{
-    fraudScore: number;
-    isFraud: boolean;
-    confidence: number;
-    modelScores: Record<string, number>;
-    modelWeights: Record<string, number>;
-    explanations: FraudExplanationItem[];
-    graphScore?: number;
-    graphMetrics?: Record<string, unknown>;
-    featureContributions?: Array<{ feature: string; weight: number }>;
-  }> {
+  async score(payload: MlRequest): Promise<MlScore> {
     if (!this.canAttempt()) {
       throw new Error(`ML circuit breaker open until ${new Date(this.circuitOpenUntil).toISOString()}`);
     }
 
     const startedAt = Date.now();
     try {
-      const response = await axios.post<{
-        fraudScore: number;
-        isFraud: boolean;
-        confidence: number;
-        modelScores: Record<string, number>;
-        modelWeights: Record<string, number>;
-        explanations: FraudExplanationItem[];
-        graphScore?: number;
-        graphMetrics?: Record<string, unknown>;
-        featureContributions?: Array<{ feature: string; weight: number }>;
-      }>(`${env.ML_SERVICE_URL}/predict`, payload, {
+      const response = await axios.post<MlScore>(`${env.ML_SERVICE_URL}/predict`, payload, {
         timeout: 2500
       });
       this.markSuccess(Date.now() - startedAt);
@@ -104,6 +108,46 @@ export class MlServiceClient {
     }
   }
 
+  /**
+   * Scores a stream of transactions over a single NDJSON request (POST /predict/stream).
+   * Results come back in input order. Events are pulled only as fast as the service
+   * reads them, so a busy service slows the producer down rather than letting it buffer.
+   */
+  async *scoreStream(events: AsyncIterable<MlRequest>): AsyncGenerator<MlStreamResult> {
+    if (!this.canAttempt()) {
+      throw new Error(`ML circuit breaker open until ${new Date(this.circuitOpenUntil).toISOString()}`);
+    }
+
+    const body = Readable.from(
+      (async function* () {
+        for await (const event of events) {
+          yield `${JSON.stringify(event)}\n`;
+        }
+      })()
+    );
+    const startedAt = Date.now();
+    try {
+      const response = await axios.post<Readable>(`${env.ML_SERVICE_URL}/predict/stream`, body, {
+        headers: { 'Content-Type': 'application/x-ndjson' },
+        responseType: 'stream',
+        // Native http (no redirect wrapper), which streams the body instead of buffering it
+        maxRedirects: 0,
+        maxBodyLength: Infinity,
+        timeout: 0
+      });
+      this.markSuccess(Date.now() - startedAt);
+      for await (const line of createInterface({ input: response.data, crlfDelay: Infinity })) {
+        if (line) {
+          yield JSON.parse(line) as MlStreamResult;
+        }
+      }
+    } catch (error: any) {
+      const reason = error instanceof Error ? error.message : 'Unknown ML error';
+      this.markFailure(reason);
+      throw error;
+    }
+  }
+
   async getGraphAnalytics(): Promise<{
     nodes: any[];
     clusters: any[];
@@ -186,6 +230,15 @@ export class MlServiceClient {
     }
   }
 
+  async getModelDrift(): Promise<any> {
+    try {
+      const resp = await axios.get(`${env.ML_SERVICE_URL}/model/drift`, { timeout: 5000 });
+      return resp.data;
+    } catch {
+      return { windows: {}, models: {} };
+    }
+  }
+
   getModelInfo() {
     return {
       modelName: env.MODEL_NAME,
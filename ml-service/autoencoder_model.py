@@ -1,33 +1,54 @@
 """
-PyTorch MLP Autoencoder for anomaly detection.
+MLP Autoencoder for anomaly detection.
 Reconstruction error on normal-transaction features indicates fraud likelihood.
 Kept lightweight — no GPU, no heavy dependencies.
+
+Training uses PyTorch, imported lazily inside train(). After training the weights
+are exported to NumPy and scoring is a fused NumPy forward pass, so serving
+processes that load a persisted artifact never import torch.
 """
 from __future__ import annotations
 
+import os
+
 import numpy as np
-import torch
-import torch.nn as nn
-from torch.utils.data import DataLoader, TensorDataset
-
-
-class _MLP(nn.Module):
-    def __init__(self, input_dim: int = 5, hidden_dim: int = 12, bottleneck: int = 4) -> None:
-        super().__init__()
-        self.encoder = nn.Sequential(
-            nn.Linear(input_dim, hidden_dim),
-            nn.ReLU(),
-            nn.Linear(hidden_dim, bottleneck),
-            nn.ReLU(),
-        )
-        self.decoder = nn.Sequential(
-            nn.Linear(bottleneck, hidden_dim),
-            nn.ReLU(),
-            nn.Linear(hidden_dim, input_dim),
-        )
 
-    def forward(self, x: torch.Tensor) -> torch.Tensor:  # type: ignore[override]
-        return self.decoder(self.encoder(x))
+from drift import DriftReference, fit_reference, load_reference, save_reference
+from feature_log import FeatureLogReader
+from registry import artifact_path
+
+# Passes over the feature log when training from it (it is far larger than the synthetic set)
+AE_LOG_EPOCHS = int(os.getenv("AE_LOG_EPOCHS", "3"))
+AE_THRESHOLD_SAMPLE = int(os.getenv("AE_THRESHOLD_SAMPLE", "200000"))
+# Fine-tuning epochs for an incremental update
+AE_FINETUNE_EPOCHS = int(os.getenv("AE_FINETUNE_EPOCHS", "3"))
+
+# Layer names in the order of the 5 → 12 → 4 → 12 → 5 network; also the artifact keys
+_LAYERS = ("encoder.0", "encoder.2", "decoder.0", "decoder.2")
+
+
+def _build_mlp(input_dim: int = 5, hidden_dim: int = 12, bottleneck: int = 4):
+    import torch.nn as nn  # noqa: PLC0415
+
+    class _MLP(nn.Module):
+        def __init__(self) -> None:
+            super().__init__()
+            self.encoder = nn.Sequential(
+                nn.Linear(input_dim, hidden_dim),
+                nn.ReLU(),
+                nn.Linear(hidden_dim, bottleneck),
+                nn.ReLU(),
+            )
+            self.decoder = nn.Sequential(
+                nn.Linear(bottleneck, hidden_dim),
+                nn.ReLU(),
+                nn.Linear(hidden_dim, input_dim),
+            )
+
+        def forward(self, x):  # type: ignore[override]
+            return self.decoder(self.encoder(x))
+
+    return _MLP()
 
 
 class AutoencoderModel:
@@ -37,11 +58,15 @@ class AutoencoderModel:
     Threshold is the 95th-percentile reconstruction error on training data.
     """
 
+    supervised = False
+
     def __init__(self) -> None:
-        self._net = _MLP()
+        # (W.T, b) per Linear layer, float32, ready for X @ W.T + b
+        self._layers: list[tuple[np.ndarray, np.ndarray]] | None = None
         self._threshold: float = 1.0
         self._scaler_mean: np.ndarray | None = None
         self._scaler_std: np.ndarray | None = None
+        self.reference: DriftReference | None = None  # training distribution, for drift
         self.is_fitted = False
         self.version = "1.0.0"
         self.name = "autoencoder"
@@ -52,63 +77,214 @@ class AutoencoderModel:
             return X
         return (X - self._scaler_mean) / (self._scaler_std + 1e-8)
 
+    def _reconstruct(self, X_norm: np.ndarray) -> np.ndarray:
+        (w1, b1), (w2, b2), (w3, b3), (w4, b4) = self._layers
+        h = np.maximum(X_norm @ w1 + b1, 0.0)
+        h = np.maximum(h @ w2 + b2, 0.0)
+        h = np.maximum(h @ w3 + b3, 0.0)
+        return h @ w4 + b4
+
     def _reconstruct_error(self, X_norm: np.ndarray) -> np.ndarray:
-        tensor = torch.tensor(X_norm, dtype=torch.float32)
-        with torch.no_grad():
-            out = self._net(tensor)
-        return ((tensor - out) ** 2).mean(dim=1).numpy()
+        return ((X_norm - self._reconstruct(X_norm)) ** 2).mean(axis=1)
+
+    def _set_weights(self, state: dict[str, np.ndarray]) -> None:
+        self._layers = [
+            (
+                np.ascontiguousarray(np.asarray(state[f"{layer}.weight"], dtype=np.float32).T),
+                np.asarray(state[f"{layer}.bias"], dtype=np.float32),
+            )
+            for layer in _LAYERS
+        ]
+
+    def _state_dict(self) -> dict[str, np.ndarray]:
+        state: dict[str, np.ndarray] = {}
+        for layer, (w_t, b) in zip(_LAYERS, self._layers):
+            state[f"{layer}.weight"] = np.ascontiguousarray(w_t.T)
+            state[f"{layer}.bias"] = b
+        return state
 
     # ------------------------------------------------------------------
-    def train_on_synthetic(self) -> None:
-        rng = np.random.default_rng(42)
+    @staticmethod
+    def synthetic_data(seed: int = 42, n: int = 5000) -> tuple[np.ndarray, None]:
+        rng = np.random.default_rng(seed)
         X = np.column_stack([
-            rng.normal(120, 40, 5000),
-            rng.normal(0, 0.5, 5000),
-            rng.poisson(1.5, 5000),
-            rng.normal(10, 5, 5000),
-            rng.normal(0.5, 0.15, 5000),
+            rng.normal(120, 40, n),
+            rng.normal(0, 0.5, n),
+            rng.poisson(1.5, n),
+            rng.normal(10, 5, n),
+            rng.normal(0.5, 0.15, n),
         ]).astype(np.float32)
-        self.train(X)
+        return X, None
+
+    def train_on_synthetic(self) -> None:
+        self.train(self.synthetic_data()[0])
 
     def train(self, X: np.ndarray) -> None:
+        import torch  # noqa: PLC0415
+        from torch.utils.data import DataLoader, TensorDataset  # noqa: PLC0415
+
         X = X.astype(np.float32)
         self._scaler_mean = X.mean(axis=0)
         self._scaler_std = X.std(axis=0) + 1e-8
         X_norm = self._normalize(X).astype(np.float32)
 
-        dataset = TensorDataset(torch.tensor(X_norm))
-        loader = DataLoader(dataset, batch_size=128, shuffle=True)
+        loader = DataLoader(TensorDataset(torch.tensor(X_norm)), batch_size=128, shuffle=True)
+        # 30 epochs — fast but effective
+        self._fit(lambda: (batch for (batch,) in loader), epochs=30)
+
+        # Set threshold at 95th percentile of training reconstruction errors
+        errors = self._reconstruct_error(X_norm)
+        self._threshold = float(np.percentile(errors, 95))
+        self.is_fitted = True
+        self.reference = fit_reference(self, X)
+
+    def train_from_log(self, reader: FeatureLogReader, chunk_rows: int = 65_536) -> int:
+        """
+        Train on the feature-log rows the ensemble did not flag, with chunked reads from
+        the memmapped segments: one pass for the scaler (merged per-chunk mean / M2),
+        then AE_LOG_EPOCHS passes of mini-batches shuffled within each chunk. The
+        threshold comes from a uniform sample, so memory stays bounded by the chunk
+        size. Flagged rows are left out throughout: the network should learn to
+        reconstruct normal traffic. Returns the rows used.
+        """
+        import torch  # noqa: PLC0415
 
-        optimizer = torch.optim.Adam(self._net.parameters(), lr=1e-3)
+        def unflagged():
+            for chunk in reader.iter_chunks(chunk_rows):
+                features = chunk["features"][chunk["is_fraud"] == 0]
+                if len(features):
+                    yield features
+
+        n, mean, m2 = 0, np.zeros(5), np.zeros(5)
+        for chunk in unflagged():
+            k = len(chunk)
+            c_mean = chunk.mean(axis=0)
+            delta = c_mean - mean
+            m2 += ((chunk - c_mean) ** 2).sum(axis=0) + delta ** 2 * n * k / (n + k)
+            mean += delta * k / (n + k)
+            n += k
+        if n == 0:
+            raise ValueError("feature log has no unflagged rows")
+        self._scaler_mean = mean.astype(np.float32)
+        self._scaler_std = (np.sqrt(m2 / n) + 1e-8).astype(np.float32)
+
+        rng = np.random.default_rng(42)
+
+        def batches():
+            for chunk in unflagged():
+                X_norm = self._normalize(chunk[rng.permutation(len(chunk))].astype(np.float32)).astype(np.float32)
+                for start in range(0, len(X_norm), 128):
+                    yield torch.from_numpy(X_norm[start:start + 128])
+
+        self._fit(batches, epochs=AE_LOG_EPOCHS)
+
+        sample = reader.sample(AE_THRESHOLD_SAMPLE)
+        sample = sample["features"][sample["is_fraud"] == 0].astype(np.float32)
+        errors = self._reconstruct_error(self._normalize(sample).astype(np.float32))
+        self._threshold = float(np.percentile(errors, 95))
+        self.is_fitted = True
+        self.reference = fit_reference(self, sample)
+        return n
+
+    def update(self, X: np.ndarray, y: np.ndarray | None = None, seed: int = 0) -> dict:
+        """
+        Incremental update: fine-tune the current weights for AE_FINETUNE_EPOCHS on X,
+        keeping the scaler so inputs stay on the scale the network learned. The
+        threshold is re-estimated on X. y is ignored.
+        """
+        import torch  # noqa: PLC0415
+
+        X_norm = self._normalize(np.asarray(X, dtype=np.float32)).astype(np.float32)
+        rng = np.random.default_rng(seed)
+
+        def batches():
+            shuffled = X_norm[rng.permutation(len(X_norm))]
+            for start in range(0, len(shuffled), 128):
+                yield torch.from_numpy(shuffled[start:start + 128])
+
+        self._fit(batches, epochs=AE_FINETUNE_EPOCHS, init=self._state_dict())
+        self._threshold = float(np.percentile(self._reconstruct_error(X_norm), 95))
+        self.is_fitted = True
+        self.reference = fit_reference(self, X)
+        return {"epochs": AE_FINETUNE_EPOCHS}
+
+    def _fit(self, epoch_batches, epochs: int, init: dict[str, np.ndarray] | None = None) -> None:
+        """
+        Train on the float32 batches yielded by epoch_batches() each epoch, starting
+        from init weights if given, else from a fresh network.
+        """
+        import torch  # noqa: PLC0415
+        import torch.nn as nn  # noqa: PLC0415
+
+        net = _build_mlp()
+        if init is not None:
+            net.load_state_dict({k: torch.from_numpy(np.array(v, dtype=np.float32)) for k, v in init.items()})
+        optimizer = torch.optim.Adam(net.parameters(), lr=1e-3)
         criterion = nn.MSELoss()
 
-        self._net.train()
-        for _ in range(30):  # 30 epochs — fast but effective
-            for (batch,) in loader:
+        net.train()
+        for _ in range(epochs):
+            for batch in epoch_batches():
                 optimizer.zero_grad()
-                out = self._net(batch)
+                out = net(batch)
                 loss = criterion(out, batch)
                 loss.backward()
                 optimizer.step()
 
-        # Set threshold at 95th percentile of training reconstruction errors
-        self._net.eval()
-        errors = self._reconstruct_error(X_norm)
-        self._threshold = float(np.percentile(errors, 95))
+        self._set_weights({k: v.detach().cpu().numpy() for k, v in net.state_dict().items()})
+
+    # ------------------------------------------------------------------
+    def save(self, directory: str) -> str:
+        """Persist network weights, scaler mean/std and threshold as a NumPy .npz, plus the drift reference; returns the artifact path."""
+        os.makedirs(directory, exist_ok=True)
+        path = artifact_path(directory, self.name, self.version, "npz")
+        tmp = path[: -len(".npz")] + ".tmp.npz"
+        weights = {f"net.{k}": v for k, v in self._state_dict().items()}
+        np.savez(
+            tmp,
+            scaler_mean=self._scaler_mean,
+            scaler_std=self._scaler_std,
+            threshold=np.float64(self._threshold),
+            **weights,
+        )
+        os.replace(tmp, path)
+        save_reference(path, self.reference)
+        return path
+
+    def load(self, path: str) -> None:
+        with np.load(path) as data:
+            self._set_weights({k[len("net."):]: data[k] for k in data.files if k.startswith("net.")})
+            self._scaler_mean = data["scaler_mean"]
+            self._scaler_std = data["scaler_std"]
+            self._threshold = float(data["threshold"])
+        self.reference = load_reference(path)
         self.is_fitted = True
 
     # ------------------------------------------------------------------
     def score(self, features: list[float]) -> float:
         """Return fraud probability in [0, 1] based on reconstruction error."""
+        return float(self.score_batch(np.array([features]))[0])
+
+    def score_batch(self, X: np.ndarray) -> np.ndarray:
+        """Return fraud probabilities in [0, 1] for an (N, 5) feature matrix."""
         if not self.is_fitted:
             self.train_on_synthetic()
 
-        X = np.array([features], dtype=np.float32)
+        X = np.asarray(X, dtype=np.float32)
         X_norm = self._normalize(X).astype(np.float32)
-        self._net.eval()
-        error = float(self._reconstruct_error(X_norm)[0])
+        errors = self._reconstruct_error(X_norm).astype(np.float64)
 
         # Sigmoid-like mapping: error relative to threshold
-        ratio = error / (self._threshold + 1e-8)
+        ratio = errors / (self._threshold + 1e-8)
         prob = 1.0 / (1.0 + np.exp(-4.0 * (ratio - 1.0)))
-        return float(np.clip(prob, 0.0, 1.0))
+        return np.clip(prob, 0.0, 1.0)
+
+    def feature_errors(self, X: np.ndarray) -> np.ndarray:
+        """
+        Per-feature squared reconstruction error (normalised space) for an (N, 5) matrix;
+        the row means are the reconstruction errors score_batch maps to a probability.
+        """
+        if not self.is_fitted:
+            self.train_on_synthetic()
+        X_norm = self._normalize(np.asarray(X, dtype=np.float32)).astype(np.float32)
+        return ((X_norm - self._reconstruct(X_norm)) ** 2).astype(np.float64)
@@ -0,0 +1,402 @@
+"""
+Offline backtesting: replay historical transactions through the serving
+FeatureEngineer + EnsembleModel, write per-transaction scores and report
+precision / recall over a range of thresholds.
+
+    python -m backtest history.csv --out scores.csv --report report.json
+    python -m backtest history.parquet --out scores.csv --workers 8 --weights xgboost=0.6,autoencoder=0.1
+
+Input columns are the /predict fields (userId, amount, location, deviceId,
+timestamp; transactionId optional) plus a label column (--label-column, isFraud
+by default: true/false or 1/0). Rows without a label are scored but left out of
+the metrics; rows that do not parse are skipped and counted. CSV is read with
+the standard library; Parquet needs pyarrow.
+
+Memory stays bounded however large the input is:
+
+1. The input is read --chunk-rows at a time. Each chunk is split by userId into
+   one partition per worker, sorted by timestamp and spilled to a run file.
+2. Each worker owns one partition (so all of a user's transactions go through
+   one FeatureEngineer) and replays it in timestamp order by merging its runs
+   lazily, --batch-rows at a time through scoring.score_records. Results go to
+   a partition file, and labelled scores are counted into fixed bins (fraud
+   scores carry 4 decimals, so SCORE_BINS bins are exact).
+3. The partition files are merged by timestamp into --out, and the bins are
+   summed into the report.
+
+Only per-user feature state grows with the input; FEATURE_MAX_USERS caps it as
+in serving. Idle-user eviction runs on event time rather than wall time. Models
+come from the registry as in serving. Nothing is written to the feature log or
+feature state.
+
+    BACKTEST_WORKERS     worker processes (default: CPUs)
+    BACKTEST_CHUNK_ROWS  rows read and spilled at a time (default 50000)
+    BACKTEST_BATCH_ROWS  rows scored per predict_batch call (default 2048)
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import heapq
+import json
+import logging
+import multiprocessing as mp
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from typing import Any, Iterable, Iterator, Sequence
+
+import numpy as np
+
+from feature_log import user_hash
+
+logger = logging.getLogger(__name__)
+
+BACKTEST_WORKERS = int(os.getenv("BACKTEST_WORKERS", str(os.cpu_count() or 1)))
+BACKTEST_CHUNK_ROWS = int(os.getenv("BACKTEST_CHUNK_ROWS", "50000"))
+BACKTEST_BATCH_ROWS = int(os.getenv("BACKTEST_BATCH_ROWS", "2048"))
+
+SCORE_BINS = 10_001  # fraudScore is rounded to 4 decimals
+MAX_OPEN_RUNS = 256  # runs merged at once; more are merged in rounds first
+DEFAULT_THRESHOLDS = tuple(round(0.05 * i, 2) for i in range(1, 20))
+OUTPUT_COLUMNS = (
+    "row", "transactionId", "userId", "timestamp", "amount", "fraudScore", "isFraud", "label",
+    "isolation_forest", "xgboost", "autoencoder",
+)
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+_TRUE = {"1", "true", "t", "yes", "y"}
+_FALSE = {"0", "false", "f", "no", "n"}
+
+# Spilled rows: ts_us, row, userId, amount, location, deviceId, timestamp, transactionId, label ("1" / "0" / "")
+SpillRow = list[str]
+
+
+# ── Input ────────────────────────────────────────────────────────────────────
+def read_chunks(path: str, chunk_rows: int = BACKTEST_CHUNK_ROWS) -> Iterator[list[dict[str, Any]]]:
+    """Input rows as dicts, chunk_rows at a time (CSV, or Parquet by extension)."""
+    if path.endswith((".parquet", ".pq")):
+        try:
+            import pyarrow.parquet as pq  # noqa: PLC0415
+        except ImportError as exc:
+            raise RuntimeError("reading Parquet needs pyarrow (pip install pyarrow)") from exc
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+            yield batch.to_pylist()
+        return
+    with open(path, newline="") as f:
+        reader = csv.DictReader(f)
+        while chunk := list(islice(reader, chunk_rows)):
+            yield chunk
+
+
+def _parse_timestamp(value: Any) -> datetime:
+    ts = value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
+    return ts if ts.tzinfo is not None else ts.replace(tzinfo=timezone.utc)
+
+
+def _parse_label(value: Any) -> str:
+    if value is None or value == "":
+        return ""
+    if isinstance(value, (bool, int, float)):
+        return "1" if value else "0"
+    text = str(value).strip().lower()
+    return "1" if text in _TRUE else "0" if text in _FALSE else ""
+
+
+def _spill_row(row: dict[str, Any], row_no: int, label_column: str) -> SpillRow:
+    ts = _parse_timestamp(row["timestamp"])
+    user_id, location, device_id = str(row["userId"]), str(row["location"]), str(row["deviceId"])
+    amount = float(row["amount"])
+    if not user_id or not location or not device_id or not amount > 0:
+        raise ValueError("empty userId / location / deviceId or non-positive amount")
+    tx_id = row.get("transactionId")
+    return [
+        str((ts - _EPOCH) // _MICROSECOND), str(row_no), user_id, repr(amount), location, device_id, ts.isoformat(),
+        "" if tx_id is None else str(tx_id), _parse_label(row.get(label_column)),
+    ]
+
+
+def _sort_key(row: SpillRow) -> tuple[int, int]:
+    return int(row[0]), int(row[1])
+
+
+def spill(
+    chunks: Iterable[list[dict[str, Any]]], n_parts: int, directory: str, label_column: str = "isFraud",
+) -> tuple[list[list[str]], int, int]:
+    """Split chunks by user into n_parts partitions of timestamp-sorted run files. Returns (runs, rows, skipped)."""
+    runs: list[list[str]] = [[] for _ in range(n_parts)]
+    row_no = skipped = 0
+    for chunk_no, chunk in enumerate(chunks):
+        parts: list[list[SpillRow]] = [[] for _ in range(n_parts)]
+        for row in chunk:
+            row_no += 1
+            try:
+                spilled = _spill_row(row, row_no, label_column)
+            except (KeyError, TypeError, ValueError) as exc:
+                if not skipped:
+                    logger.warning("Skipping row %d: %r", row_no, exc)
+                skipped += 1
+                continue
+            parts[user_hash(spilled[2]) % n_parts].append(spilled)
+        for part, rows in enumerate(parts):
+            if not rows:
+                continue
+            rows.sort(key=_sort_key)
+            path = os.path.join(directory, f"p{part}-r{chunk_no:06d}.csv")
+            with open(path, "w", newline="") as f:
+                csv.writer(f).writerows(rows)
+            runs[part].append(path)
+    return runs, row_no - skipped, skipped
+
+
+def _merged(paths: Sequence[str], files: list) -> Iterator[SpillRow]:
+    for path in paths:
+        files.append(open(path, newline=""))
+    return heapq.merge(*(csv.reader(f) for f in files), key=_sort_key)
+
+
+def _merge_into(paths: Sequence[str], dest: str) -> None:
+    files: list = []
+    try:
+        with open(dest, "w", newline="") as out:
+            csv.writer(out).writerows(_merged(paths, files))
+    finally:
+        for f in files:
+            f.close()
+
+
+def _compact_runs(runs: list[str], directory: str, tag: str) -> list[str]:
+    """Merge runs in rounds until at most MAX_OPEN_RUNS remain, so open files stay bounded too."""
+    level = 0
+    while len(runs) > MAX_OPEN_RUNS:
+        merged = []
+        for start in range(0, len(runs), MAX_OPEN_RUNS):
+            dest = os.path.join(directory, f"{tag}-m{level}-{start // MAX_OPEN_RUNS:06d}.csv")
+            _merge_into(runs[start:start + MAX_OPEN_RUNS], dest)
+            merged.append(dest)
+        for path in runs:
+            os.remove(path)
+        runs, level = merged, level + 1
+    return runs
+
+
+# ── Workers ──────────────────────────────────────────────────────────────────
+def _init_worker() -> None:
+    # One core per worker: keep BLAS / OpenMP from oversubscribing
+    for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ.setdefault(var, "1")
+
+
+def replay_partition(
+    part: int,
+    runs: list[str],
+    directory: str,
+    batch_rows: int = BACKTEST_BATCH_ROWS,
+    weights: dict[str, float] | None = None,
+    threshold: float | None = None,
+) -> dict:
+    """Score one partition in timestamp order with a fresh FeatureEngineer; returns its output file and bins."""
+    from ensemble import MODEL_NAMES, EnsembleModel  # noqa: PLC0415
+    from features import FeatureEngineer  # noqa: PLC0415
+    from registry import ModelRegistry  # noqa: PLC0415
+    from scoring import score_records  # noqa: PLC0415
+
+    started = time.perf_counter()
+    ensemble = EnsembleModel(ModelRegistry())
+    ensemble.load_or_train()
+    if weights or threshold is not None:
+        ensemble.configure(weights, threshold)
+    event_time = [0.0]
+    feature_engineer = FeatureEngineer(clock=lambda: event_time[0])
+
+    positives = np.zeros(SCORE_BINS, dtype=np.int64)
+    negatives = np.zeros(SCORE_BINS, dtype=np.int64)
+    rows = 0
+    out_path = os.path.join(directory, f"scores-p{part}.csv")
+    files: list = []
+    try:
+        merged = _merged(_compact_runs(runs, directory, f"p{part}"), files)
+        with open(out_path, "w", newline="") as out:
+            writer = csv.writer(out)
+            while batch := list(islice(merged, batch_rows)):
+                records = [(r[2], float(r[3]), r[4], r[5], _parse_timestamp(r[6])) for r in batch]
+                event_time[0] = int(batch[-1][0]) / 1e6
+                responses = score_records(feature_engineer, ensemble, records, time_ordered=False)
+                # Timestamps are all aware here, so a row that failed to build is a bug: stop, don't skip it
+                failed = next((r for r in responses if isinstance(r, Exception)), None)
+                if failed is not None:
+                    raise failed
+                writer.writerows(
+                    [
+                        r[0], r[1], r[7], r[2], r[6], r[3], response["fraudScore"], int(response["isFraud"]), r[8],
+                        *(response["modelScores"].get(name, "") for name in MODEL_NAMES),
+                    ]
+                    for r, response in zip(batch, responses)
+                )
+                bins = np.rint(np.array([resp["fraudScore"] for resp in responses]) * (SCORE_BINS - 1)).astype(np.int64)
+                labels = np.array([r[8] for r in batch])
+                positives += np.bincount(bins[labels == "1"], minlength=SCORE_BINS)
+                negatives += np.bincount(bins[labels == "0"], minlength=SCORE_BINS)
+                rows += len(batch)
+    finally:
+        for f in files:
+            f.close()
+    return {
+        "part": part, "path": out_path, "rows": rows, "positives": positives, "negatives": negatives,
+        "threshold": ensemble.snapshot().threshold, "users": len(feature_engineer.state), "seconds": round(time.perf_counter() - started, 3),
+    }
+
+
+# ── Metrics ──────────────────────────────────────────────────────────────────
+def threshold_metrics(positives: np.ndarray, negatives: np.ndarray, thresholds: Sequence[float]) -> list[dict]:
+    """Confusion counts, precision, recall and F1 when flagging fraudScore >= each threshold."""
+    # Labelled rows scoring at or above each bin
+    tp_at = np.cumsum(positives[::-1])[::-1]
+    fp_at = np.cumsum(negatives[::-1])[::-1]
+    n_pos, n_neg = int(positives.sum()), int(negatives.sum())
+    out = []
+    for threshold in thresholds:
+        b = min(max(int(round(threshold * (SCORE_BINS - 1))), 0), SCORE_BINS - 1)
+        tp, fp = int(tp_at[b]), int(fp_at[b])
+        precision = tp / (tp + fp) if tp + fp else 0.0
+        recall = tp / n_pos if n_pos else 0.0
+        f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+        out.append({
+            "threshold": threshold, "flagged": tp + fp, "tp": tp, "fp": fp, "fn": n_pos - tp, "tn": n_neg - fp,
+            "precision": round(precision, 4), "recall": round(recall, 4), "f1": round(f1, 4),
+        })
+    return out
+
+
+def best_f1(positives: np.ndarray, negatives: np.ndarray) -> dict | None:
+    """The threshold (on the 4-decimal score grid) with the highest F1."""
+    if not positives.sum():
+        return None
+    tp = np.cumsum(positives[::-1])[::-1].astype(np.float64)
+    flagged = tp + np.cumsum(negatives[::-1])[::-1]
+    f1 = np.divide(2 * tp, flagged + positives.sum(), out=np.zeros_like(tp), where=flagged > 0)
+    return threshold_metrics(positives, negatives, [round(int(np.argmax(f1)) / (SCORE_BINS - 1), 4)])[0]
+
+
+# ── Driver ───────────────────────────────────────────────────────────────────
+def run_backtest(
+    path: str,
+    out: str,
+    workers: int = BACKTEST_WORKERS,
+    chunk_rows: int = BACKTEST_CHUNK_ROWS,
+    batch_rows: int = BACKTEST_BATCH_ROWS,
+    thresholds: Sequence[float] = DEFAULT_THRESHOLDS,
+    weights: dict[str, float] | None = None,
+    threshold: float | None = None,
+    label_column: str = "isFraud",
+    tmp_dir: str | None = None,
+) -> dict:
+    started = time.perf_counter()
+    workers = max(1, workers)
+    scratch = tempfile.mkdtemp(prefix="backtest-", dir=tmp_dir)
+    try:
+        runs, rows, skipped = spill(read_chunks(path, chunk_rows), workers, scratch, label_column)
+        spilled_at = time.perf_counter()
+        jobs = [(part, part_runs, scratch, batch_rows, weights, threshold) for part, part_runs in enumerate(runs)]
+        if workers == 1:
+            # One core: spawning a process and importing the models again would only add time
+            results = [replay_partition(*job) for job in jobs]
+        else:
+            with ProcessPoolExecutor(
+                max_workers=workers, mp_context=mp.get_context("spawn"), initializer=_init_worker,
+            ) as pool:
+                results = list(pool.map(replay_partition, *zip(*jobs)))
+        scored_at = time.perf_counter()
+
+        files: list = []
+        try:
+            with open(out, "w", newline="") as f:
+                writer = csv.writer(f)
+                writer.writerow(OUTPUT_COLUMNS)
+                writer.writerows(r[1:] for r in _merged([res["path"] for res in results], files))
+        finally:
+            for f in files:
+                f.close()
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    positives = sum(res["positives"] for res in results)
+    negatives = sum(res["negatives"] for res in results)
+    # The threshold the workers scored with: --threshold, or FRAUD_THRESHOLD
+    threshold = results[0]["threshold"]
+    sweep = sorted({*thresholds, threshold})
+    elapsed = time.perf_counter() - started
+    return {
+        "input": path,
+        "output": out,
+        "rows": rows,
+        "skipped": skipped,
+        "labelled": int(positives.sum() + negatives.sum()),
+        "positives": int(positives.sum()),
+        "weights": weights,
+        "threshold": threshold,
+        "atThreshold": threshold_metrics(positives, negatives, [threshold])[0],
+        "bestF1": best_f1(positives, negatives),
+        "thresholds": threshold_metrics(positives, negatives, sweep),
+        "workers": workers,
+        "partitions": [{k: res[k] for k in ("part", "rows", "users", "seconds")} for res in results],
+        "seconds": {
+            "spill": round(spilled_at - started, 3),
+            "score": round(scored_at - spilled_at, 3),
+            "total": round(elapsed, 3),
+        },
+        "rowsPerSecond": round(rows / elapsed, 1) if elapsed > 0 else 0.0,
+    }
+
+
+def _parse_weights(text: str | None) -> dict[str, float] | None:
+    if not text:
+        return None
+    weights = {}
+    for item in text.split(","):
+        name, _, value = item.partition("=")
+        weights[name.strip()] = float(value)
+    return weights
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="CSV or Parquet (.parquet / .pq) file of transactions")
+    parser.add_argument("--out", required=True, help="per-transaction scores (CSV), in timestamp order")
+    parser.add_argument("--report", help="also write the JSON report here")
+    parser.add_argument("--workers", type=int, default=BACKTEST_WORKERS)
+    parser.add_argument("--chunk-rows", type=int, default=BACKTEST_CHUNK_ROWS)
+    parser.add_argument("--batch-rows", type=int, default=BACKTEST_BATCH_ROWS)
+    parser.add_argument(
+        "--thresholds", default=",".join(map(str, DEFAULT_THRESHOLDS)), help="comma-separated thresholds to report",
+    )
+    parser.add_argument("--weights", help="model weights to try, e.g. xgboost=0.6,autoencoder=0.1")
+    parser.add_argument("--threshold", type=float, help="decision threshold to try (default: FRAUD_THRESHOLD)")
+    parser.add_argument("--label-column", default="isFraud")
+    parser.add_argument("--tmp-dir", help="where to spill runs (default: the system temp dir)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(levelname)s %(name)s: %(message)s")
+    report = run_backtest(
+        args.input, args.out,
+        workers=args.workers, chunk_rows=args.chunk_rows, batch_rows=args.batch_rows,
+        thresholds=[float(t) for t in args.thresholds.split(",") if t],
+        weights=_parse_weights(args.weights), threshold=args.threshold,
+        label_column=args.label_column, tmp_dir=args.tmp_dir,
+    )
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.report:
+        with open(args.report, "w") as f:
+            f.write(text + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+"""
+Micro-batching in front of EnsembleModel.
+
+Concurrent /predict calls are collected on the event loop for up to
+MICROBATCH_MAX_WAIT_MS, or until MICROBATCH_MAX_SIZE requests are waiting, and
+then scored as one matrix per model. Batches run one at a time on a single
+worker thread in the order they were formed, so per-user feature state is
+updated in request arrival order — the same order a one-request-at-a-time
+server would see. Under load the worker stays busy and batches grow on their
+own; when idle a request waits at most the window.
+
+process may return an exception in place of an item's result: only that
+caller's request fails, and the rest of the batch is answered normally.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Generic, TypeVar
+
+from prometheus_client import Histogram
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+MICROBATCH_ENABLED = os.getenv("MICROBATCH_ENABLED", "1").lower() in ("1", "true", "yes")
+MICROBATCH_MAX_SIZE = int(os.getenv("MICROBATCH_MAX_SIZE", "64"))
+MICROBATCH_MAX_WAIT_MS = float(os.getenv("MICROBATCH_MAX_WAIT_MS", "2"))
+
+
+class MicroBatcher(Generic[T, R]):
+    def __init__(
+        self,
+        process: Callable[[list[T]], list[R | BaseException]],
+        max_size: int = MICROBATCH_MAX_SIZE,
+        max_wait_ms: float = MICROBATCH_MAX_WAIT_MS,
+        batch_size_hist: Histogram | None = None,
+        queue_wait_hist: Histogram | None = None,
+    ) -> None:
+        self._process = process
+        self._max_size = max(1, max_size)
+        self._max_wait_s = max(0.0, max_wait_ms) / 1000.0
+        self._batch_size_hist = batch_size_hist
+        self._queue_wait_hist = queue_wait_hist
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="microbatch")
+        self._pending: list[tuple[T, asyncio.Future, float]] = []
+        self._timer: asyncio.TimerHandle | None = None
+
+    # ------------------------------------------------------------------
+    async def submit(self, item: T) -> R:
+        loop = asyncio.get_running_loop()
+        future: asyncio.Future = loop.create_future()
+        self._pending.append((item, future, time.perf_counter()))
+        if len(self._pending) >= self._max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self._max_wait_s, self._flush)
+        return await future
+
+    def run_exclusive(self, fn: Callable[[], R]) -> "asyncio.Future[R]":
+        """Run fn on the batch worker thread, serialised with the micro-batches."""
+        return asyncio.get_running_loop().run_in_executor(self._executor, fn)
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        asyncio.get_running_loop().create_task(self._run(batch))
+
+    async def _run(self, batch: list[tuple[T, asyncio.Future, float]]) -> None:
+        items = [item for item, _, _ in batch]
+
+        def work() -> list[R]:
+            started = time.perf_counter()
+            if self._queue_wait_hist is not None:
+                for _, _, enqueued in batch:
+                    self._queue_wait_hist.observe(started - enqueued)
+            if self._batch_size_hist is not None:
+                self._batch_size_hist.observe(len(items))
+            return self._process(items)
+
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(self._executor, work)
+        except Exception as exc:  # noqa: BLE001
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        for (_, future, _), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, BaseException):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
@@ -0,0 +1,4 @@
+"""
+Benchmarks for the ML service. Run from ml-service/, e.g. `python -m benchmarks.bench_isolation_forest`,
+or the whole suite with a baseline check: `python -m benchmarks.suite`.
+"""
@@ -0,0 +1,60 @@
+"""
+Single-row latency of each model's score(), EnsembleModel.predict, and per-row
+cost of EnsembleModel.predict_batch on 64 rows.
+
+    python -m benchmarks.bench_ensemble [--quick]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+
+import numpy as np
+
+from benchmarks.harness import peak_rss_mb, summarize, time_calls
+from ensemble import EnsembleModel
+from registry import ModelRegistry
+from xgboost_model import XGBoostModel
+
+BATCH = 64
+
+
+def run(quick: bool = False) -> dict:
+    repeat = 300 if quick else 3_000
+    ensemble = EnsembleModel(ModelRegistry())
+    ensemble.load_or_train()
+    snap = ensemble.snapshot()
+
+    X, _ = XGBoostModel._generate_synthetic_data()
+    X = X[np.random.default_rng(0).permutation(len(X))]
+    rows = [list(map(float, row)) for row in X[:512]]
+    cursor = iter(range(10**9))
+
+    def next_row() -> list[float]:
+        return rows[next(cursor) % len(rows)]
+
+    results: dict = {}
+    for name, model in snap.models():
+        results[f"score_{name}"] = summarize(time_calls(lambda m=model: m.score(next_row()), repeat))
+    results["ensemble_predict"] = summarize(
+        time_calls(lambda: ensemble.predict(next_row(), location="NYC", device_id="device-1"), repeat),
+    )
+    batch = X[:BATCH]
+    locations, devices = ["NYC"] * BATCH, ["device-1"] * BATCH
+    results[f"ensemble_predict_batch_{BATCH}"] = summarize(
+        time_calls(lambda: ensemble.predict_batch(batch, locations, devices), max(20, repeat // 10)),
+        items_per_call=BATCH,
+    )
+    results["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--quick", action="store_true")
+    args = parser.parse_args()
+    print(json.dumps(run(args.quick), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Latency of FeatureEngineer.build for a user with a growing transaction history.
+
+    python -m benchmarks.bench_features [--quick]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+from datetime import datetime, timedelta, timezone
+
+from benchmarks.harness import peak_rss_mb, summarize, time_calls
+from features import FeatureEngineer
+
+HISTORY_SIZES = (10, 1_000, 20_000)
+
+
+def run(quick: bool = False) -> dict:
+    repeat = 500 if quick else 5_000
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    results: dict = {}
+    for history in HISTORY_SIZES:
+        fe = FeatureEngineer()
+        # 0.1 s apart, so the whole history sits inside the 1-hour velocity window
+        for i in range(history):
+            fe.build("bench-user", 100.0 + i % 50, "NYC", f"device-{i % 3}", start + timedelta(seconds=0.1 * i))
+
+        ticks = iter(range(history, history + repeat + 100))
+
+        def call() -> None:
+            i = next(ticks)
+            fe.build("bench-user", 100.0 + i % 50, "NYC", f"device-{i % 3}", start + timedelta(seconds=0.1 * i))
+
+        results[f"history_{history}"] = summarize(time_calls(call, repeat))
+    results["peak_rss_mb"] = peak_rss_mb()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--quick", action="store_true")
+    args = parser.parse_args()
+    print(json.dumps(run(args.quick), indent=2))
+
+
+if __name__ == "__main__":
+    main()
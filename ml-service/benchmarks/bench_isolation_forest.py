@@ -0,0 +1,55 @@
+"""
+Per-row latency of IsolationForestModel scoring: sklearn decision_function vs CompiledForest.
+
+    python -m benchmarks.bench_isolation_forest [--repeat 200]
+"""
+from __future__ import annotations
+
+import argparse
+import time
+
+import numpy as np
+
+from isolation_forest_model import CompiledForest, IsolationForestModel
+
+
+def _per_row_us(fn, X: np.ndarray, repeat: int) -> float:
+    fn(X)  # warm-up
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn(X)
+    return (time.perf_counter() - started) / (repeat * len(X)) * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    model = IsolationForestModel()
+    model.train_on_synthetic()
+    clf = model._clf
+    compiled = CompiledForest(clf)
+
+    rng = np.random.default_rng(0)
+    X = np.column_stack([
+        rng.normal(150, 120, 4096),
+        rng.normal(0, 2, 4096),
+        rng.poisson(3, 4096),
+        rng.normal(500, 1500, 4096),
+        rng.normal(0.9, 0.5, 4096),
+    ])
+
+    max_diff = float(np.max(np.abs(clf.decision_function(X) - compiled.decision_function(X))))
+    print(f"max |decision diff| over {len(X)} rows: {max_diff:.3e}")
+    print(f"{'batch':>6} {'sklearn us/row':>15} {'compiled us/row':>16} {'speedup':>8}")
+    for batch in (1, 16, 256, 4096):
+        rows = X[:batch]
+        repeat = max(1, args.repeat // batch) if batch > 1 else args.repeat
+        before = _per_row_us(clf.decision_function, rows, repeat)
+        after = _per_row_us(compiled.decision_function, rows, max(repeat, 10))
+        print(f"{batch:>6} {before:>15.1f} {after:>16.2f} {before / after:>7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Per-row latency of XGBoostModel scoring: XGBClassifier.predict_proba vs
+Booster.inplace_predict vs the NumPy CompiledBooster.
+
+    python -m benchmarks.bench_xgboost [--repeat 500]
+"""
+from __future__ import annotations
+
+import argparse
+import time
+
+import numpy as np
+
+from xgboost_model import CompiledBooster, XGBoostModel
+
+
+def _per_row_us(fn, X: np.ndarray, repeat: int) -> float:
+    fn(X)  # warm-up
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn(X)
+    return (time.perf_counter() - started) / (repeat * len(X)) * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeat", type=int, default=500)
+    args = parser.parse_args()
+
+    model = XGBoostModel()
+    model.train_on_synthetic()
+    clf = model._clf
+    booster = clf.get_booster()
+    compiled = CompiledBooster(booster)
+
+    X, _ = XGBoostModel._generate_synthetic_data()
+    X = X[np.random.default_rng(0).permutation(len(X))][:4096]
+
+    reference = clf.predict_proba(X)[:, 1]
+    print(f"max |prob diff| inplace_predict: {np.max(np.abs(booster.inplace_predict(X.astype(np.float32)) - reference)):.3e}")
+    print(f"max |prob diff| numpy walker:    {np.max(np.abs(compiled.predict_proba(X) - reference)):.3e}")
+
+    engines = {
+        "predict_proba": lambda rows: clf.predict_proba(rows)[:, 1],
+        "inplace": lambda rows: booster.inplace_predict(model._float32_rows(rows)),
+        "numpy": compiled.predict_proba,
+    }
+    print(f"{'batch':>6} " + " ".join(f"{name + ' us/row':>20}" for name in engines))
+    for batch in (1, 16, 256, 4096):
+        rows = X[:batch]
+        repeat = max(3, args.repeat // batch)
+        timings = [_per_row_us(fn, rows, repeat) for fn in engines.values()]
+        print(f"{batch:>6} " + " ".join(f"{t:>20.2f}" for t in timings))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Shared helpers for the benchmark suite: timing, latency summaries, peak RSS,
+and comparison of a results file against a stored baseline.
+"""
+from __future__ import annotations
+
+import resource
+import sys
+import time
+from typing import Callable
+
+import numpy as np
+
+
+def time_calls(fn: Callable[[], object], repeat: int, warmup: int = 10) -> np.ndarray:
+    """Per-call wall time in seconds for repeat calls of fn (after warmup untimed calls)."""
+    for _ in range(warmup):
+        fn()
+    out = np.empty(repeat, dtype=np.float64)
+    clock = time.perf_counter
+    for i in range(repeat):
+        started = clock()
+        fn()
+        out[i] = clock() - started
+    return out
+
+
+def summarize(latencies_s: np.ndarray, items_per_call: int = 1, wall_s: float | None = None) -> dict[str, float]:
+    """
+    Throughput and latency percentiles. Throughput is items / wall time when wall_s is
+    given (concurrent load), else items / summed call time (sequential microbenchmarks).
+    """
+    latencies_s = np.asarray(latencies_s, dtype=np.float64)
+    elapsed = wall_s if wall_s is not None else float(latencies_s.sum())
+    p50, p95, p99 = np.percentile(latencies_s, [50, 95, 99]) * 1e6
+    return {
+        "ops_per_s": round(len(latencies_s) * items_per_call / elapsed, 1),
+        "p50_us": round(float(p50), 2),
+        "p95_us": round(float(p95), 2),
+        "p99_us": round(float(p99), 2),
+    }
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far (ru_maxrss is KiB on Linux, bytes on macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+# ── Baseline comparison ──────────────────────────────────────────────────────
+def flatten(results: dict, prefix: str = "") -> dict[str, float]:
+    flat: dict[str, float] = {}
+    for key, value in results.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = float(value)
+    return flat
+
+
+def higher_is_better(metric: str) -> bool:
+    return metric.endswith("ops_per_s")
+
+
+def compare(
+    current: dict,
+    baseline: dict,
+    threshold: float,
+    tail_threshold: float | None = None,
+    min_delta_us: float = 0.0,
+) -> list[dict]:
+    """
+    Metrics present in both result sets that got worse by more than threshold
+    (a fraction: 0.2 = 20%). Throughput must not drop, latencies and RSS must not grow.
+    p95 / p99 latencies use tail_threshold (defaults to threshold), since tails of
+    microsecond-scale calls are dominated by scheduler noise, and latency changes
+    smaller than min_delta_us are ignored for the same reason.
+    """
+    cur, base = flatten(current), flatten(baseline)
+    tail_threshold = threshold if tail_threshold is None else tail_threshold
+    regressions = []
+    for name in sorted(cur.keys() & base.keys()):
+        old, new = base[name], cur[name]
+        if old <= 0:
+            continue
+        if name.endswith("_us") and abs(new - old) < min_delta_us:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better(name) else change
+        limit = tail_threshold if name.endswith(("p95_us", "p99_us")) else threshold
+        if worse > limit:
+            regressions.append({"metric": name, "baseline": old, "current": new, "change": round(change, 4)})
+    return regressions
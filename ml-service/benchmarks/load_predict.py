@@ -0,0 +1,74 @@
+"""
+In-process load test of POST /predict: the FastAPI app is driven over ASGI by
+CONCURRENCY concurrent clients replaying a seeded transaction stream
+(benchmarks.workload), so micro-batching, validation and routing are all on
+the measured path, but no network is.
+
+    python -m benchmarks.load_predict [--quick] [--requests N] [--concurrency C]
+
+Imports main, so models load from (or train into) MODEL_ARTIFACT_DIR. The
+suite runner points that, the feature log and the feature state at a scratch
+directory.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+import numpy as np
+
+from benchmarks.harness import peak_rss_mb, summarize
+from benchmarks.workload import transaction_stream
+
+WARMUP = 200
+
+
+async def _drive(app, payloads: list[dict], concurrency: int) -> tuple[np.ndarray, float, int]:
+    latencies = np.empty(len(payloads), dtype=np.float64)
+    errors = 0
+    next_index = iter(range(len(payloads)))
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        async def worker() -> None:
+            nonlocal errors
+            for i in next_index:
+                started = time.perf_counter()
+                response = await client.post("/predict", json=payloads[i])
+                latencies[i] = time.perf_counter() - started
+                if response.status_code != 200:
+                    errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        wall = time.perf_counter() - started
+    return latencies, wall, errors
+
+
+def run(quick: bool = False, requests: int | None = None, concurrency: int = 32, seed: int = 7) -> dict:
+    import main  # noqa: PLC0415 — starts the service (loads or trains models)
+
+    main.startup_finished.wait()
+    if not main.models_ready.is_set():
+        raise RuntimeError("service did not become ready")
+    n = requests or (2_000 if quick else 20_000)
+    payloads = transaction_stream(n + WARMUP, seed=seed)
+    asyncio.run(_drive(main.app, payloads[:WARMUP], concurrency))
+    latencies, wall, errors = asyncio.run(_drive(main.app, payloads[WARMUP:], concurrency))
+
+    return {"predict": summarize(latencies, wall_s=wall), "errors": errors, "peak_rss_mb": peak_rss_mb()}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--quick", action="store_true")
+    parser.add_argument("--requests", type=int, default=None)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+    print(json.dumps(run(args.quick, args.requests, args.concurrency), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+In-process load test of POST /predict/stream: STREAMS concurrent NDJSON streams
+replay a seeded transaction stream (benchmarks.workload), partitioned by user,
+each sending CHUNK lines per body chunk. Reports events scored per second of wall time; compare
+with the load suite's /predict figure for the request-per-event cost.
+
+    python -m benchmarks.load_stream [--quick] [--events N] [--streams S] [--chunk C]
+
+httpx's ASGI transport hands back the response once the stream has finished,
+so only throughput is meaningful here, not per-event latency. Imports main,
+like benchmarks.load_predict.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import time
+import zlib
+from datetime import datetime, timezone
+
+import httpx
+
+from benchmarks.harness import peak_rss_mb
+from benchmarks.workload import transaction_stream
+
+WARMUP = 200
+# After the load suite's stream: it shares the feature state, and replaying its timestamps would all be out of order
+START = datetime(2026, 1, 2, tzinfo=timezone.utc)
+
+
+async def _body(payloads: list[dict], chunk: int):
+    for start in range(0, len(payloads), chunk):
+        yield "".join(json.dumps(p) + "\n" for p in payloads[start:start + chunk]).encode()
+
+
+async def _drive(app, payloads: list[dict], streams: int, chunk: int) -> tuple[float, int, int]:
+    # Partitioned by user, like a keyed topic: each user's events stay in order on one stream
+    parts: list[list[dict]] = [[] for _ in range(streams)]
+    for payload in payloads:
+        parts[zlib.crc32(payload["userId"].encode()) % streams].append(payload)
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=None,
+    ) as client:
+        async def one(part: list[dict]) -> tuple[int, int]:
+            response = await client.post(
+                "/predict/stream", content=_body(part, chunk), headers={"content-type": "application/x-ndjson"},
+            )
+            lines = response.text.splitlines()
+            errors = sum(1 for line in lines if line.startswith('{"error"') or line.startswith('{"line"'))
+            return len(lines), errors + (len(part) - len(lines)) + (response.status_code != 200)
+
+        started = time.perf_counter()
+        counts = await asyncio.gather(*(one(part) for part in parts))
+        wall = time.perf_counter() - started
+    return wall, sum(c[0] for c in counts), sum(c[1] for c in counts)
+
+
+def run(quick: bool = False, events: int | None = None, streams: int = 4, chunk: int = 64, seed: int = 7) -> dict:
+    import main  # noqa: PLC0415 — starts the service (loads or trains models)
+
+    main.startup_finished.wait()
+    if not main.models_ready.is_set():
+        raise RuntimeError("service did not become ready")
+    n = events or (5_000 if quick else 50_000)
+    payloads = transaction_stream(n + WARMUP, seed=seed, start=START)
+    asyncio.run(_drive(main.app, payloads[:WARMUP], streams, chunk))
+    wall, scored, errors = asyncio.run(_drive(main.app, payloads[WARMUP:], streams, chunk))
+
+    return {"stream": {"ops_per_s": round(scored / wall, 1)}, "errors": errors, "peak_rss_mb": peak_rss_mb()}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--quick", action="store_true")
+    parser.add_argument("--events", type=int, default=None)
+    parser.add_argument("--streams", type=int, default=4)
+    parser.add_argument("--chunk", type=int, default=64)
+    args = parser.parse_args()
+    print(json.dumps(run(args.quick, args.events, args.streams, args.chunk), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Cold start: how long a fresh service process takes to answer /health, to report
+/ready, and to return its first /predict response, measured from just before
+the interpreter is launched. Each run is a new process, so imports and model
+loading are paid in full; the median of several runs is reported.
+
+    python -m benchmarks.startup [--quick] [--runs N]
+
+Imports main, so models load from (or train into) MODEL_ARTIFACT_DIR. The suite
+runner points that at a scratch directory where the models are already trained,
+so this measures the load path a restarted pod takes.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from benchmarks.workload import transaction_stream
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def _first_responses(app, payload: dict, launched_at: float) -> dict[str, float]:
+    import httpx  # noqa: PLC0415
+
+    out: dict[str, float] = {}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        for path, key in (("/health", "time_to_health_ms"), ("/ready", "time_to_ready_ms")):
+            while (await client.get(path)).status_code != 200:
+                await asyncio.sleep(0.002)
+            out[key] = round((time.time() - launched_at) * 1000.0, 1)
+        response = await client.post("/predict", json=payload)
+        response.raise_for_status()
+        out["time_to_first_prediction_ms"] = round((time.time() - launched_at) * 1000.0, 1)
+    return out
+
+
+def _child() -> None:
+    launched_at = float(os.environ["BENCH_LAUNCHED_AT"])
+    import main  # noqa: PLC0415 — the measured part: imports, then models loading in the background
+
+    payload = transaction_stream(1, seed=11)[0]
+    print(json.dumps(asyncio.run(_first_responses(main.app, payload, launched_at))))
+
+
+def _launch() -> dict[str, float]:
+    env = dict(os.environ, BENCH_LAUNCHED_AT=repr(time.time()))
+    out = subprocess.run(
+        [sys.executable, "-m", "benchmarks.startup", "--child"], cwd=SERVICE_DIR, env=env, capture_output=True,
+        text=True,
+    )
+    if out.returncode != 0:
+        sys.stderr.write(out.stderr)
+        raise RuntimeError(f"startup run failed with exit code {out.returncode}")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def run(quick: bool = False, runs: int | None = None) -> dict:
+    _launch()  # first launch warms the OS page cache for the libraries and artifacts
+    samples = [_launch() for _ in range(runs or (3 if quick else 5))]
+    return {key: round(float(np.median([s[key] for s in samples])), 1) for key in samples[0]}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--quick", action="store_true")
+    parser.add_argument("--runs", type=int, default=None)
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        _child()
+        return
+    print(json.dumps(run(args.quick, args.runs), indent=2))
+
+
+if __name__ == "__main__":
+    main()
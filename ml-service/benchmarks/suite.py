@@ -0,0 +1,151 @@
+"""
+Benchmark suite runner: microbenchmarks, the /predict and /predict/stream load tests and cold start, with
+results saved as JSON and compared against a stored baseline.
+
+    python -m benchmarks.suite                         # run, compare to benchmarks/baseline.json
+    python -m benchmarks.suite --quick --out run.json  # smaller run, keep the results
+    python -m benchmarks.suite --save-baseline         # record a new baseline
+
+Each suite runs in its own process, so its peak RSS is its own. All suites share
+a scratch directory for model artifacts, the registry, the feature log and the
+saved feature state, so the
+service's real state is never touched; models are trained once (seeded) per run,
+before any suite starts. The run fails (exit 1) when any metric is worse than the baseline by more than
+--threshold (--tail-threshold for p95 / p99), or a load test saw errors.
+Throughput must not drop; latencies and RSS must not grow. Baselines only compare against runs with the same config.
+"""
+from __future__ import annotations
+
+import argparse
+import importlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+from benchmarks.harness import compare
+
+SUITES = {
+    "features": "benchmarks.bench_features",
+    "ensemble": "benchmarks.bench_ensemble",
+    "load": "benchmarks.load_predict",
+    "stream": "benchmarks.load_stream",
+    "startup": "benchmarks.startup",
+}
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _git_commit() -> str | None:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=SERVICE_DIR, capture_output=True, text=True, check=True,
+        )
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _run_child(suite: str, quick: bool, scratch: str) -> dict:
+    env = dict(
+        os.environ,
+        MODEL_ARTIFACT_DIR=os.path.join(scratch, "artifacts"),
+        MODEL_REGISTRY_PATH=os.path.join(scratch, "model_registry.json"),
+        FEATURE_LOG_DIR=os.path.join(scratch, "feature_log"),
+        FEATURE_STATE_DIR=os.path.join(scratch, "feature_state"),
+        PYTHONHASHSEED="0",
+    )
+    cmd = [sys.executable, "-m", "benchmarks.suite", "--child", suite] + (["--quick"] if quick else [])
+    out = subprocess.run(cmd, cwd=SERVICE_DIR, env=env, capture_output=True, text=True)
+    if out.returncode != 0:
+        sys.stderr.write(out.stderr)
+        raise RuntimeError(f"suite {suite} failed with exit code {out.returncode}")
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--quick", action="store_true", help="fewer iterations / requests")
+    parser.add_argument("--suites", default=",".join(SUITES), help=f"comma-separated subset of {','.join(SUITES)}")
+    parser.add_argument("--out", help="write the results JSON here")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--threshold", type=float, default=0.25, help="allowed regression, as a fraction")
+    parser.add_argument("--tail-threshold", type=float, default=1.0, help="allowed regression of p95 / p99")
+    parser.add_argument("--min-delta-us", type=float, default=2.0, help="ignore latency changes below this")
+    parser.add_argument("--save-baseline", action="store_true", help="write the results to --baseline")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child == "prepare":
+        from ensemble import EnsembleModel  # noqa: PLC0415
+        from registry import ModelRegistry  # noqa: PLC0415
+
+        print(json.dumps(EnsembleModel(ModelRegistry()).load_or_train()))
+        return 0
+    if args.child:
+        print(json.dumps(importlib.import_module(SUITES[args.child]).run(quick=args.quick)))
+        return 0
+
+    suites = [s for s in args.suites.split(",") if s]
+    report = {
+        "config": {"quick": args.quick, "suites": suites},
+        "env": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "commit": _git_commit(),
+        },
+        "recordedAt": datetime.now(tz=timezone.utc).isoformat(),
+        "results": {},
+    }
+    with tempfile.TemporaryDirectory(prefix="ml-bench-") as scratch:
+        # Train once up front, so every suite loads artifacts and its RSS reflects serving only
+        print("training models ...", file=sys.stderr)
+        _run_child("prepare", args.quick, scratch)
+        for suite in suites:
+            print(f"running {suite} ...", file=sys.stderr)
+            report["results"][suite] = _run_child(suite, args.quick, scratch)
+
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+
+    failed = False
+    for suite in ("load", "stream"):
+        load_errors = report["results"].get(suite, {}).get("errors", 0)
+        if load_errors:
+            print(f"FAIL: {suite} test saw {load_errors} failed requests", file=sys.stderr)
+            failed = True
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            f.write(text + "\n")
+        print(f"baseline written to {args.baseline}", file=sys.stderr)
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("config", {}).get("quick") != args.quick:
+            print("baseline was recorded with a different --quick setting; not comparing", file=sys.stderr)
+            return 2
+        regressions = compare(
+            report["results"], baseline["results"], args.threshold, args.tail_threshold, args.min_delta_us,
+        )
+        for r in regressions:
+            print(
+                f"REGRESSION {r['metric']}: {r['baseline']:g} -> {r['current']:g} ({r['change']:+.1%})",
+                file=sys.stderr,
+            )
+        if regressions:
+            failed = True
+        else:
+            print(f"no regressions beyond {args.threshold:.0%} vs {args.baseline}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,52 @@
+"""
+Seeded synthetic transaction stream for load tests.
+
+Users are drawn from a Zipf distribution, so a few heavy users generate most
+of the traffic, as in production. Each user has a home location and a primary
+device; some transactions come from another known location or from a new
+device. Amounts are log-normal and timestamps move forward with exponential
+gaps, so velocity features see realistic bursts.
+"""
+from __future__ import annotations
+
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+# The service's original 16 locations, so streams (and the stored baseline) stay comparable
+LOCATIONS = (
+    "BERLIN", "CA", "DELHI", "DUBAI", "FL", "HONGKONG", "LONDON", "MUMBAI",
+    "NY", "PARIS", "SINGAPORE", "SYDNEY", "TOKYO", "TORONTO", "TX", "WA",
+)
+
+
+def transaction_stream(
+    n: int,
+    n_users: int = 5_000,
+    zipf_a: float = 1.3,
+    mean_gap_ms: float = 50.0,
+    seed: int = 7,
+    start: datetime | None = None,
+) -> list[dict]:
+    """n /predict payloads, identical for the same arguments. Timestamps begin at start (default 2026-01-01 UTC)."""
+    rng = np.random.default_rng(seed)
+    locations = LOCATIONS
+    users = (rng.zipf(zipf_a, n) - 1) % n_users
+    home = rng.integers(0, len(locations), n_users)
+    away = rng.random(n) < 0.05
+    location_idx = np.where(away, rng.integers(0, len(locations), n), home[users])
+    new_device = rng.random(n) < 0.03
+    amounts = np.round(rng.lognormal(4.5, 1.0, n), 2) + 0.01
+    offsets_ms = np.cumsum(rng.exponential(mean_gap_ms, n))
+    start = start or datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+    return [
+        {
+            "userId": f"user-{users[i]}",
+            "amount": float(amounts[i]),
+            "location": locations[location_idx[i]],
+            "deviceId": f"unknown-{i}" if new_device[i] else f"device-{users[i]}",
+            "timestamp": (start + timedelta(milliseconds=float(offsets_ms[i]))).isoformat(),
+        }
+        for i in range(n)
+    ]
@@ -0,0 +1,331 @@
+"""
+Cascade scoring: run the ensemble's models one at a time and stop early when
+the partial score is confidently far from the threshold.
+
+A CascadePolicy fixes the model order and, for every stage but the last, an
+exit band (low, high) on the partial score, i.e. the weighted mean of the
+models run so far. A transaction exits as legitimate when the partial score is
+below low and as fraud when it is above high; anything in between goes on to
+the next model. The last stage always runs, so borderline cases get all three.
+
+Bands come from recorded traffic, never by hand: the calibration tool scores
+the features in the feature log with every live model (live_scores), and
+calibrate() picks the order and bands that
+minimise expected model cost while the share of decisions that differ from
+the full ensemble stays within max_flip_rate. The rate is measured again on a
+held-out split, and each stage's agreement rate scales the confidence of the
+predictions that exit there.
+
+A policy is only valid for the model artifacts (by sha256), weights and
+threshold it was calibrated with; EnsembleModel falls back to full scoring
+while any of them differ, e.g. after a retrain, promote or rollback.
+
+    CASCADE_ENABLED       1 / 0 (default 0)
+    CASCADE_POLICY_PATH   policy JSON written by the calibration tool
+
+    python -m cascade [--feature-log DIR] [--rows N] [--max-flip-rate 0.001] [--order auto|a,b,c] [--out PATH]
+"""
+from __future__ import annotations
+
+import argparse
+import itertools
+import json
+import os
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+
+import numpy as np
+
+from registry import ARTIFACT_DIR
+
+CASCADE_ENABLED = os.getenv("CASCADE_ENABLED", "0").lower() in ("1", "true", "yes")
+CASCADE_POLICY_PATH = os.getenv("CASCADE_POLICY_PATH", os.path.join(ARTIFACT_DIR, "cascade.json"))
+
+# Same order as ensemble.MODEL_NAMES and the feature log's model_scores column
+MODEL_NAMES = ("isolation_forest", "xgboost", "autoencoder")
+
+
+@dataclass(frozen=True)
+class CascadePolicy:
+    order: tuple[str, ...]
+    bands: tuple[tuple[float, float], ...]  # one (low, high) per stage except the last
+    agreement: tuple[float, ...]            # per stage: share of its exits that match the full ensemble
+    weights: dict[str, float]
+    threshold: float
+    calibration: dict = field(default_factory=dict)
+    artifacts: dict[str, str] = field(default_factory=dict)  # model name -> artifact sha256 scored during calibration
+
+    def matches(
+        self, weights: dict[str, float], threshold: float, artifacts: dict[str, str], tol: float = 1e-9,
+    ) -> bool:
+        # A policy without recorded artifacts cannot be checked against the live models
+        return (
+            bool(self.artifacts)
+            and all(artifacts.get(name) == self.artifacts.get(name) for name in MODEL_NAMES)
+            and abs(threshold - self.threshold) <= tol
+            and all(abs(weights.get(name, 0.0) - self.weights.get(name, 0.0)) <= tol for name in MODEL_NAMES)
+        )
+
+    def summary(self) -> dict:
+        return {
+            "order": list(self.order), "bands": [list(b) for b in self.bands], "artifacts": dict(self.artifacts),
+            **self.calibration,
+        }
+
+    # ------------------------------------------------------------------
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(asdict(self), f, indent=2)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "CascadePolicy":
+        with open(path) as f:
+            raw = json.load(f)
+        policy = cls(
+            order=tuple(raw["order"]),
+            bands=tuple((float(lo), float(hi)) for lo, hi in raw["bands"]),
+            agreement=tuple(float(a) for a in raw["agreement"]),
+            weights={k: float(v) for k, v in raw["weights"].items()},
+            threshold=float(raw["threshold"]),
+            calibration=raw.get("calibration", {}),
+            artifacts=dict(raw.get("artifacts", {})),
+        )
+        if sorted(policy.order) != sorted(MODEL_NAMES) or len(policy.bands) != len(policy.order) - 1:
+            raise ValueError(f"invalid cascade policy in {path}")
+        return policy
+
+
+# ── Simulation ───────────────────────────────────────────────────────────────
+def _weighted(scores: np.ndarray, weights: dict[str, float], names: tuple[str, ...]) -> np.ndarray:
+    """Weighted mean over the named columns, accumulated in MODEL_NAMES order like EnsembleModel."""
+    num = np.zeros(len(scores))
+    total = 0.0
+    for j, name in enumerate(MODEL_NAMES):
+        if name in names:
+            num += scores[:, j] * weights[name]
+            total += weights[name]
+    return num / total if total > 0 else num
+
+
+def simulate(policy: CascadePolicy, scores: np.ndarray) -> dict:
+    """
+    Replay policy over an (N, 3) score matrix (MODEL_NAMES columns). Returns the
+    exit stage per row (1-based: number of models run), the cascade decision,
+    the full-ensemble decision and summary rates.
+    """
+    n, stages = len(scores), len(policy.order)
+    exit_stage = np.full(n, stages)
+    decision = np.zeros(n, dtype=bool)
+    pending = np.ones(n, dtype=bool)
+    for k in range(stages):
+        partial = _weighted(scores, policy.weights, policy.order[:k + 1])
+        if k < stages - 1:
+            low, high = policy.bands[k]
+            exits = pending & ((partial < low) | (partial > high))
+        else:
+            exits = pending
+        exit_stage[exits] = k + 1
+        decision[exits] = partial[exits] >= policy.threshold
+        pending &= ~exits
+    full = _weighted(scores, policy.weights, MODEL_NAMES) >= policy.threshold
+    flips = decision != full
+    agreement = []
+    for k in range(1, stages + 1):
+        at = exit_stage == k
+        agreement.append(float(1.0 - flips[at].mean()) if at.any() else 1.0)
+    return {
+        "exit_stage": exit_stage,
+        "decision": decision,
+        "full": full,
+        "flipRate": float(flips.mean()) if n else 0.0,
+        "exitRate": [float((exit_stage == k).mean()) if n else 0.0 for k in range(1, stages + 1)],
+        "agreement": agreement,
+    }
+
+
+def expected_cost(exit_stage: np.ndarray, order: tuple[str, ...], costs: dict[str, float]) -> float:
+    """Mean model cost per row relative to running every model (1.0 = no saving)."""
+    stage_cost = np.cumsum([costs[name] for name in order])
+    return float(stage_cost[exit_stage - 1].mean() / stage_cost[-1]) if len(exit_stage) else 1.0
+
+
+# ── Calibration ──────────────────────────────────────────────────────────────
+def _side_curve(partial: np.ndarray, wrong: np.ndarray, ascending: bool) -> tuple[np.ndarray, np.ndarray]:
+    """Sorted partial scores on one side of the threshold and cumulative flips for exiting the first i of them."""
+    order = np.argsort(partial if ascending else -partial, kind="stable")
+    flips = np.concatenate(([0], np.cumsum(wrong[order])))
+    return partial[order], flips
+
+
+def _stage_bands(partial: np.ndarray, full: np.ndarray, threshold: float, budget: int) -> tuple[float, float]:
+    """Widest (low, high) exit band whose flips (exits that disagree with full) fit in budget."""
+    below, above = partial < threshold, partial >= threshold
+    low_p, low_flips = _side_curve(partial[below], full[below], ascending=True)
+    high_p, high_flips = _side_curve(partial[above], ~full[above], ascending=False)
+
+    # Try every split of the budget between the two sides; exits are monotonic in flips
+    spend = np.arange(budget + 1)
+    n_low = np.searchsorted(low_flips, spend, side="right") - 1
+    n_high = np.searchsorted(high_flips, budget - spend, side="right") - 1
+    best = int(np.argmax(n_low + n_high))
+    i, m = int(n_low[best]), int(n_high[best])
+
+    # Exit legit when partial < low, fraud when partial > high; ties at a boundary stay in the cascade
+    low = float(low_p[i]) if i < len(low_p) else threshold
+    high = float(high_p[m]) if m < len(high_p) else float(np.nextafter(threshold, -np.inf))
+    return (low if i > 0 else 0.0), (high if m > 0 else 1.0)
+
+
+def _calibrate_order(
+    scores: np.ndarray,
+    order: tuple[str, ...],
+    weights: dict[str, float],
+    threshold: float,
+    max_flip_rate: float,
+) -> tuple[tuple[float, float], ...]:
+    full = _weighted(scores, weights, MODEL_NAMES) >= threshold
+    budget = int(max_flip_rate * len(scores))
+    pending = np.ones(len(scores), dtype=bool)
+    bands = []
+    stages = len(order) - 1
+    for k in range(stages):
+        partial = _weighted(scores, weights, order[:k + 1])
+        # Spread what is left of the budget evenly over the remaining stages
+        stage_budget = budget // (stages - k)
+        low, high = _stage_bands(partial[pending], full[pending], threshold, stage_budget)
+        exits = pending & ((partial < low) | (partial > high))
+        budget -= int((exits & ((partial >= threshold) != full)).sum())
+        pending &= ~exits
+        bands.append((low, high))
+    return tuple(bands)
+
+
+def calibrate(
+    scores: np.ndarray,
+    weights: dict[str, float],
+    threshold: float,
+    max_flip_rate: float = 0.001,
+    order: tuple[str, ...] | None = None,
+    costs: dict[str, float] | None = None,
+    holdout: float = 0.2,
+    seed: int = 0,
+    artifacts: dict[str, str] | None = None,
+) -> CascadePolicy:
+    """
+    Choose the model order (all permutations unless given) and exit bands that
+    minimise expected cost on (1 - holdout) of the rows, with decisions differing
+    from the full ensemble on at most max_flip_rate of them. The held-out rows
+    give the reported flip rate and the per-stage agreement. artifacts names the
+    model artifacts the scores came from; the policy only applies to those.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    scores = scores[np.isfinite(scores).all(axis=1)]
+    if len(scores) == 0:
+        raise ValueError("no rows with scores from every model to calibrate on")
+    costs = costs or {name: 1.0 for name in MODEL_NAMES}
+    perm = np.random.default_rng(seed).permutation(len(scores))
+    n_holdout = int(len(scores) * holdout)
+    test, train = scores[perm[:n_holdout]], scores[perm[n_holdout:]]
+
+    best: tuple[float, CascadePolicy, dict] | None = None
+    for candidate in ([order] if order else itertools.permutations(MODEL_NAMES)):
+        bands = _calibrate_order(train, candidate, weights, threshold, max_flip_rate)
+        policy = CascadePolicy(candidate, bands, (1.0,) * len(candidate), dict(weights), threshold)
+        sim = simulate(policy, train)
+        cost = expected_cost(sim["exit_stage"], candidate, costs)
+        if best is None or cost < best[0]:
+            best = (cost, policy, sim)
+
+    cost, policy, sim = best
+    check = simulate(policy, test) if len(test) else sim
+    return CascadePolicy(
+        order=policy.order,
+        bands=policy.bands,  # unrounded: rounding a band edge could let extra rows exit
+        agreement=tuple(round(a, 6) for a in check["agreement"]),
+        weights=dict(weights),
+        threshold=threshold,
+        calibration={
+            "maxFlipRate": max_flip_rate,
+            "rows": len(train),
+            "holdoutRows": len(test),
+            "flipRate": round(sim["flipRate"], 6),
+            "holdoutFlipRate": round(check["flipRate"], 6),
+            "exitRate": [round(r, 4) for r in check["exitRate"]],
+            "expectedCostRatio": round(expected_cost(check["exit_stage"], policy.order, costs), 4),
+            "modelCostsUs": {k: round(v * 1e6, 2) for k, v in costs.items()},
+            "calibratedAt": datetime.now(tz=timezone.utc).isoformat(),
+        },
+        artifacts=dict(artifacts or {}),
+    )
+
+
+def live_scores(model_set, X: np.ndarray) -> np.ndarray:
+    """
+    (N, 3) per-model scores of an (N, 5) feature matrix from the models of
+    model_set, in MODEL_NAMES order. The logged scores are not used: they came
+    from whichever models were live when each row was logged, and rows that
+    exited the cascade early lack some of them.
+    """
+    X = np.asarray(X, dtype=np.float64).reshape(-1, 5)
+    return np.column_stack([np.asarray(model.score_batch(X), dtype=np.float64) for _, model in model_set.models()])
+
+
+# ── CLI ──────────────────────────────────────────────────────────────────────
+def _model_costs(ensemble, X: np.ndarray, repeat: int = 200) -> dict[str, float]:
+    """Mean single-row score() time per model, in seconds."""
+    rows = [list(map(float, r)) for r in X[:repeat]]
+    costs = {}
+    for name, model in ensemble.snapshot().models():
+        for row in rows[:20]:
+            model.score(row)
+        started = time.perf_counter()
+        for row in rows:
+            model.score(row)
+        costs[name] = (time.perf_counter() - started) / len(rows)
+    return costs
+
+
+def main() -> None:
+    from ensemble import EnsembleModel  # noqa: PLC0415
+    from feature_log import FEATURE_LOG_DIR, FeatureLogReader  # noqa: PLC0415
+    from registry import ModelRegistry  # noqa: PLC0415
+
+    parser = argparse.ArgumentParser(description="Calibrate cascade exit bands from the feature log.")
+    parser.add_argument("--feature-log", default=FEATURE_LOG_DIR)
+    parser.add_argument("--rows", type=int, default=1_000_000, help="most recent rows to calibrate on")
+    parser.add_argument("--max-flip-rate", type=float, default=0.001)
+    parser.add_argument("--order", default="auto", help="auto, or a comma-separated model order")
+    parser.add_argument("--holdout", type=float, default=0.2)
+    parser.add_argument("--out", default=CASCADE_POLICY_PATH)
+    args = parser.parse_args()
+
+    features = FeatureLogReader(args.feature_log).recent(args.rows)["features"]
+    if not len(features):
+        raise SystemExit(f"no rows in {args.feature_log}")
+
+    ensemble = EnsembleModel(ModelRegistry())
+    ensemble.load_or_train()
+    snap = ensemble.snapshot()
+    if sorted(snap.artifacts) != sorted(MODEL_NAMES):
+        raise SystemExit("some live models have no saved artifact, so no policy could be tied to them")
+    # Every row, scored by exactly the models the policy will be stamped with
+    policy = calibrate(
+        live_scores(snap, features),
+        weights=dict(snap.weights),
+        threshold=snap.threshold,
+        max_flip_rate=args.max_flip_rate,
+        order=None if args.order == "auto" else tuple(args.order.split(",")),
+        costs=_model_costs(ensemble, features),
+        holdout=args.holdout,
+        artifacts=dict(snap.artifacts),
+    )
+    policy.save(args.out)
+    print(json.dumps({"path": args.out, **policy.summary(), "agreement": list(policy.agreement)}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
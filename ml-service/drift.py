@@ -0,0 +1,318 @@
+"""
+Input and score drift against each model's training distribution.
+
+At train time every model fits a DriftReference: for each of the five features
+and for the model's own score, DRIFT_BINS fixed-width bins spanning the 0.5th to
+99.5th percentile of its training data (the end bins also take the tails), and
+the share of training rows in each bin. It is saved next to the artifact as a
+"reference" sidecar (like the compiled arrays, tagged with the artifact's hash)
+and loaded with it.
+
+DriftMonitor bins live traffic against the references of the models currently
+serving. Counts go into the current DRIFT_SLOT_SECONDS slot; a window is the sum
+of its slots, so observing a request is a few multiplies and compares per value,
+and a window is only summed when it is read. For every window, model and column
+it reports the population stability index (PSI) against the reference and the
+Kolmogorov-Smirnov distance between the binned distributions (the largest CDF
+gap at a bin edge). When a model's version changes, its counts start over,
+because counts binned against another reference are not comparable.
+
+    DRIFT_ENABLED         keep drift histograms (default 1)
+    DRIFT_BINS            bins per histogram (default 20)
+    DRIFT_SLOT_SECONDS    slot length (default 300)
+    DRIFT_MIN_SAMPLES     observations a window needs before PSI / KS are reported (default 100)
+    DRIFT_REFERENCE_ROWS  training rows a reference is fitted on, at most (default 50000)
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import math
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Sequence
+
+import numpy as np
+
+from registry import load_compiled, save_compiled
+
+logger = logging.getLogger(__name__)
+
+DRIFT_ENABLED = os.getenv("DRIFT_ENABLED", "1") == "1"
+DRIFT_BINS = int(os.getenv("DRIFT_BINS", "20"))
+DRIFT_SLOT_SECONDS = int(os.getenv("DRIFT_SLOT_SECONDS", "300"))
+DRIFT_MIN_SAMPLES = int(os.getenv("DRIFT_MIN_SAMPLES", "100"))
+DRIFT_REFERENCE_ROWS = int(os.getenv("DRIFT_REFERENCE_ROWS", "50000"))
+
+FEATURE_NAMES = ("amount", "amount_z", "tx_freq", "geo_delta", "device_entropy")
+COLUMNS = FEATURE_NAMES + ("score",)
+# Floor for empty bins, so PSI stays finite
+_EPS = 1e-4
+
+
+def bin_indices(data: np.ndarray, lo: np.ndarray, scale: np.ndarray, bins: int) -> np.ndarray:
+    """Bin of each value of an (N, C) matrix; out-of-range values land in the end bins, NaN in the first."""
+    x = np.nan_to_num((data - lo) * scale, nan=0.0, posinf=bins - 1, neginf=0.0)
+    return np.clip(x, 0, bins - 1).astype(np.intp)
+
+
+@dataclass(frozen=True)
+class DriftReference:
+    """Training distribution of one model: bin layout and expected share per bin, per column."""
+
+    lo: np.ndarray        # (C,) left edge of bin 1's range
+    scale: np.ndarray     # (C,) bins per unit
+    expected: np.ndarray  # (C, bins) share of training rows per bin
+    rows: int
+
+    @property
+    def bins(self) -> int:
+        return self.expected.shape[1]
+
+    @property
+    def key(self) -> str:
+        """Identifies the reference across processes, so counts from shards are only merged when they match."""
+        digest = hashlib.blake2b(digest_size=8)
+        for array in (self.lo, self.scale, self.expected):
+            digest.update(np.ascontiguousarray(array, dtype=np.float64).tobytes())
+        return digest.hexdigest()
+
+    @classmethod
+    def fit(cls, X: np.ndarray, scores: np.ndarray, bins: int = DRIFT_BINS) -> "DriftReference":
+        data = np.column_stack([np.asarray(X, dtype=np.float64)[:, :len(FEATURE_NAMES)], np.asarray(scores, dtype=np.float64)])
+        data = data[np.isfinite(data).all(axis=1)]
+        if len(data) == 0:
+            raise ValueError("no finite training rows to fit a drift reference on")
+        lo, hi = np.percentile(data, [0.5, 99.5], axis=0)
+        scale = bins / np.where(hi > lo, hi - lo, 1.0)
+        idx = bin_indices(data, lo, scale, bins)
+        expected = np.stack([np.bincount(idx[:, c], minlength=bins) for c in range(data.shape[1])]) / len(data)
+        return cls(lo=lo, scale=scale, expected=expected, rows=len(data))
+
+    def to_arrays(self) -> dict[str, np.ndarray]:
+        return {"lo": self.lo, "scale": self.scale, "expected": self.expected, "rows": np.int64(self.rows)}
+
+    @classmethod
+    def from_arrays(cls, arrays: dict[str, np.ndarray]) -> "DriftReference":
+        return cls(
+            lo=np.asarray(arrays["lo"], dtype=np.float64),
+            scale=np.asarray(arrays["scale"], dtype=np.float64),
+            expected=np.asarray(arrays["expected"], dtype=np.float64),
+            rows=int(arrays["rows"]),
+        )
+
+
+def fit_reference(model, X: np.ndarray, seed: int = 42) -> DriftReference | None:
+    """
+    Reference for a model that was just trained on X (or on data X is a sample of):
+    X's features and the model's scores on them. None if it cannot be fitted,
+    which only disables drift reporting for that model.
+    """
+    X = np.asarray(X, dtype=np.float64)
+    if len(X) > DRIFT_REFERENCE_ROWS:
+        X = X[np.random.default_rng(seed).choice(len(X), DRIFT_REFERENCE_ROWS, replace=False)]
+    try:
+        return DriftReference.fit(X, model.score_batch(X))
+    except Exception as exc:  # noqa: BLE001
+        logger.warning("Could not fit a drift reference for %s: %s", getattr(model, "name", model), exc)
+        return None
+
+
+def save_reference(path: str, reference: DriftReference | None) -> None:
+    if reference is not None:
+        save_compiled(path, reference.to_arrays(), kind="reference")
+
+
+def load_reference(path: str) -> DriftReference | None:
+    arrays = load_compiled(path, kind="reference")
+    if arrays is None:
+        return None
+    try:
+        return DriftReference.from_arrays(arrays)
+    except (KeyError, ValueError):
+        return None
+
+
+def compare(expected: np.ndarray, counts: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(psi, ks, samples) per column for (C, bins) observed counts against (C, bins) expected shares."""
+    samples = counts.sum(axis=1)
+    actual = counts / np.maximum(samples, 1)[:, None]
+    e, a = np.maximum(expected, _EPS), np.maximum(actual, _EPS)
+    psi = ((a - e) * np.log(a / e)).sum(axis=1)
+    ks = np.abs(np.cumsum(actual, axis=1) - np.cumsum(expected, axis=1)).max(axis=1)
+    return psi, ks, samples
+
+
+# ── Live histograms ─────────────────────────────────────────────────────────
+class _ModelHistograms:
+    """Rolling (C × bins) counts for one model, binned against its reference."""
+
+    def __init__(self, reference: DriftReference, n_slots: int, since: float) -> None:
+        self.reference = reference
+        self.key = reference.key
+        self.bins = reference.bins
+        self.slots = np.zeros((n_slots, len(COLUMNS) * self.bins), dtype=np.int64)
+        self.since = since
+        # Plain floats for the per-row path, where NumPy call overhead would dominate
+        self.lo = reference.lo.tolist()
+        self.scale = reference.scale.tolist()
+        self.offsets = np.arange(len(COLUMNS)) * self.bins
+
+
+class DriftMonitor:
+    """
+    Rolling drift histograms for the models serving in ensemble. observe() is
+    called with the feature vectors and EnsembleResults of every scored batch.
+    """
+
+    # Below this many rows, per-value Python arithmetic beats NumPy call overhead
+    _SMALL = 8
+
+    def __init__(
+        self,
+        ensemble,
+        windows: dict[str, int] | None = None,
+        slot_seconds: int = DRIFT_SLOT_SECONDS,
+        min_samples: int = DRIFT_MIN_SAMPLES,
+        clock: Callable[[], float] = time.monotonic,
+        wall_clock: Callable[[], float] = time.time,
+    ) -> None:
+        self._ensemble = ensemble
+        self.windows = windows or {"1h": 3600, "24h": 86400}
+        self.min_samples = min_samples
+        self._slot_seconds = slot_seconds
+        self._window_slots = {name: max(1, math.ceil(s / slot_seconds)) for name, s in self.windows.items()}
+        self._n_slots = max(self._window_slots.values())
+        self._clock = clock
+        self._wall_clock = wall_clock
+        self._current = int(clock() // slot_seconds)
+        self._models: dict[str, _ModelHistograms] = {}
+        self._lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    def _advance(self) -> None:
+        now = int(self._clock() // self._slot_seconds)
+        if now == self._current:
+            return
+        stale = range(self._current + 1, now + 1) if now - self._current < self._n_slots else range(self._n_slots)
+        rows = [i % self._n_slots for i in stale]
+        for hist in self._models.values():
+            hist.slots[rows] = 0
+        self._current = now
+
+    def _histograms(self, name: str, model) -> _ModelHistograms | None:
+        reference = getattr(model, "reference", None)
+        hist = self._models.get(name)
+        if hist is not None and hist.reference is reference:
+            return hist
+        if reference is None:
+            self._models.pop(name, None)
+            return None
+        # A new version (or a first reference): its counts start from zero
+        hist = self._models[name] = _ModelHistograms(reference, self._n_slots, self._wall_clock())
+        return hist
+
+    def observe(self, feats: Sequence[Sequence[float]], results: Sequence) -> None:
+        if not len(feats):
+            return
+        snap = self._ensemble.snapshot()
+        with self._lock:
+            self._advance()
+            slot = self._current % self._n_slots
+            for name, model in snap.models():
+                hist = self._histograms(name, model)
+                if hist is None:
+                    continue
+                scores = [r.model_scores.get(name) for r in results]
+                if len(feats) <= self._SMALL:
+                    self._add_rows(hist, hist.slots[slot], feats, scores)
+                else:
+                    self._add_batch(hist, hist.slots[slot], feats, scores)
+
+    @staticmethod
+    def _add_rows(hist: _ModelHistograms, row: np.ndarray, feats, scores) -> None:
+        bins, lo, scale = hist.bins, hist.lo, hist.scale
+        top = bins - 1
+        for values, score in zip(feats, scores):
+            for c, value in enumerate((*values, score)):
+                if value is None:
+                    continue  # the model did not run for this row (cascade)
+                x = (value - lo[c]) * scale[c]
+                row[c * bins + (0 if not x > 0 else top if x >= top else int(x))] += 1
+
+    @staticmethod
+    def _add_batch(hist: _ModelHistograms, row: np.ndarray, feats, scores) -> None:
+        data = np.empty((len(feats), len(COLUMNS)), dtype=np.float64)
+        data[:, :len(FEATURE_NAMES)] = feats
+        data[:, -1] = [np.nan if s is None else s for s in scores]
+        idx = bin_indices(data, hist.reference.lo, hist.reference.scale, hist.bins) + hist.offsets
+        missing = np.isnan(data[:, -1])
+        flat = idx[~missing].ravel() if not missing.any() else np.concatenate([idx[:, :-1].ravel(), idx[~missing, -1]])
+        row += np.bincount(flat, minlength=row.shape[0])
+
+    # ------------------------------------------------------------------
+    def _window_counts(self, hist: _ModelHistograms) -> dict[str, np.ndarray]:
+        out = {}
+        for window, w in self._window_slots.items():
+            rows = [(self._current - k) % self._n_slots for k in range(min(w, self._n_slots))]
+            out[window] = hist.slots[rows].sum(axis=0).reshape(len(COLUMNS), hist.bins)
+        return out
+
+    def counts(self) -> dict[str, dict[str, Any]]:
+        """Raw window counts per model with their reference key, for merging across processes (sharding)."""
+        snap = self._ensemble.snapshot()
+        with self._lock:
+            self._advance()
+            out = {}
+            for name, model in snap.models():
+                hist = self._histograms(name, model)
+                if hist is not None:
+                    out[name] = {"key": hist.key, "windows": {w: c.tolist() for w, c in self._window_counts(hist).items()}}
+            return out
+
+    def report(self, extra: Iterable[dict[str, dict[str, Any]]] = ()) -> dict:
+        """
+        PSI / KS per window, model and column. extra holds counts() of other processes
+        scoring for the same models (shards); counts against a different reference are skipped.
+        """
+        extra = list(extra)
+        snap = self._ensemble.snapshot()
+        with self._lock:
+            self._advance()
+            models: dict[str, dict] = {}
+            for name, model in snap.models():
+                hist = self._histograms(name, model)
+                if hist is None:
+                    models[name] = {"reference": None, "windows": {}}
+                    continue
+                windows = self._window_counts(hist)
+                for other in extra:
+                    theirs = other.get(name)
+                    if theirs is not None and theirs["key"] == hist.key:
+                        for w in windows:
+                            windows[w] = windows[w] + np.asarray(theirs["windows"][w], dtype=np.int64)
+                models[name] = {
+                    "reference": {"rows": hist.reference.rows, "bins": hist.bins},
+                    "since": hist.since,
+                    "windows": {w: self._describe(hist.reference, c) for w, c in windows.items()},
+                }
+        return {"windows": dict(self.windows), "minSamples": self.min_samples, "models": models}
+
+    def _describe(self, reference: DriftReference, counts: np.ndarray) -> dict:
+        psi, ks, samples = compare(reference.expected, counts)
+        columns = {}
+        for c, column in enumerate(COLUMNS):
+            enough = samples[c] >= self.min_samples
+            columns[column] = {
+                "samples": int(samples[c]),
+                "psi": round(float(psi[c]), 4) if enough else None,
+                "ks": round(float(ks[c]), 4) if enough else None,
+            }
+        reported = [v["psi"] for v in columns.values() if v["psi"] is not None]
+        return {
+            "sampleSize": int(samples[0]),
+            "maxPsi": max(reported) if reported else None,
+            "columns": columns,
+        }
@@ -0,0 +1,302 @@
+"""
+Append-only, segmented feature log used as the training store.
+
+Every scored transaction appends one fixed-width binary record (RECORD_DTYPE):
+event timestamp, a 64-bit hash of the userId, the 5 model features, the three
+model scores and the ensemble score/decision. Segments are plain files with a
+64-byte header followed by packed records, so any segment — including the one
+being written — can be opened as a read-only np.memmap and read in chunks
+without parsing.
+
+Writes never block a request: FeatureLogWriter.append() only enqueues the batch
+on a bounded queue. A background thread packs and writes it. When the queue is
+full the batch is dropped and counted. Each process writes its own segments
+(prefix = writer id), so shard workers never contend on a file.
+
+    FEATURE_LOG_DIR              directory for segments ("" disables logging)
+    FEATURE_LOG_SEGMENT_RECORDS  records per segment before rotating
+    FEATURE_LOG_MAX_SEGMENTS     per-writer retention; oldest segments are deleted (0 keeps all)
+    FEATURE_LOG_QUEUE_BATCHES    bounded queue length, in appended batches
+"""
+from __future__ import annotations
+
+import atexit
+import glob
+import hashlib
+import logging
+import os
+import queue
+import struct
+import threading
+from datetime import datetime, timezone
+from typing import Iterator, Sequence
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FEATURE_LOG_DIR = os.getenv("FEATURE_LOG_DIR", "feature_log")
+FEATURE_LOG_SEGMENT_RECORDS = int(os.getenv("FEATURE_LOG_SEGMENT_RECORDS", "1000000"))
+FEATURE_LOG_MAX_SEGMENTS = int(os.getenv("FEATURE_LOG_MAX_SEGMENTS", "100"))
+FEATURE_LOG_QUEUE_BATCHES = int(os.getenv("FEATURE_LOG_QUEUE_BATCHES", "4096"))
+
+RECORD_DTYPE = np.dtype([
+    ("ts_us", "<i8"),               # event timestamp, microseconds since the Unix epoch (UTC)
+    ("user_hash", "<u8"),
+    ("features", "<f8", (5,)),      # amount, amount_z, tx_freq, geo_delta, device_entropy
+    ("model_scores", "<f4", (3,)),  # isolation_forest, xgboost, autoencoder; NaN if a cascade skipped it
+    ("fraud_score", "<f4"),
+    ("is_fraud", "u1"),
+    ("_pad", "V7"),                 # pad to 80 bytes
+])
+
+MAGIC = b"FLOG"
+FORMAT_VERSION = 1
+HEADER_SIZE = 64
+_HEADER = struct.Struct("<4sHHI")  # magic, format version, reserved, record size
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def user_hash(user_id: str) -> int:
+    return int.from_bytes(hashlib.blake2b(user_id.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _ts_us(ts: datetime) -> int:
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    delta = ts - _EPOCH
+    return (delta.days * 86_400 + delta.seconds) * 1_000_000 + delta.microseconds
+
+
+def pack_records(
+    timestamps: Sequence[datetime],
+    user_ids: Sequence[str],
+    features: np.ndarray,
+    model_scores: np.ndarray,
+    fraud_scores: np.ndarray,
+    is_fraud: np.ndarray,
+) -> np.ndarray:
+    out = np.zeros(len(user_ids), dtype=RECORD_DTYPE)
+    out["ts_us"] = [_ts_us(t) for t in timestamps]
+    out["user_hash"] = [user_hash(u) for u in user_ids]
+    out["features"] = features
+    out["model_scores"] = model_scores
+    out["fraud_score"] = fraud_scores
+    out["is_fraud"] = is_fraud
+    return out
+
+
+# ── Writer ───────────────────────────────────────────────────────────────────
+class FeatureLogWriter:
+    def __init__(
+        self,
+        directory: str = FEATURE_LOG_DIR,
+        writer_id: str = "main",
+        segment_records: int = FEATURE_LOG_SEGMENT_RECORDS,
+        max_segments: int = FEATURE_LOG_MAX_SEGMENTS,
+        queue_batches: int = FEATURE_LOG_QUEUE_BATCHES,
+    ) -> None:
+        self._dir = directory
+        self._writer_id = writer_id
+        self._segment_records = max(1, segment_records)
+        self._max_segments = max_segments
+        self._queue: queue.Queue = queue.Queue(maxsize=max(1, queue_batches))
+        self._file = None
+        self._file_records = 0
+        self._seq = 0
+        self.rows_written = 0
+        self.rows_dropped = 0
+        os.makedirs(directory, exist_ok=True)
+        existing = self._own_segments()
+        if existing:
+            self._seq = int(os.path.basename(existing[-1]).rsplit("-", 1)[1].split(".")[0]) + 1
+        self._thread = threading.Thread(target=self._run, name=f"feature-log-{writer_id}", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # ------------------------------------------------------------------
+    def append(self, records: Sequence, features, results) -> bool:
+        """
+        Enqueue one scored batch: records are (user_id, amount, location, device_id, timestamp)
+        tuples, features the matching feature vectors, results the EnsembleResults.
+        Never blocks; returns False if the batch was dropped.
+        """
+        try:
+            self._queue.put_nowait((records, features, results))
+            return True
+        except queue.Full:
+            self.rows_dropped += len(records)
+            return False
+
+    def flush(self, timeout: float = 5.0) -> None:
+        """Block until everything enqueued so far is on disk (tests / shutdown)."""
+        marker = threading.Event()
+        self._queue.put(marker, timeout=timeout)
+        marker.wait(timeout)
+
+    def close(self) -> None:
+        if self._thread.is_alive():
+            try:
+                self._queue.put(None, timeout=5)
+            except queue.Full:
+                pass
+            self._thread.join(timeout=5)
+
+    # ------------------------------------------------------------------
+    def _own_segments(self) -> list[str]:
+        return sorted(glob.glob(os.path.join(self._dir, f"features-{self._writer_id}-*.seg")))
+
+    def _open_segment(self) -> None:
+        path = os.path.join(self._dir, f"features-{self._writer_id}-{self._seq:08d}.seg")
+        self._seq += 1
+        self._file = open(path, "ab")
+        header = _HEADER.pack(MAGIC, FORMAT_VERSION, 0, RECORD_DTYPE.itemsize)
+        self._file.write(header.ljust(HEADER_SIZE, b"\0"))
+        self._file_records = 0
+        if self._max_segments > 0:
+            for old in self._own_segments()[:-self._max_segments]:
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
+
+    def _write(self, packed: np.ndarray) -> None:
+        start = 0
+        while start < len(packed):
+            if self._file is None or self._file_records >= self._segment_records:
+                if self._file is not None:
+                    self._file.close()
+                self._open_segment()
+            take = min(len(packed) - start, self._segment_records - self._file_records)
+            self._file.write(packed[start:start + take].tobytes())
+            self._file_records += take
+            start += take
+        self.rows_written += len(packed)
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            pending = [item]
+            # Drain whatever else is queued so one write / flush covers many requests
+            while True:
+                try:
+                    pending.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = False
+            for entry in pending:
+                if entry is None:
+                    stop = True
+                elif isinstance(entry, threading.Event):
+                    continue
+                else:
+                    try:
+                        self._write(self._pack(*entry))
+                    except Exception:  # noqa: BLE001
+                        logger.exception("Feature log write failed; dropping batch")
+                        self.rows_dropped += len(entry[0])
+            if self._file is not None:
+                self._file.flush()
+            for entry in pending:
+                if isinstance(entry, threading.Event):
+                    entry.set()
+            if stop:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                return
+
+    @staticmethod
+    def _pack(records, features, results) -> np.ndarray:
+        return pack_records(
+            timestamps=[r[4] for r in records],
+            user_ids=[r[0] for r in records],
+            features=np.asarray(features, dtype=np.float64).reshape(-1, 5),
+            # NaN for models a cascade skipped
+            model_scores=[
+                [res.model_scores.get(k, np.nan) for k in ("isolation_forest", "xgboost", "autoencoder")]
+                for res in results
+            ],
+            fraud_scores=[res.fraud_score for res in results],
+            is_fraud=[res.is_fraud for res in results],
+        )
+
+
+# ── Reader ───────────────────────────────────────────────────────────────────
+class FeatureLogReader:
+    """Read-only view over every segment in a directory, via np.memmap."""
+
+    def __init__(self, directory: str = FEATURE_LOG_DIR) -> None:
+        self._dir = directory
+
+    def segments(self) -> list[str]:
+        return sorted(glob.glob(os.path.join(self._dir, "features-*.seg")))
+
+    @staticmethod
+    def open(path: str) -> np.ndarray:
+        with open(path, "rb") as f:
+            magic, version, _, record_size = _HEADER.unpack(f.read(_HEADER.size))
+        if magic != MAGIC or version != FORMAT_VERSION or record_size != RECORD_DTYPE.itemsize:
+            raise ValueError(f"{path}: not a feature log segment (format {version})")
+        # Ignore a torn trailing record from a crash mid-write
+        n = (os.path.getsize(path) - HEADER_SIZE) // RECORD_DTYPE.itemsize
+        if n <= 0:
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        return np.memmap(path, dtype=RECORD_DTYPE, mode="r", offset=HEADER_SIZE, shape=(n,))
+
+    def _open_all(self) -> list[np.ndarray]:
+        maps = []
+        for path in self.segments():
+            try:
+                maps.append(self.open(path))
+            except (OSError, ValueError) as exc:
+                logger.warning("Skipping feature log segment %s: %s", path, exc)
+        return maps
+
+    def __len__(self) -> int:
+        return sum(len(m) for m in self._open_all())
+
+    def iter_chunks(self, chunk_rows: int = 65_536) -> Iterator[np.ndarray]:
+        """Yield record arrays of at most chunk_rows, segment by segment."""
+        for records in self._open_all():
+            for start in range(0, len(records), chunk_rows):
+                yield records[start:start + chunk_rows]
+
+    def iter_features(self, chunk_rows: int = 65_536) -> Iterator[np.ndarray]:
+        """Yield (n, 5) float64 feature chunks."""
+        for chunk in self.iter_chunks(chunk_rows):
+            yield np.ascontiguousarray(chunk["features"])
+
+    def recent(self, n: int) -> np.ndarray:
+        """The n records with the latest event timestamps, across every writer's segments."""
+        maps = self._open_all()
+        if not maps:
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        ts = np.concatenate([m["ts_us"] for m in maps])
+        if len(ts) <= n:
+            return np.concatenate([np.asarray(m) for m in maps])
+        picks = np.sort(np.argpartition(ts, len(ts) - n)[len(ts) - n:])
+        return self._gather(maps, picks)
+
+    @staticmethod
+    def _gather(maps: list[np.ndarray], picks: np.ndarray) -> np.ndarray:
+        """Records at sorted global row indices picks, reading each memmap once."""
+        bounds = np.concatenate([[0], np.cumsum([len(m) for m in maps])])
+        parts = []
+        for i, m in enumerate(maps):
+            lo, hi = np.searchsorted(picks, [bounds[i], bounds[i + 1]])
+            if hi > lo:
+                parts.append(np.asarray(m[picks[lo:hi] - bounds[i]]))
+        return np.concatenate(parts)
+
+    def sample(self, n: int, seed: int = 42) -> np.ndarray:
+        """Uniform random sample of up to n records across all segments (sorted reads from each memmap)."""
+        maps = self._open_all()
+        sizes = np.array([len(m) for m in maps], dtype=np.int64)
+        total = int(sizes.sum())
+        if total == 0:
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        rng = np.random.default_rng(seed)
+        picks = np.sort(rng.choice(total, size=min(n, total), replace=False))
+        return self._gather(maps, picks)
@@ -0,0 +1,504 @@
+"""
+Durable FeatureEngineer state: periodic snapshots plus a write-ahead log.
+
+Without this every deploy or crash forgets all per-user history, and every
+user scores as brand new (z-score 0, no geo delta, entropy 0) until history
+builds up again.
+
+Every FeatureEngineer.build() appends its input to the current WAL segment
+once it has been applied (a record that fails to build is never logged); the
+segment is flushed once per scored batch. Feature state
+is a pure function of the sequence of builds, so replaying the WAL on top of
+the snapshot it follows reproduces the state exactly.
+
+A snapshot is columnar: per-user scalars, the amount / timestamp / device
+deques and the device counts are flattened into a few numpy arrays with a
+shared string table and saved as one .npz, so loading millions of users is a
+handful of array reads plus one pass to rebuild the UserState objects.
+
+Snapshots never pause scoring for more than a WAL rotation. When one is due,
+the scoring thread rotates the WAL to a new segment and starts a spawned
+process. That process rebuilds the state from the previous snapshot and the
+closed WAL segments after it, the same way recovery would, and writes the new
+snapshot. The serving process is never forked while its threads hold locks, and
+the rebuild runs on another core. Once the process succeeds, files older than
+the previous snapshot are deleted. That snapshot and the WAL segments after it
+stay, so a new snapshot that turns out unreadable costs a longer replay rather
+than the history it covered. One that runs past FEATURE_SNAPSHOT_TIMEOUT_S is
+killed and logged, and the next due snapshot takes its place.
+
+    FEATURE_STATE_DIR            directory for snapshots and WAL segments ("" disables)
+    FEATURE_SNAPSHOT_INTERVAL_S  seconds between snapshots
+    FEATURE_WAL_MAX_RECORDS      snapshot early once the WAL holds this many updates
+    FEATURE_SNAPSHOT_TIMEOUT_S   kill a snapshot process running longer than this
+
+Files: snapshot-{seq}.npz holds the state before WAL segment wal-{seq}.log.
+Recovery loads the newest readable snapshot and replays wal-{seq}.log onwards.
+When some of that history is gone (a segment missing or unreadable), recovery
+still serves what it could replay, but logs an error and reports
+recovery["complete"] = False instead of a clean warm start.
+
+Idle time survives too: a snapshot stores each user's idle seconds, and every
+WAL record carries the wall-clock time of its update. Replay runs the
+engineer's clock at those times, so last_seen and idle-TTL eviction come out
+as they were before the restart, with the time spent down added on top.
+(Version 1 segments have no times; their users count as seen at replay.)
+"""
+from __future__ import annotations
+
+import atexit
+import gc
+import glob
+import json
+import logging
+import multiprocessing as mp
+import os
+import struct
+import threading
+import time
+from array import array
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from dataclasses import asdict
+from datetime import datetime, timedelta, timezone
+from typing import IO, Callable, Iterator
+
+import numpy as np
+
+from features import FeatureConfig, FeatureEngineer, UserState
+
+logger = logging.getLogger(__name__)
+
+FEATURE_STATE_DIR = os.getenv("FEATURE_STATE_DIR", "feature_state")
+FEATURE_SNAPSHOT_INTERVAL_S = float(os.getenv("FEATURE_SNAPSHOT_INTERVAL_S", "300"))
+FEATURE_WAL_MAX_RECORDS = int(os.getenv("FEATURE_WAL_MAX_RECORDS", "500000"))
+FEATURE_SNAPSHOT_TIMEOUT_S = float(os.getenv("FEATURE_SNAPSHOT_TIMEOUT_S", "900"))
+
+SNAPSHOT_VERSION = 1
+WAL_MAGIC = b"FWAL"
+WAL_VERSION = 2
+_WAL_HEADER = struct.Struct("<4sH")      # magic, format version
+_WAL_RECORD = struct.Struct("<qddBHHH")  # ts_us, amount, wall time, naive timestamp, len(user), len(location), len(device)
+_WAL_RECORD_V1 = struct.Struct("<qdBHHH")  # as above without the wall time
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _ts_us(ts: datetime) -> tuple[int, bool]:
+    naive = ts.tzinfo is None
+    delta = (ts.replace(tzinfo=timezone.utc) if naive else ts) - _EPOCH
+    return (delta.days * 86_400 + delta.seconds) * 1_000_000 + delta.microseconds, naive
+
+
+def _from_us(us: int, naive: bool) -> datetime:
+    ts = _EPOCH + timedelta(microseconds=us)
+    return ts.replace(tzinfo=None) if naive else ts
+
+
+@contextmanager
+def _gc_paused() -> Iterator[None]:
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+# ── Snapshot ─────────────────────────────────────────────────────────────────
+def write_snapshot(fe: FeatureEngineer, path: str) -> int:
+    """Write fe.state (LRU order kept) to path atomically. Returns the number of users."""
+    strings: dict[str, int] = {}
+    intern = lambda s: strings.setdefault(s, len(strings))  # noqa: E731
+    now = fe._clock()
+
+    n = len(fe.state)
+    ints = np.empty((n, 9), dtype=np.int64)    # user, count, device_total, last_location, naive, n_amounts, n_ts, n_counts, n_devices
+    floats = np.empty((n, 4), dtype=np.float64)  # mean, m2, device_clogc, idle seconds
+    # array, not list: 8 bytes per value instead of a boxed Python object
+    amounts, timestamps = array("d"), array("q")
+    count_keys, count_values, devices = array("q"), array("q"), array("q")
+
+    for i, (user_id, u) in enumerate(fe.state.items()):
+        ts = [_ts_us(t) for t in u.timestamps]
+        timestamps.extend(us for us, _ in ts)
+        if u.amounts is not None:
+            amounts.extend(u.amounts)
+        count_keys.extend(intern(d) for d in u.device_counts)
+        count_values.extend(u.device_counts.values())
+        if u.devices is not None:
+            devices.extend(intern(d) for d in u.devices)
+        ints[i] = (
+            intern(user_id), u.count, u.device_total,
+            intern(u.last_location) if u.last_location is not None else -1,
+            ts[0][1] if ts else 0,
+            len(u.amounts) if u.amounts is not None else -1,
+            len(ts), len(u.device_counts),
+            len(u.devices) if u.devices is not None else -1,
+        )
+        floats[i] = (u.mean, u.m2, u.device_clogc, now - u.last_seen)
+
+    encoded = [s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    meta = {"version": SNAPSHOT_VERSION, "config": asdict(fe.config), "wallTime": time.time(), "users": n}
+
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        np.savez(
+            f,
+            meta=np.frombuffer(json.dumps(meta).encode("utf-8"), dtype=np.uint8),
+            strings=np.frombuffer(b"".join(encoded), dtype=np.uint8),
+            string_offsets=offsets,
+            ints=ints,
+            floats=floats,
+            amounts=np.frombuffer(amounts, dtype=np.float64),
+            timestamps=np.frombuffer(timestamps, dtype=np.int64),
+            count_keys=np.frombuffer(count_keys, dtype=np.int64),
+            count_values=np.frombuffer(count_values, dtype=np.int64),
+            devices=np.frombuffer(devices, dtype=np.int64),
+        )
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return n
+
+
+def load_snapshot(path: str, fe: FeatureEngineer) -> int:
+    """
+    Replace fe.state with the snapshot at path. Raises ValueError when the snapshot
+    was taken under a different FeatureConfig (its windows would not fit).
+    """
+    with np.load(path, allow_pickle=False) as z:
+        meta = json.loads(z["meta"].tobytes())
+        if meta.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"unsupported snapshot version {meta.get('version')}")
+        if meta["config"] != asdict(fe.config):
+            raise ValueError(f"snapshot config {meta['config']} differs from {asdict(fe.config)}")
+        blob = z["strings"].tobytes()
+        bounds = z["string_offsets"].tolist()
+        ints, floats = z["ints"], z["floats"]
+        amounts = z["amounts"].tolist()
+        # One vectorised conversion to (naive UTC) datetimes; aware users get tzinfo back below
+        timestamps = z["timestamps"].astype("datetime64[us]").tolist()
+        count_keys, count_values = z["count_keys"].tolist(), z["count_values"].tolist()
+        devices = z["devices"].tolist()
+
+    strings = [blob[a:b].decode("utf-8") for a, b in zip(bounds, bounds[1:])]
+    # Time spent down counts towards the idle TTL
+    now = fe._clock() - max(0.0, time.time() - meta["wallTime"])
+    state: OrderedDict[str, UserState] = OrderedDict()
+    a = t = c = d = 0
+    lookup = strings.__getitem__
+    utc = timezone.utc
+    new = UserState.__new__
+    # Millions of new containers would otherwise trigger repeated full collections
+    with _gc_paused():
+        for row, (mean, m2, clogc, idle) in zip(ints.tolist(), floats.tolist()):
+            user_idx, count, device_total, location, naive, n_amounts, n_ts, n_counts, n_devices = row
+            # Every slot is assigned here, so skip __init__ and its throwaway deques
+            u = new(UserState)
+            u.count, u.mean, u.m2 = count, mean, m2
+            if n_amounts >= 0:
+                u.amounts = deque(amounts[a:a + n_amounts])
+                a += n_amounts
+            else:
+                u.amounts = None
+            if naive:
+                u.timestamps = deque(timestamps[t:t + n_ts])
+            else:
+                u.timestamps = deque([ts.replace(tzinfo=utc) for ts in timestamps[t:t + n_ts]])
+            t += n_ts
+            u.last_location = strings[location] if location >= 0 else None
+            u.device_counts = dict(zip(map(lookup, count_keys[c:c + n_counts]), count_values[c:c + n_counts]))
+            c += n_counts
+            u.device_total, u.device_clogc = device_total, clogc
+            if n_devices >= 0:
+                u.devices = deque(map(lookup, devices[d:d + n_devices]))
+                d += n_devices
+            else:
+                u.devices = None
+            u.last_seen = now - idle
+            state[strings[user_idx]] = u
+    fe.state = state
+    return len(state)
+
+
+# ── WAL ──────────────────────────────────────────────────────────────────────
+def replay_wal(path: str, fe: FeatureEngineer) -> int:
+    """
+    Apply every complete record in a WAL segment to fe. A torn tail record is ignored.
+    Only records that built are logged, but one that fails here anyway (a segment
+    written by an older version, or a config change) is skipped and logged, not
+    allowed to stop the rest of the segment.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < _WAL_HEADER.size or data[:4] != WAL_MAGIC:
+        raise ValueError(f"{path} is not a feature WAL segment")
+    _, version = _WAL_HEADER.unpack_from(data)
+    if version not in (1, WAL_VERSION):
+        raise ValueError(f"unsupported WAL version {version} in {path}")
+    record = _WAL_RECORD if version == WAL_VERSION else _WAL_RECORD_V1
+    pos, end, n, skipped = _WAL_HEADER.size, len(data), 0, 0
+    build = fe._build
+    clock = fe._clock
+    # Wall time of an update -> the engineer's clock at that moment (downtime included)
+    offset = clock() - time.time()
+    wall = [0.0]
+    if version == WAL_VERSION:
+        fe._clock = lambda: wall[0] + offset
+    try:
+        with _gc_paused():
+            while pos + record.size <= end:
+                if version == WAL_VERSION:
+                    us, amount, wall[0], naive, lu, ll, ld = record.unpack_from(data, pos)
+                else:
+                    us, amount, naive, lu, ll, ld = record.unpack_from(data, pos)
+                start = pos + record.size
+                stop = start + lu + ll + ld
+                if stop > end:
+                    break
+                try:
+                    user_id = data[start:start + lu].decode("utf-8")
+                    location = data[start + lu:start + lu + ll].decode("utf-8")
+                    device_id = data[start + lu + ll:stop].decode("utf-8")
+                    build(user_id, amount, location, device_id, _from_us(us, naive))
+                    n += 1
+                except Exception as exc:  # noqa: BLE001
+                    if not skipped:
+                        logger.warning("Skipping WAL record at %s:%d: %s", path, pos, exc)
+                    skipped += 1
+                pos = stop
+    finally:
+        fe._clock = clock
+    if skipped:
+        logger.warning("Skipped %d of %d records in %s", skipped, n + skipped, path)
+    return n
+
+
+def _state_path(directory: str, kind: str, seq: int) -> str:
+    ext = "npz" if kind == "snapshot" else "log"
+    return os.path.join(directory, f"{kind}-{seq:08d}.{ext}")
+
+
+def _state_files(directory: str, kind: str) -> list[tuple[int, str]]:
+    out = []
+    for path in glob.glob(os.path.join(directory, f"{kind}-*.*")):
+        stem = os.path.basename(path).split(".")[0]
+        if path.endswith((".npz", ".log")):
+            out.append((int(stem.split("-")[1]), path))
+    return sorted(out)
+
+
+def restore(directory: str, fe: FeatureEngineer, before: int | None = None) -> tuple[int, int, int, bool]:
+    """
+    Load the newest readable snapshot into fe and replay the WAL segments after it,
+    up to (not including) segment before. Returns (snapshot seq, snapshot users,
+    WAL records, complete); complete is False when part of the history could not
+    be replayed: a segment between the snapshot used and a newer, unreadable one
+    is missing, or a segment fails to replay.
+    """
+    snapshot_seq, snapshot_users, skipped = 0, 0, 0
+    for seq, path in reversed(_state_files(directory, "snapshot")):
+        if before is not None and seq >= before:
+            continue
+        try:
+            snapshot_users = load_snapshot(path, fe)
+            snapshot_seq = seq
+            break
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Skipping feature state snapshot %s: %s", path, exc)
+            fe.state = OrderedDict()
+            skipped = max(skipped, seq)
+
+    wal = [(seq, path) for seq, path in _state_files(directory, "wal") if seq >= snapshot_seq and (before is None or seq < before)]
+    # The skipped snapshot's history lives only in the segments from the one used up to it
+    needed = set(range(max(snapshot_seq, 1), skipped))
+    missing = sorted(needed - {seq for seq, _ in wal})
+    complete = not missing
+    if missing:
+        logger.error(
+            "Feature state history lost: WAL segments %s are gone, so users are restored without "
+            "the updates between snapshot %d and snapshot %d", missing, snapshot_seq, skipped,
+        )
+
+    replayed = 0
+    for seq, path in wal:
+        try:
+            replayed += replay_wal(path, fe)
+        except Exception as exc:  # noqa: BLE001
+            logger.error("Stopping WAL replay at %s: %s; later updates are not restored", path, exc)
+            complete = False
+            break
+    return snapshot_seq, snapshot_users, replayed, complete
+
+
+def compact(directory: str, seq: int, config: dict) -> None:
+    """
+    Write snapshot-{seq}: the state at the start of WAL segment seq, rebuilt from the
+    files alone. Runs in a spawned process; exits non-zero on failure.
+    """
+    try:
+        os.nice(10)  # leave the CPU to the serving process
+    except (AttributeError, OSError):
+        pass
+    fe = FeatureEngineer(config=FeatureConfig(**config))
+    restore(directory, fe, before=seq)
+    write_snapshot(fe, _state_path(directory, "snapshot", seq))
+
+
+class FeatureStateStore:
+    """
+    Snapshot + WAL persistence for one FeatureEngineer. Call recover() once at
+    startup; it replays the saved state and attaches the store as the engineer's
+    journal, after which build() logs every update and commit() drives snapshots.
+    """
+
+    def __init__(
+        self,
+        directory: str = FEATURE_STATE_DIR,
+        snapshot_interval_s: float = FEATURE_SNAPSHOT_INTERVAL_S,
+        wal_max_records: int = FEATURE_WAL_MAX_RECORDS,
+        snapshot_timeout_s: float = FEATURE_SNAPSHOT_TIMEOUT_S,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.directory = directory
+        self.snapshot_interval_s = snapshot_interval_s
+        self.wal_max_records = wal_max_records
+        self.snapshot_timeout_s = snapshot_timeout_s
+        self._clock = clock
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        self._seq = 0
+        self._wal: IO[bytes] | None = None
+        self.wal_records = 0
+        self._last_snapshot = clock()
+        self._child: tuple[mp.process.BaseProcess, int, float] | None = None  # process, seq, started
+        self.snapshots_written = 0
+        self.snapshot_failures = 0
+        self.last_snapshot_seconds: float | None = None
+        self.recovery: dict = {}
+        atexit.register(self.close)
+
+    def _path(self, kind: str, seq: int) -> str:
+        return _state_path(self.directory, kind, seq)
+
+    def _files(self, kind: str) -> list[tuple[int, str]]:
+        return _state_files(self.directory, kind)
+
+    # ------------------------------------------------------------------
+    def recover(self, fe: FeatureEngineer) -> dict:
+        """Load the newest snapshot, replay the WAL after it, and start journaling fe's updates."""
+        started = time.perf_counter()
+        snapshot_seq, snapshot_users, replayed, complete = restore(self.directory, fe)
+        wal = self._files("wal")
+
+        self._seq = max([snapshot_seq] + [seq for seq, _ in wal]) + 1
+        self._open_wal()
+        fe.journal = self
+        self.recovery = {
+            "users": len(fe.state),
+            "snapshotUsers": snapshot_users,
+            "walRecords": replayed,
+            "complete": complete,
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+        if complete:
+            logger.info("Feature state recovered: %s", self.recovery)
+        else:
+            logger.error("Feature state recovered only in part: %s", self.recovery)
+        return self.recovery
+
+    def _open_wal(self) -> None:
+        self._wal = open(self._path("wal", self._seq), "ab", buffering=1 << 20)
+        if self._wal.tell() == 0:
+            self._wal.write(_WAL_HEADER.pack(WAL_MAGIC, WAL_VERSION))
+        self.wal_records = 0
+
+    def append(self, user_id: str, amount: float, location: str, device_id: str, timestamp: datetime) -> None:
+        # Called by FeatureEngineer.build with self.lock held
+        us, naive = _ts_us(timestamp)
+        user, loc, dev = user_id.encode("utf-8"), location.encode("utf-8"), device_id.encode("utf-8")
+        self._wal.write(
+            _WAL_RECORD.pack(us, amount, time.time(), naive, len(user), len(loc), len(dev)) + user + loc + dev,
+        )
+        self.wal_records += 1
+
+    def commit(self, fe: FeatureEngineer) -> None:
+        """Flush the WAL to the OS and start a snapshot when one is due."""
+        with self.lock:
+            self._wal.flush()
+            if self._child is not None:
+                self._reap(block=False)
+            due = (
+                self._clock() - self._last_snapshot >= self.snapshot_interval_s
+                or self.wal_records >= self.wal_max_records
+            )
+            if due and self._child is None:
+                self._snapshot(fe)
+
+    # ------------------------------------------------------------------
+    def _snapshot(self, fe: FeatureEngineer) -> None:
+        # The new WAL segment starts exactly where the snapshot's state ends
+        self._wal.close()
+        self._seq += 1
+        seq = self._seq
+        self._open_wal()
+        self._last_snapshot = self._clock()
+        # exec()s a fresh interpreter: nothing of this process's threads or locks is inherited
+        process = mp.get_context("spawn").Process(
+            target=compact, args=(self.directory, seq, asdict(fe.config)), name=f"feature-snapshot-{seq}", daemon=True,
+        )
+        process.start()
+        self._child = (process, seq, time.perf_counter())
+
+    def _reap(self, block: bool) -> None:
+        process, seq, started = self._child
+        if block:
+            process.join(max(0.0, self.snapshot_timeout_s - (time.perf_counter() - started)))
+        elapsed = time.perf_counter() - started
+        if process.is_alive():
+            if elapsed < self.snapshot_timeout_s:
+                return
+            logger.error("Feature state snapshot %d still running after %.0fs; killing it", seq, elapsed)
+            process.kill()
+            process.join()
+        self._child = None
+        self._finished(seq, elapsed, ok=process.exitcode == 0)
+
+    def _finished(self, seq: int, seconds: float, ok: bool) -> None:
+        if not ok:
+            self.snapshot_failures += 1
+            tmp = f"{self._path('snapshot', seq)}.tmp"
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            logger.error("Feature state snapshot %d failed; keeping the previous snapshot and WAL until the next one", seq)
+            return
+        self.snapshots_written += 1
+        self.last_snapshot_seconds = round(seconds, 3)
+        # Keep the previous snapshot and the WAL after it, in case snapshot seq cannot be read back
+        older = [old for old, _ in self._files("snapshot") if old < seq]
+        keep_from = older[-1] if older else seq
+        for kind in ("snapshot", "wal"):
+            for old, path in self._files(kind):
+                if old < keep_from:
+                    os.remove(path)
+
+    def stats(self) -> dict:
+        return {
+            "walRecords": self.wal_records,
+            "snapshotsWritten": self.snapshots_written,
+            "snapshotFailures": self.snapshot_failures,
+            "lastSnapshotSeconds": self.last_snapshot_seconds,
+            "recovery": self.recovery,
+        }
+
+    def close(self) -> None:
+        with self.lock:
+            if self._wal is not None and not self._wal.closed:
+                self._wal.close()
+            if self._child is not None:
+                self._reap(block=True)
@@ -1,95 +1,314 @@
 from __future__ import annotations
 
-from collections import defaultdict
-from datetime import datetime, timedelta
-from math import radians, sin, cos, sqrt, atan2, log2
-from typing import Dict, List, Tuple
-
-LOCATION_MAP: Dict[str, Tuple[float, float]] = {
-    "NY": (40.7128, -74.0060),
-    "CA": (36.7783, -119.4179),
-    "TX": (31.9686, -99.9018),
-    "FL": (27.6648, -81.5158),
-    "WA": (47.7511, -120.7401),
-    "LONDON": (51.5072, -0.1276),
-    "PARIS": (48.8566, 2.3522),
-    "BERLIN": (52.5200, 13.4050),
-    "DUBAI": (25.2048, 55.2708),
-    "TOKYO": (35.6762, 139.6503),
-    "SYDNEY": (-33.8688, 151.2093),
-    "MUMBAI": (19.0760, 72.8777),
-    "DELHI": (28.6139, 77.2090),
-    "SINGAPORE": (1.3521, 103.8198),
-    "HONGKONG": (22.3193, 114.1694),
-    "TORONTO": (43.6532, -79.3832),
-}
+import os
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from math import log2
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+from geo import GeoIndex, default_index
+
+VELOCITY_WINDOW = timedelta(hours=1)
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _utc_key(ts: datetime) -> timedelta:
+    """Sort key placing naive (taken as UTC) and aware timestamps on one timeline."""
+    return (ts.replace(tzinfo=timezone.utc) if ts.tzinfo is None else ts) - _EPOCH
+
+
+@dataclass(frozen=True)
+class FeatureConfig:
+    """
+    Bounds on per-user feature state. 0 disables a bound.
+
+    amount_window   z-score over the last N amounts instead of the whole history
+    device_window   device entropy over the last N devices instead of the whole history
+    velocity_cap    max timestamps kept for the 1-hour velocity window (tx_freq saturates at this)
+    user_ttl_s      evict users idle for this many seconds (they restart with empty history)
+    max_users       LRU cap on the number of tracked users
+
+    Parity mode (FEATURE_PARITY_MODE=1) disables every bound and keeps timestamps that
+    fall out of the velocity window, so features equal the original full-history
+    computation: tx_freq exactly, amount_z and device_entropy up to floating-point
+    rounding (Welford and the running Σc·log2(c) are algebraically the same as the
+    two-pass formulas). geo_delta comes from geo.GeoIndex either way.
+
+    With the default bounds, values only differ when a bound is actually hit, or for
+    events arriving more than an hour behind the newest timestamp already seen for
+    that user (their velocity can undercount).
+    """
+
+    amount_window: int = 0
+    device_window: int = 0
+    velocity_cap: int = 10_000
+    user_ttl_s: float = 30 * 24 * 3600.0
+    max_users: int = 0
+    parity: bool = False
+
+    @classmethod
+    def from_env(cls) -> "FeatureConfig":
+        if os.getenv("FEATURE_PARITY_MODE", "0").lower() in ("1", "true", "yes"):
+            return cls.parity_mode()
+        return cls(
+            amount_window=int(os.getenv("FEATURE_AMOUNT_WINDOW", "0")),
+            device_window=int(os.getenv("FEATURE_DEVICE_WINDOW", "0")),
+            velocity_cap=int(os.getenv("FEATURE_VELOCITY_CAP", "10000")),
+            user_ttl_s=float(os.getenv("FEATURE_USER_TTL_SECONDS", str(30 * 24 * 3600))),
+            max_users=int(os.getenv("FEATURE_MAX_USERS", "0")),
+        )
+
+    @classmethod
+    def parity_mode(cls) -> "FeatureConfig":
+        return cls(amount_window=0, device_window=0, velocity_cap=0, user_ttl_s=0.0, max_users=0, parity=True)
 
 
 class UserState:
-    def __init__(self) -> None:
-        self.amounts: List[float] = []
-        self.timestamps: List[datetime] = []
-        self.locations: List[str] = []
-        self.devices: List[str] = []
+    """Incremental per-user state; every update and feature read is O(1) amortised."""
 
+    __slots__ = (
+        "count", "mean", "m2", "amounts",
+        "timestamps",
+        "last_location",
+        "device_counts", "device_total", "device_clogc", "devices",
+        "last_seen",
+    )
 
-class FeatureEngineer:
-    def __init__(self) -> None:
-        self.state = defaultdict(UserState)
+    def __init__(self, config: FeatureConfig) -> None:
+        # Welford running mean / sum of squared deviations over the amount history
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.amounts: Optional[Deque[float]] = deque() if config.amount_window > 0 else None
+
+        # Time-ordered timestamps, trimmed to the velocity window
+        self.timestamps: Deque[datetime] = deque()
 
-    @staticmethod
-    def _zscore(amount: float, history: List[float]) -> float:
-        if len(history) < 2:
+        self.last_location: Optional[str] = None
+
+        # Device counts plus Σ c·log2(c), so entropy = log2(N) - Σ c·log2(c) / N
+        self.device_counts: Dict[str, int] = {}
+        self.device_total = 0
+        self.device_clogc = 0.0
+        self.devices: Optional[Deque[str]] = deque() if config.device_window > 0 else None
+
+        self.last_seen = 0.0
+
+    # ------------------------------------------------------------------
+    def amount_z(self, amount: float) -> float:
+        if self.count < 2:
             return 0.0
-        mean = sum(history) / len(history)
-        variance = sum((x - mean) ** 2 for x in history) / len(history)
-        std = variance ** 0.5
-        if std == 0:
+        variance = self.m2 / self.count
+        if variance <= 0:
             return 0.0
-        return (amount - mean) / std
+        return (amount - self.mean) / variance ** 0.5
 
-    @staticmethod
-    def _haversine_km(a: str, b: str) -> float:
-        loc_a = a.upper() if a else ""
-        loc_b = b.upper() if b else ""
-        if loc_a not in LOCATION_MAP or loc_b not in LOCATION_MAP:
-            return 0.0
-        lat1, lon1 = LOCATION_MAP[loc_a]
-        lat2, lon2 = LOCATION_MAP[loc_b]
-        r = 6371.0
-        dlat = radians(lat2 - lat1)
-        dlon = radians(lon2 - lon1)
-        x = sin(dlat / 2) ** 2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2) ** 2
-        c = 2 * atan2(sqrt(x), sqrt(1 - x))
-        return r * c
-
-    @staticmethod
-    def _entropy(devices: List[str]) -> float:
-        if not devices:
+    def add_amount(self, amount: float, window: int) -> None:
+        self.count += 1
+        delta = amount - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (amount - self.mean)
+        if self.amounts is not None:
+            self.amounts.append(amount)
+            if len(self.amounts) > window:
+                self._remove_amount(self.amounts.popleft())
+
+    def _remove_amount(self, amount: float) -> None:
+        self.count -= 1
+        if self.count == 0:
+            self.mean = 0.0
+            self.m2 = 0.0
+            return
+        delta = amount - self.mean
+        self.mean -= delta / self.count
+        self.m2 = max(0.0, self.m2 - delta * (amount - self.mean))
+
+    # ------------------------------------------------------------------
+    def velocity(self, timestamp: datetime, config: FeatureConfig) -> int:
+        """Number of earlier transactions at or after timestamp - 1h."""
+        cutoff = timestamp - VELOCITY_WINDOW
+        ts = self.timestamps
+        if not config.parity and ts and timestamp >= ts[-1]:
+            while ts and ts[0] < cutoff:
+                ts.popleft()
+            return len(ts)
+        # Out-of-order event (or parity mode): the deque is sorted, so walk back from the newest
+        count = 0
+        for t in reversed(ts):
+            if t < cutoff:
+                break
+            count += 1
+        return count
+
+    def count_since(self, timestamp: datetime) -> int:
+        """velocity() without trimming the deque, for read-only lookups."""
+        cutoff = timestamp - VELOCITY_WINDOW
+        count = 0
+        for t in reversed(self.timestamps):
+            if t < cutoff:
+                break
+            count += 1
+        return count
+
+    def add_timestamp(self, timestamp: datetime, config: FeatureConfig) -> None:
+        ts = self.timestamps
+        if config.velocity_cap > 0 and len(ts) >= config.velocity_cap:
+            ts.popleft()
+        if not ts or timestamp >= ts[-1]:
+            ts.append(timestamp)
+            return
+        idx = len(ts)
+        while idx > 0 and ts[idx - 1] > timestamp:
+            idx -= 1
+        ts.insert(idx, timestamp)
+
+    # ------------------------------------------------------------------
+    def device_entropy(self) -> float:
+        n = self.device_total
+        if n == 0:
             return 0.0
-        counts = {}
-        for d in devices:
-            counts[d] = counts.get(d, 0) + 1
-        total = len(devices)
-        entropy = 0.0
-        for count in counts.values():
-            p = count / total
-            entropy -= p * log2(p)
-        return entropy
+        return max(0.0, log2(n) - self.device_clogc / n)
 
-    def build(self, user_id: str, amount: float, location: str, device_id: str, timestamp: datetime) -> List[float]:
-        user = self.state[user_id]
+    def add_device(self, device_id: str, window: int) -> None:
+        c = self.device_counts.get(device_id, 0)
+        self.device_counts[device_id] = c + 1
+        self.device_total += 1
+        self.device_clogc += (c + 1) * log2(c + 1) - (c * log2(c) if c else 0.0)
+        if self.devices is not None:
+            self.devices.append(device_id)
+            if len(self.devices) > window:
+                self._remove_device(self.devices.popleft())
+
+    def _remove_device(self, device_id: str) -> None:
+        c = self.device_counts[device_id]
+        if c == 1:
+            del self.device_counts[device_id]
+        else:
+            self.device_counts[device_id] = c - 1
+        self.device_total -= 1
+        self.device_clogc -= c * log2(c) - ((c - 1) * log2(c - 1) if c > 1 else 0.0)
+        if self.device_total == 0:
+            self.device_clogc = 0.0
 
-        amount_z = self._zscore(amount, user.amounts)
-        one_hour_ago = timestamp - timedelta(hours=1)
-        tx_freq = sum(1 for t in user.timestamps if t >= one_hour_ago)
 
-        geo_delta = self._haversine_km(user.locations[-1], location) if user.locations else 0.0
-        device_entropy = self._entropy(user.devices)
+class FeatureEngineer:
+    def __init__(
+        self,
+        config: FeatureConfig | None = None,
+        clock: Callable[[], float] = time.monotonic,
+        geo: GeoIndex | None = None,
+    ) -> None:
+        self.config = config or FeatureConfig.from_env()
+        self._clock = clock
+        self.geo = geo or default_index()
+        # Least recently seen user first, so idle eviction only inspects the head
+        self.state: "OrderedDict[str, UserState]" = OrderedDict()
+        # Write-ahead log of updates (feature_state.FeatureStateStore), attached after recovery
+        self.journal: Optional[Any] = None
+
+    def _user(self, user_id: str) -> UserState:
+        now = self._clock()
+        user = self.state.get(user_id)
+        if user is None:
+            user = UserState(self.config)
+            self.state[user_id] = user
+        else:
+            self.state.move_to_end(user_id)
+        user.last_seen = now
+        self._evict(now)
+        return user
 
-        user.amounts.append(amount)
-        user.timestamps.append(timestamp)
-        user.locations.append(location)
-        user.devices.append(device_id)
+    def _evict(self, now: float) -> None:
+        cfg = self.config
+        if cfg.max_users > 0:
+            while len(self.state) > cfg.max_users:
+                self.state.popitem(last=False)
+        if cfg.user_ttl_s > 0:
+            while self.state:
+                _, oldest = next(iter(self.state.items()))
+                if now - oldest.last_seen <= cfg.user_ttl_s:
+                    break
+                self.state.popitem(last=False)
+
+    def build(self, user_id: str, amount: float, location: str, device_id: str, timestamp: datetime) -> List[float]:
+        journal = self.journal
+        if journal is None:
+            return self._build(user_id, amount, location, device_id, timestamp)
+        # Applied and logged under one lock, so a snapshot never sees half an update.
+        # A record that fails to build changed nothing, so it is not logged either.
+        with journal.lock:
+            feats = self._build(user_id, amount, location, device_id, timestamp)
+            journal.append(user_id, amount, location, device_id, timestamp)
+            return feats
+
+    def _build(self, user_id: str, amount: float, location: str, device_id: str, timestamp: datetime) -> List[float]:
+        cfg = self.config
+        user = self.state.get(user_id)
+        if user is None:
+            amount_z, tx_freq, geo_delta, device_entropy = 0.0, 0, 0.0, 0.0
+        else:
+            # Everything that can reject the record (e.g. a naive timestamp against aware
+            # history) runs here, before any state changes
+            amount_z = user.amount_z(amount)
+            tx_freq = user.velocity(timestamp, cfg)
+            geo_delta = self.geo.distance_km(user.last_location, location) if user.last_location is not None else 0.0
+            device_entropy = user.device_entropy()
+
+        user = self._user(user_id)
+        user.add_timestamp(timestamp, cfg)
+        user.add_amount(amount, cfg.amount_window)
+        user.last_location = location
+        user.add_device(device_id, cfg.device_window)
 
         return [amount, amount_z, float(tx_freq), geo_delta, device_entropy]
+
+    def peek(self, user_id: str, amount: float, location: str, device_id: str, timestamp: datetime) -> List[float]:
+        """
+        The feature vector build() would return right now, without updating any state
+        (history, recency, eviction or journal): for explaining past or hypothetical
+        transactions.
+        """
+        user = self.state.get(user_id)
+        if user is None:
+            return [amount, 0.0, 0.0, 0.0, 0.0]
+        geo_delta = self.geo.distance_km(user.last_location, location) if user.last_location is not None else 0.0
+        return [amount, user.amount_z(amount), float(user.count_since(timestamp)), geo_delta, user.device_entropy()]
+
+    def build_batch(
+        self,
+        records: Sequence[Tuple[str, float, str, str, datetime]],
+        time_ordered: bool = True,
+        errors: Optional[Dict[int, Exception]] = None,
+    ) -> List[List[float]]:
+        """
+        Build feature vectors for (user_id, amount, location, device_id, timestamp) records.
+        State is updated in timestamp order (ties keep input order; naive timestamps count as
+        UTC), or in input order when time_ordered is False; rows are returned in input order.
+
+        With errors, a record that fails to build is reported there by index (its row is
+        left empty, and it neither changes state nor reaches the journal) instead of
+        failing the whole batch.
+        """
+        out: List[List[float]] = [[] for _ in records]
+        order = sorted(range(len(records)), key=lambda k: _utc_key(records[k][4])) if time_ordered else range(len(records))
+        try:
+            for i in order:
+                user_id, amount, location, device_id, timestamp = records[i]
+                if errors is None:
+                    out[i] = self.build(user_id, amount, location, device_id, timestamp)
+                    continue
+                try:
+                    out[i] = self.build(user_id, amount, location, device_id, timestamp)
+                except Exception as exc:  # noqa: BLE001
+                    errors[i] = exc
+        finally:
+            # Rows already built are in state and the journal either way
+            self.commit()
+        return out
+
+    def commit(self) -> None:
+        """Flush journaled updates and start a state snapshot if one is due. No-op without a journal."""
+        if self.journal is not None:
+            self.journal.commit(self)
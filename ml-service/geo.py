@@ -0,0 +1,196 @@
+"""
+Geo index for the geo_delta feature.
+
+Places come from a bundled CSV (data/locations.csv: cities, US states,
+countries, IATA codes as aliases). Every name and alias is normalised once
+(upper case, letters and digits only) and mapped to an integer place ID, so
+"New York", "new-york" and "NEWYORK" are the same place. Distances between
+IDs come from a precomputed matrix (small files) or a bounded pair cache
+(large files), so the request path is two dict lookups and an array read.
+
+A location may also be raw coordinates ("40.71,-74.01"); those resolve to the
+nearest city through a k-d tree, so geo_delta stays consistent with named
+locations (regions and countries are areas, not candidates). Unknown names resolve to -1 and score a distance of 0 km.
+
+    GEO_LOCATIONS_PATH      CSV of places (name,kind,lat,lon,aliases)
+    GEO_MATRIX_MAX_PLACES   precompute the full distance matrix up to this many places
+    GEO_CACHE_SIZE          bound on cached raw-string resolutions and distance pairs
+"""
+from __future__ import annotations
+
+import csv
+import logging
+import os
+import re
+import threading
+from math import atan2, cos, radians, sin, sqrt
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+GEO_LOCATIONS_PATH = os.getenv(
+    "GEO_LOCATIONS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "locations.csv"),
+)
+GEO_MATRIX_MAX_PLACES = int(os.getenv("GEO_MATRIX_MAX_PLACES", "2048"))
+GEO_CACHE_SIZE = int(os.getenv("GEO_CACHE_SIZE", "100000"))
+
+EARTH_RADIUS_KM = 6371.0
+UNKNOWN = -1
+
+_NON_ALNUM = re.compile(r"[^0-9A-Z]")
+_COORDS = re.compile(r"^\s*([-+]?\d{1,3}(?:\.\d+)?)\s*[,;/ ]\s*([-+]?\d{1,3}(?:\.\d+)?)\s*$")
+
+
+def normalize(name: str) -> str:
+    return _NON_ALNUM.sub("", name.upper())
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    dlat = radians(lat2 - lat1)
+    dlon = radians(lon2 - lon1)
+    x = sin(dlat / 2) ** 2 + cos(radians(lat1)) * cos(radians(lat2)) * sin(dlon / 2) ** 2
+    return EARTH_RADIUS_KM * 2 * atan2(sqrt(x), sqrt(1 - x))
+
+
+def _unit_vectors(lat_deg: np.ndarray, lon_deg: np.ndarray) -> np.ndarray:
+    lat, lon = np.radians(lat_deg), np.radians(lon_deg)
+    return np.column_stack((np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)))
+
+
+class GeoIndex:
+    def __init__(
+        self,
+        names: list[str],
+        lat: np.ndarray,
+        lon: np.ndarray,
+        aliases: dict[str, int] | None = None,
+        kinds: list[str] | None = None,
+        matrix_max_places: int = GEO_MATRIX_MAX_PLACES,
+        cache_size: int = GEO_CACHE_SIZE,
+    ) -> None:
+        self.names = names
+        self.kinds = kinds or ["place"] * len(names)
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self._ids: dict[str, int] = {}
+        for i, name in enumerate(names):
+            self._ids.setdefault(normalize(name), i)
+        for alias, i in (aliases or {}).items():
+            self._ids.setdefault(normalize(alias), i)
+
+        self._cache_size = max(1, cache_size)
+        # Raw request string -> place ID; filled on first sight of each spelling
+        self._resolved: dict[str, int] = {}
+        self._matrix: np.ndarray | None = (
+            self._distance_matrix() if len(names) <= matrix_max_places else None
+        )
+        self._pairs: dict[int, float] = {}
+        self._tree = None
+        self._tree_ids: np.ndarray | None = None
+        self._tree_lock = threading.Lock()
+
+    @classmethod
+    def from_csv(cls, path: str = GEO_LOCATIONS_PATH, **kwargs) -> "GeoIndex":
+        names: list[str] = []
+        kinds: list[str] = []
+        lat: list[float] = []
+        lon: list[float] = []
+        aliases: dict[str, int] = {}
+        with open(path, newline="", encoding="utf-8") as f:
+            rows = csv.DictReader(line for line in f if not line.startswith("#"))
+            for row in rows:
+                i = len(names)
+                names.append(row["name"])
+                kinds.append(row.get("kind") or "place")
+                lat.append(float(row["lat"]))
+                lon.append(float(row["lon"]))
+                for alias in (row.get("aliases") or "").split("|"):
+                    if alias:
+                        aliases.setdefault(alias, i)
+        return cls(names, np.array(lat), np.array(lon), aliases, kinds, **kwargs)
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def _distance_matrix(self) -> np.ndarray:
+        # Same haversine as haversine_km, vectorised over every pair
+        lat, lon = np.radians(self.lat), np.radians(self.lon)
+        dlat = lat[None, :] - lat[:, None]
+        dlon = lon[None, :] - lon[:, None]
+        x = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlon / 2) ** 2
+        return EARTH_RADIUS_KM * 2 * np.arctan2(np.sqrt(x), np.sqrt(1 - x))
+
+    # ------------------------------------------------------------------
+    def resolve(self, location: str) -> int:
+        """Place ID for a name, alias or "lat,lon" string; UNKNOWN (-1) if none."""
+        place = self._resolved.get(location)
+        if place is not None:
+            return place
+        place = self._ids.get(normalize(location), UNKNOWN)
+        if place == UNKNOWN:
+            match = _COORDS.match(location)
+            if match:
+                lat, lon = float(match.group(1)), float(match.group(2))
+                if -90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0:
+                    place = self.nearest(lat, lon)
+        if len(self._resolved) >= self._cache_size:
+            self._resolved.clear()
+        self._resolved[location] = place
+        return place
+
+    def nearest(self, lat: float, lon: float) -> int:
+        """ID of the city closest to (lat, lon) by great-circle distance (any place if there are no cities)."""
+        if self._tree is None:
+            with self._tree_lock:
+                if self._tree is None:
+                    from scipy.spatial import cKDTree  # noqa: PLC0415 — only needed for raw coordinates
+
+                    ids = np.flatnonzero(np.array(self.kinds) == "city")
+                    self._tree_ids = ids if len(ids) else np.arange(len(self.names))
+                    # Chord distance between unit vectors is monotonic in great-circle distance
+                    self._tree = cKDTree(_unit_vectors(self.lat[self._tree_ids], self.lon[self._tree_ids]))
+        _, idx = self._tree.query(_unit_vectors(np.array([lat]), np.array([lon]))[0])
+        return int(self._tree_ids[idx])
+
+    def distance_ids(self, a: int, b: int) -> float:
+        if a < 0 or b < 0:
+            return 0.0
+        if self._matrix is not None:
+            return float(self._matrix[a, b])
+        key = a * len(self.names) + b if a <= b else b * len(self.names) + a
+        km = self._pairs.get(key)
+        if km is None:
+            km = haversine_km(self.lat[a], self.lon[a], self.lat[b], self.lon[b])
+            if len(self._pairs) >= self._cache_size:
+                self._pairs.clear()
+            self._pairs[key] = km
+        return km
+
+    def distance_km(self, a: str, b: str) -> float:
+        """Great-circle km between two locations; 0.0 when either is unknown."""
+        return self.distance_ids(self.resolve(a), self.resolve(b))
+
+    def place(self, place_id: int) -> dict:
+        return {
+            "id": place_id,
+            "name": self.names[place_id],
+            "kind": self.kinds[place_id],
+            "lat": float(self.lat[place_id]),
+            "lon": float(self.lon[place_id]),
+        }
+
+
+_default: GeoIndex | None = None
+_default_lock = threading.Lock()
+
+
+def default_index() -> GeoIndex:
+    """The process-wide index over GEO_LOCATIONS_PATH, loaded on first use."""
+    global _default
+    if _default is None:
+        with _default_lock:
+            if _default is None:
+                _default = GeoIndex.from_csv(GEO_LOCATIONS_PATH)
+                logger.info("Geo index: %d places, %d names from %s", len(_default), len(_default._ids), GEO_LOCATIONS_PATH)
+    return _default
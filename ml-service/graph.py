@@ -0,0 +1,331 @@
+"""
+In-memory entity graph over the /predict stream.
+
+Users link to the devices, IP addresses and locations they transact from. A
+union-find over user-device and user-IP links groups users that share
+hardware or networks into clusters (candidate fraud rings). Every cluster keeps
+running aggregates at its root (nodes, users, edges, transactions, flagged
+transactions, fraud-score sum, shared devices / IPs), merged in O(1) on union,
+so a transaction updates the graph in a few dict lookups and near-constant
+finds, and analytics walk only the multi-user clusters.
+
+Locations are recorded as nodes and links but never merge clusters: a city is
+shared by everyone. For the same reason a device or IP linked to more than
+GRAPH_HUB_DEGREE users (an office proxy, a shared kiosk) stops merging.
+
+graphScore for a transaction is its user's cluster score right after linking,
+before its own outcome is counted: ring size and shared-entity pressure
+weighted by the cluster's flagged-transaction rate, smoothed towards zero for
+clusters with little history. Single-user clusters score 0.
+
+    GRAPH_ENABLED          1 / 0 (default 1)
+    GRAPH_MAX_NODES        node cap; entities past it are not added (default 1000000)
+    GRAPH_HUB_DEGREE       users after which a device / IP stops merging (default 50)
+    GRAPH_RING_USERS       users at which the ring-size factor saturates (default 4)
+    GRAPH_RING_SHARED      shared devices + IPs at which sharing saturates (default 3)
+    GRAPH_PRIOR_TX         pseudo-count of clean transactions in the fraud rate (default 5)
+"""
+from __future__ import annotations
+
+import os
+import threading
+from array import array
+from typing import Sequence
+
+GRAPH_ENABLED = os.getenv("GRAPH_ENABLED", "1").lower() in ("1", "true", "yes")
+GRAPH_MAX_NODES = int(os.getenv("GRAPH_MAX_NODES", "1000000"))
+GRAPH_HUB_DEGREE = int(os.getenv("GRAPH_HUB_DEGREE", "50"))
+GRAPH_RING_USERS = int(os.getenv("GRAPH_RING_USERS", "4"))
+GRAPH_RING_SHARED = int(os.getenv("GRAPH_RING_SHARED", "3"))
+GRAPH_PRIOR_TX = float(os.getenv("GRAPH_PRIOR_TX", "5"))
+
+USER, DEVICE, LOCATION, IP = range(4)
+KIND_NAMES = ("USER", "DEVICE", "LOCATION", "IP")
+
+
+class _Cluster:
+    """Aggregates of one union-find component; only meaningful at its root."""
+
+    __slots__ = (
+        "nodes", "users", "links", "transactions", "flagged", "score_sum",
+        "shared_devices", "shared_ips",
+    )
+
+    def __init__(self, node: int, is_user: bool) -> None:
+        self.nodes = 1
+        self.users = int(is_user)
+        self.links = 0  # user-device and user-IP links inside the cluster
+        self.transactions = 0
+        self.flagged = 0
+        self.score_sum = 0.0
+        self.shared_devices = 0
+        self.shared_ips = 0
+
+    def absorb(self, other: "_Cluster") -> None:
+        self.nodes += other.nodes
+        self.users += other.users
+        self.links += other.links
+        self.transactions += other.transactions
+        self.flagged += other.flagged
+        self.score_sum += other.score_sum
+        self.shared_devices += other.shared_devices
+        self.shared_ips += other.shared_ips
+
+
+class EntityGraph:
+    def __init__(
+        self,
+        max_nodes: int = GRAPH_MAX_NODES,
+        hub_degree: int = GRAPH_HUB_DEGREE,
+        ring_users: int = GRAPH_RING_USERS,
+        ring_shared: int = GRAPH_RING_SHARED,
+        prior_tx: float = GRAPH_PRIOR_TX,
+    ) -> None:
+        self._max_nodes = max_nodes
+        self._hub_degree = hub_degree
+        self._ring_users = max(1, ring_users)
+        self._ring_shared = max(1, ring_shared)
+        self._prior_tx = prior_tx
+        self._lock = threading.Lock()
+
+        # Per-node columns; compact arrays rather than lists of boxed ints
+        self._ids: dict[tuple[int, str], int] = {}
+        self._kind = bytearray()
+        self._name: list[str] = []
+        self._parent = array("q")
+        self._next = array("q")  # circular list of each cluster's members, spliced on union
+        self._degree = array("q")  # distinct neighbours
+        self._tx = array("q")
+        self._flagged = array("q")
+        self._score_sum = array("d")
+        self._clusters: list[_Cluster | None] = []  # set at roots, None once absorbed
+        # Neighbours of users, devices and IPs; location nodes keep none (they neighbour everyone).
+        # A user's list is short, so it also dedupes links
+        self._adj: list[list[int] | None] = []
+        self._edge_count = 0
+        self._rings: set[int] = set()  # roots of clusters with two or more users
+        self.nodes_dropped = 0
+
+    # ------------------------------------------------------------------
+    def _node(self, kind: int, name: str) -> int:
+        key = (kind, name)
+        node = self._ids.get(key)
+        if node is not None:
+            return node
+        if len(self._name) >= self._max_nodes:
+            self.nodes_dropped += 1
+            return -1
+        node = len(self._name)
+        self._ids[key] = node
+        self._kind.append(kind)
+        self._name.append(name)
+        self._parent.append(node)
+        self._next.append(node)
+        self._clusters.append(_Cluster(node, kind == USER))
+        self._degree.append(0)
+        self._tx.append(0)
+        self._flagged.append(0)
+        self._score_sum.append(0.0)
+        self._adj.append(None if kind == LOCATION else [])
+        return node
+
+    def _find(self, node: int) -> int:
+        parent = self._parent
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]  # path halving
+            node = parent[node]
+        return node
+
+    def _union(self, a: int, b: int) -> int:
+        ra, rb = self._find(a), self._find(b)
+        if ra == rb:
+            return ra
+        ca, cb = self._clusters[ra], self._clusters[rb]
+        if ca.nodes < cb.nodes:
+            ra, rb, ca, cb = rb, ra, cb, ca
+        self._parent[rb] = ra
+        ca.absorb(cb)
+        nxt = self._next
+        nxt[ra], nxt[rb] = nxt[rb], nxt[ra]  # splice the two member rings
+        self._clusters[rb] = None
+        self._rings.discard(rb)
+        if ca.users >= 2:
+            self._rings.add(ra)
+        return ra
+
+    def _link(self, user: int, other: int) -> None:
+        if other in self._adj[user]:
+            return
+        self._edge_count += 1
+        self._degree[user] += 1
+        self._degree[other] += 1
+        self._adj[user].append(other)
+        kind = self._kind[other]
+        if kind == LOCATION:
+            return
+        self._adj[other].append(user)
+        if self._degree[other] <= self._hub_degree:
+            root = self._union(user, other)
+        else:
+            root = self._find(user)
+        cluster = self._clusters[root]
+        cluster.links += 1
+        if self._degree[other] == 2:
+            # A second user on this device / IP: it is now shared, in whichever cluster holds it
+            shared = self._clusters[self._find(other)]
+            if kind == DEVICE:
+                shared.shared_devices += 1
+            else:
+                shared.shared_ips += 1
+
+    def _cluster_score(self, cluster: _Cluster) -> float:
+        if cluster.users < 2:
+            return 0.0
+        ring = min(1.0, (cluster.users - 1) / self._ring_users)
+        sharing = min(1.0, (cluster.shared_devices + cluster.shared_ips) / self._ring_shared)
+        fraud = cluster.flagged / (cluster.transactions + self._prior_tx)
+        return ring * (0.5 * fraud + 0.5 * sharing)
+
+    # ------------------------------------------------------------------
+    def observe(
+        self,
+        user_id: str,
+        device_id: str,
+        location: str,
+        ip_address: str | None,
+        fraud_score: float,
+        is_fraud: bool,
+    ) -> tuple[float, dict | None]:
+        """Link one scored transaction into the graph; returns (graphScore, graphMetrics)."""
+        with self._lock:
+            return self._observe(user_id, device_id, location, ip_address, fraud_score, is_fraud)
+
+    def observe_batch(self, rows: Sequence[tuple[str, str, str, str | None, float, bool]]) -> list[tuple[float, dict | None]]:
+        """observe() for (user_id, device_id, location, ip_address, fraud_score, is_fraud) rows, in order, under one lock."""
+        with self._lock:
+            return [self._observe(*row) for row in rows]
+
+    def _observe(
+        self,
+        user_id: str,
+        device_id: str,
+        location: str,
+        ip_address: str | None,
+        fraud_score: float,
+        is_fraud: bool,
+    ) -> tuple[float, dict | None]:
+        user = self._node(USER, user_id)
+        if user < 0:
+            return 0.0, None
+        touched = [user]
+        for kind, name in ((DEVICE, device_id), (IP, ip_address), (LOCATION, location)):
+            if name:
+                other = self._node(kind, name)
+                if other >= 0:
+                    self._link(user, other)
+                    if kind != LOCATION:
+                        touched.append(other)
+
+        root = self._find(user)
+        cluster = self._clusters[root]
+        score = self._cluster_score(cluster)
+        metrics = {
+            "clusterId": f"{KIND_NAMES[self._kind[root]]}:{self._name[root]}",
+            "clusterSize": cluster.nodes,
+            "clusterUsers": cluster.users,
+            "sharedDeviceCount": cluster.shared_devices,
+            "sharedIPCount": cluster.shared_ips,
+            "clusterFraudRate": round(cluster.flagged / cluster.transactions, 4) if cluster.transactions else 0.0,
+        }
+
+        # Count the outcome only after scoring, so a transaction never raises its own graphScore
+        cluster.transactions += 1
+        cluster.flagged += int(is_fraud)
+        cluster.score_sum += fraud_score
+        for node in touched:
+            self._tx[node] += 1
+            self._flagged[node] += int(is_fraud)
+            self._score_sum[node] += fraud_score
+        return round(score, 4), metrics
+
+    # ------------------------------------------------------------------
+    def _cluster_summary(self, root: int) -> dict:
+        c = self._clusters[root]
+        entities = c.nodes - c.users
+        return {
+            "clusterId": f"{KIND_NAMES[self._kind[root]]}:{self._name[root]}",
+            "size": c.nodes,
+            "users": c.users,
+            "devicesAndIPs": entities,
+            "links": c.links,
+            # Share of possible user-device / user-IP links present (bipartite density)
+            "density": round(c.links / (c.users * entities), 4) if c.users and entities else 0.0,
+            "transactions": c.transactions,
+            "fraudRate": round(c.flagged / c.transactions, 4) if c.transactions else 0.0,
+            "fraudScoreMean": round(c.score_sum / c.transactions, 4) if c.transactions else 0.0,
+            "sharedDeviceCount": c.shared_devices,
+            "sharedIPCount": c.shared_ips,
+            "graphScore": round(self._cluster_score(c), 4),
+        }
+
+    def analytics(self, limit: int = 50, max_nodes: int = 500) -> dict:
+        """
+        The riskiest multi-user clusters (by graphScore, then size) and their member
+        nodes in the shape the gateway's graph view reads. Cost is O(clusters) plus
+        the members returned.
+        """
+        with self._lock:
+            clusters = sorted(
+                (self._cluster_summary(root) | {"_root": root} for root in self._rings),
+                key=lambda c: (-c["graphScore"], -c["size"]),
+            )[:limit]
+            nodes = []
+            for cluster in clusters:
+                root = cluster.pop("_root")
+                node = root
+                while len(nodes) < max_nodes:
+                    nodes.append(self._node_summary(node, cluster))
+                    node = self._next[node]
+                    if node == root:
+                        break
+            return {
+                "nodes": nodes,
+                "clusters": clusters,
+                "totalNodes": len(self._name),
+                "totalEdges": self._edge_count,
+                "totalClusters": len(self._rings),
+                "nodesDropped": self.nodes_dropped,
+            }
+
+    def _node_summary(self, node: int, cluster: dict) -> dict:
+        neighbours = self._adj[node] or []
+        flagged = sum(1 for n in neighbours if self._flagged[n])
+        tx = self._tx[node]
+        return {
+            "nodeId": self._name[node],
+            "type": KIND_NAMES[self._kind[node]],
+            "clusterId": cluster["clusterId"],
+            "degree": self._degree[node],
+            "transactions": tx,
+            "fraudScore": round(self._score_sum[node] / tx, 4) if tx else 0.0,
+            "fraudNeighborRatio": round(flagged / len(neighbours), 4) if neighbours else 0.0,
+            "clusterDensity": cluster["density"],
+            "graphScore": cluster["graphScore"],
+            "sharedDeviceCount": cluster["sharedDeviceCount"],
+            "sharedIPCount": cluster["sharedIPCount"],
+        }
+
+    def __len__(self) -> int:
+        return len(self._name)
+
+    @property
+    def cluster_count(self) -> int:
+        return len(self._rings)
+
+    def stats(self) -> dict:
+        return {
+            "nodes": len(self._name),
+            "edges": self._edge_count,
+            "clusters": len(self._rings),
+            "nodesDropped": self.nodes_dropped,
+        }
@@ -0,0 +1,165 @@
+"""
+Idempotency cache for /predict.
+
+The gateway retries on timeouts and can submit the same transaction twice.
+Scoring a duplicate would append it to the user's feature history a second
+time (inflating velocity, skewing the z-score) and re-run the ensemble. Each
+request is keyed by its transactionId when the caller sends one, else by a
+hash of (userId, amount, location, deviceId, timestamp). A repeat within the
+TTL gets the first response back without touching feature state or models.
+A repeat that arrives while the first is still being scored waits for that
+result instead of scoring again.
+
+A transactionId names one transaction: a repeat carrying the same id with a
+different body is a client bug, and raises IdempotencyConflict instead of
+replaying a score computed for other data. The entry keeps a fingerprint of
+the body for that check.
+
+Fields that shape the response without changing the score (explain) are not
+part of the key: a retry must not score the transaction a second time. They
+form the entry's variant instead, and a repeat asking for a different variant
+raises IdempotencyConflict (409 in main) rather than getting back a response
+it did not ask for.
+
+The cache lives on the event loop (all access happens in async handlers), so
+it needs no locks.
+
+    IDEMPOTENCY_ENABLED       1 / 0
+    IDEMPOTENCY_MAX_ENTRIES   LRU bound
+    IDEMPOTENCY_TTL_SECONDS   how long a response can be replayed
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Awaitable, Callable
+
+from prometheus_client import Counter
+
+IDEMPOTENCY_ENABLED = os.getenv("IDEMPOTENCY_ENABLED", "1").lower() in ("1", "true", "yes")
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "100000"))
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "600"))
+
+
+class IdempotencyConflict(ValueError):
+    """A repeat of a cached or in-flight request had a different body or asked for a different response variant."""
+
+
+def request_fingerprint(user_id: str, amount: float, location: str, device_id: str, timestamp: datetime) -> str:
+    raw = "\x1f".join((user_id, repr(float(amount)), location, device_id, timestamp.isoformat()))
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def request_key(
+    transaction_id: str | None,
+    user_id: str,
+    amount: float,
+    location: str,
+    device_id: str,
+    timestamp: datetime,
+) -> str:
+    if transaction_id:
+        return f"id:{transaction_id}"
+    return "h:" + request_fingerprint(user_id, amount, location, device_id, timestamp)
+
+
+class IdempotencyCache:
+    def __init__(
+        self,
+        max_entries: int = IDEMPOTENCY_MAX_ENTRIES,
+        ttl_s: float = IDEMPOTENCY_TTL_SECONDS,
+        lookups: Counter | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._max_entries = max(1, max_entries)
+        self._ttl_s = ttl_s
+        self._clock = clock
+        # key -> (expires_at, fingerprint, variant, response) / (fingerprint, variant, future)
+        self._entries: OrderedDict[str, tuple[float, str, str, dict]] = OrderedDict()
+        self._inflight: dict[str, tuple[str, str, asyncio.Future]] = {}
+        self.hits = 0
+        self.misses = 0
+        self._count = {
+            result: lookups.labels(result=result).inc for result in ("hit", "inflight", "miss")
+        } if lookups is not None else {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _record(self, result: str) -> None:
+        if result == "miss":
+            self.misses += 1
+        else:
+            self.hits += 1
+        if self._count:
+            self._count[result]()
+
+    def _get(self, key: str) -> tuple[str, str, dict] | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= self._clock():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[1:]
+
+    def _put(self, key: str, fingerprint: str, variant: str, response: dict) -> None:
+        self._entries[key] = (self._clock() + self._ttl_s, fingerprint, variant, response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    # ------------------------------------------------------------------
+    async def get_or_compute(
+        self, key: str, compute: Callable[[], Awaitable[dict]], variant: str = "", fingerprint: str = ""
+    ) -> dict:
+        cached = self._get(key)
+        if cached is not None:
+            _check_repeat(key, cached[:2], (fingerprint, variant))
+            self._record("hit")
+            return cached[2]
+        pending = self._inflight.get(key)
+        if pending is not None:
+            _check_repeat(key, pending[:2], (fingerprint, variant))
+            self._record("inflight")
+            return await asyncio.shield(pending[2])
+
+        self._record("miss")
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = (fingerprint, variant, future)
+        try:
+            response = await compute()
+        except BaseException as exc:
+            # Failures are not cached; concurrent duplicates see the same error
+            future.set_exception(exc)
+            future.exception()  # mark retrieved: there may be no waiters
+            raise
+        finally:
+            self._inflight.pop(key, None)
+        self._put(key, fingerprint, variant, response)
+        future.set_result(response)
+        return response
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": round(self.hits / lookups, 4) if lookups else None,
+        }
+
+
+def _check_repeat(key: str, stored: tuple[str, str], requested: tuple[str, str]) -> None:
+    if stored[0] != requested[0]:
+        raise IdempotencyConflict(f"{key} was first requested with a different body")
+    stored, requested = stored[1], requested[1]
+    if stored != requested:
+        raise IdempotencyConflict(
+            f"{key} was first requested as {stored or 'default'!r}; this repeat asks for {requested or 'default'!r}"
+        )
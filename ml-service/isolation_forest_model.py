@@ -1,51 +1,318 @@
-"""
-Isolation Forest anomaly model — extracted and improved from the original model.py.
-"""
-from __future__ import annotations
-
-import numpy as np
-from sklearn.ensemble import IsolationForest
-
-
-class IsolationForestModel:
-    """
-    Wrapper around sklearn IsolationForest.
-    Outputs a probability in [0, 1] — higher means more likely fraudulent.
-    """
-
-    def __init__(self, n_estimators: int = 200, contamination: float = 0.05) -> None:
-        self._clf = IsolationForest(
-            n_estimators=n_estimators,
-            contamination=contamination,
-            random_state=42,
-        )
-        self.is_fitted = False
-        self.version = "1.0.0"
-        self.name = "isolation_forest"
-
-    # ------------------------------------------------------------------
-    def train(self, X: np.ndarray) -> None:
-        self._clf.fit(X)
-        self.is_fitted = True
-
-    def train_on_synthetic(self) -> None:
-        rng = np.random.default_rng(42)
-        normal = np.column_stack([
-            rng.normal(120, 40, 5000),
-            rng.normal(0, 1, 5000),
-            rng.poisson(2, 5000),
-            rng.normal(15, 8, 5000),
-            rng.normal(0.7, 0.2, 5000),
-        ])
-        self.train(normal)
-
-    # ------------------------------------------------------------------
-    def score(self, features: list[float]) -> float:
-        """Return fraud probability in [0, 1]."""
-        if not self.is_fitted:
-            self.train_on_synthetic()
-        vec = np.array([features])
-        decision = float(self._clf.decision_function(vec)[0])
-        # Lower decision score → higher anomaly → higher fraud probability
-        prob = 1.0 / (1.0 + np.exp(8.0 * decision))
-        return float(np.clip(prob, 0.0, 1.0))
+"""
+Isolation Forest anomaly model — extracted and improved from the original model.py.
+
+Inference runs on a flattened copy of the fitted forest (CompiledForest) instead of
+sklearn's decision_function, which spends most of its time on input validation and
+per-estimator Python/joblib overhead. Set IF_ENGINE=sklearn to force the sklearn path.
+
+save() writes the compiled arrays next to the joblib artifact. load() serves from
+them when they match the artifact and only unpickles the sklearn forest (and
+imports sklearn) when something needs it: an update, a save, or IF_ENGINE=sklearn.
+"""
+from __future__ import annotations
+
+import copy
+import logging
+import os
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+from feature_log import FeatureLogReader
+from drift import DriftReference, fit_reference, load_reference, save_reference
+from registry import artifact_path, load_compiled, save_compiled
+
+if TYPE_CHECKING:
+    from sklearn.ensemble import IsolationForest
+
+logger = logging.getLogger(__name__)
+
+IF_ENGINE = os.getenv("IF_ENGINE", "compiled")
+IF_TRAIN_MAX_ROWS = int(os.getenv("IF_TRAIN_MAX_ROWS", "200000"))
+# Share of the forest an incremental update regrows on new data (oldest trees are dropped)
+IF_REFRESH_FRACTION = float(os.getenv("IF_REFRESH_FRACTION", "0.2"))
+
+
+def _average_path_length(n: np.ndarray) -> np.ndarray:
+    """c(n): average path length of an unsuccessful BST search over n samples (as in sklearn)."""
+    n = np.asarray(n, dtype=np.float64)
+    out = np.zeros_like(n)
+    out[n == 2] = 1.0
+    big = n > 2
+    out[big] = 2.0 * (np.log(n[big] - 1.0) + np.euler_gamma) - 2.0 * (n[big] - 1.0) / n[big]
+    return out
+
+
+class CompiledForest:
+    """
+    All isolation trees packed into contiguous node arrays.
+
+    child[2*i] / child[2*i + 1] are the left / right children of node i, and leaves
+    point to themselves, so scoring is a fixed number of vectorised steps (the
+    forest's max depth) over an (N, n_trees) matrix of node indices; no per-tree
+    Python loop. leaf_value holds the per-tree path length sklearn
+    accumulates: edges from root to leaf + c(n_samples(leaf)).
+    """
+
+    def __init__(self, clf: IsolationForest) -> None:
+        features, thresholds, lefts, rights, leaf_values, roots = [], [], [], [], [], []
+        subsample = clf._max_features != clf.n_features_in_
+        offset = 0
+        max_depth = 0
+        for est, est_features in zip(clf.estimators_, clf.estimators_features_):
+            tree = est.tree_
+            n = tree.node_count
+            left = tree.children_left.astype(np.int64)
+            right = tree.children_right.astype(np.int64)
+            is_leaf = left == -1
+
+            depth = np.zeros(n, dtype=np.int64)
+            for node in range(n):  # children always have larger ids than their parent
+                if not is_leaf[node]:
+                    depth[left[node]] = depth[node] + 1
+                    depth[right[node]] = depth[node] + 1
+            max_depth = max(max_depth, int(depth.max()))
+
+            feat = tree.feature.astype(np.int64)
+            if subsample:
+                feat = np.where(is_leaf, 0, np.asarray(est_features)[np.where(is_leaf, 0, feat)])
+            own = np.arange(n, dtype=np.int64) + offset
+            features.append(np.where(is_leaf, 0, feat))
+            thresholds.append(np.where(is_leaf, 0.0, tree.threshold))
+            lefts.append(np.where(is_leaf, own, left + offset))
+            rights.append(np.where(is_leaf, own, right + offset))
+            leaf_values.append(depth + _average_path_length(tree.n_node_samples))
+            roots.append(offset)
+            offset += n
+
+        self.feature = np.concatenate(features).astype(np.intp)
+        self.threshold = np.ascontiguousarray(np.concatenate(thresholds), dtype=np.float64)
+        self.child = np.empty(2 * offset, dtype=np.intp)
+        self.child[0::2] = np.concatenate(lefts)
+        self.child[1::2] = np.concatenate(rights)
+        self.leaf_value = np.ascontiguousarray(np.concatenate(leaf_values), dtype=np.float64)
+        self.roots = np.asarray(roots, dtype=np.intp)
+        self.max_depth = max_depth
+        self.denominator = len(clf.estimators_) * float(_average_path_length(np.array([clf.max_samples_]))[0])
+        self.offset = float(clf.offset_)
+
+    # Rows per traversal chunk: keeps the (rows, n_trees) index matrices cache-resident
+    CHUNK_ROWS = 256
+
+    _ARRAYS = ("feature", "threshold", "child", "leaf_value", "roots")
+
+    def to_arrays(self) -> dict[str, np.ndarray]:
+        return {
+            **{name: getattr(self, name) for name in self._ARRAYS},
+            "scalars": np.array([self.max_depth, self.denominator, self.offset], dtype=np.float64),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays: dict[str, np.ndarray]) -> "CompiledForest":
+        forest = cls.__new__(cls)
+        for name in cls._ARRAYS:
+            setattr(forest, name, arrays[name])
+        max_depth, forest.denominator, forest.offset = (float(v) for v in arrays["scalars"])
+        forest.max_depth = int(max_depth)
+        return forest
+
+    def decision_function(self, X: np.ndarray) -> np.ndarray:
+        # sklearn validates input to float32 before walking the trees; match that rounding
+        X = np.ascontiguousarray(np.asarray(X, dtype=np.float32), dtype=np.float64)
+        depths = np.empty(X.shape[0], dtype=np.float64)
+        for start in range(0, X.shape[0], self.CHUNK_ROWS):
+            depths[start:start + self.CHUNK_ROWS] = self._path_lengths(X[start:start + self.CHUNK_ROWS])
+        if self.denominator == 0:
+            scores = np.ones_like(depths)
+        else:
+            scores = 2.0 ** (-depths / self.denominator)
+        return -scores - self.offset
+
+    def _path_lengths(self, X: np.ndarray) -> np.ndarray:
+        n_rows, n_features = X.shape
+        flat = X.ravel()
+        row_base = (np.arange(n_rows, dtype=np.intp) * n_features)[:, None]
+        node = np.empty((n_rows, self.roots.shape[0]), dtype=np.intp)
+        node[:] = self.roots
+        for _ in range(self.max_depth):
+            go_right = flat[row_base + self.feature[node]] > self.threshold[node]
+            node = self.child[2 * node + go_right]
+        return self.leaf_value[node].sum(axis=1)
+
+
+class IsolationForestModel:
+    """
+    Wrapper around sklearn IsolationForest.
+    Outputs a probability in [0, 1] — higher means more likely fraudulent.
+    """
+
+    supervised = False
+
+    def __init__(self, n_estimators: int = 200, contamination: float = 0.05) -> None:
+        self._params = {"n_estimators": n_estimators, "contamination": contamination, "random_state": 42}
+        self._clf: IsolationForest | None = None
+        self._path: str | None = None  # artifact the sklearn forest is loaded from on first use
+        self._compiled: CompiledForest | None = None
+        self.reference: DriftReference | None = None  # training distribution, for drift
+        self.is_fitted = False
+        self.version = "1.0.0"
+        self.name = "isolation_forest"
+
+    # ------------------------------------------------------------------
+    def _compile(self) -> None:
+        self._compiled = None
+        if IF_ENGINE != "compiled":
+            return
+        try:
+            self._compiled = CompiledForest(self._clf)
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Could not compile IsolationForest, using sklearn inference: %s", exc)
+
+    def _forest(self) -> IsolationForest:
+        """The sklearn forest; loaded from the artifact on first use when load() did not need it."""
+        if self._clf is None:
+            if self._path is None:
+                from sklearn.ensemble import IsolationForest  # noqa: PLC0415
+
+                self._clf = IsolationForest(**self._params)
+            else:
+                self._clf = self._unpickle(self._path)
+        return self._clf
+
+    def load_deferred(self) -> None:
+        """Load what load() left for later, so the first call that needs it does not pay for it."""
+        if self.is_fitted:
+            self._forest()
+
+    def train(self, X: np.ndarray) -> None:
+        from sklearn.ensemble import IsolationForest  # noqa: PLC0415
+
+        self._clf = IsolationForest(**self._params)
+        self._path = None
+        self._clf.fit(X)
+        self._compile()
+        self.is_fitted = True
+        self.reference = fit_reference(self, X)
+
+    def train_from_log(self, reader: FeatureLogReader) -> int:
+        """
+        Fit on a uniform sample of at most IF_TRAIN_MAX_ROWS feature-log rows. Each tree
+        only sees max_samples (256) rows, so sampling up front loses nothing while
+        keeping memory bounded for logs of any size. Returns the rows used.
+        """
+        records = reader.sample(IF_TRAIN_MAX_ROWS)
+        if len(records) == 0:
+            raise ValueError("feature log is empty")
+        self.train(records["features"])
+        return len(records)
+
+    def update(self, X: np.ndarray, y: np.ndarray | None = None, seed: int = 0) -> dict:
+        """
+        Incremental update: grow IF_REFRESH_FRACTION of the forest on X and drop the same
+        number of oldest trees, then recompute the contamination offset on X. Keeps the
+        forest size and max_samples, so scores stay on the same scale. y is ignored.
+        With fewer than max_samples rows (a young feature log) the current trees are
+        kept unchanged, and the returned summary says why.
+        """
+        from sklearn.ensemble import IsolationForest  # noqa: PLC0415
+
+        old = self._forest()
+        n_new = max(1, round(len(old.estimators_) * IF_REFRESH_FRACTION))
+        if X.shape[0] < old.max_samples_:
+            reason = f"need at least {old.max_samples_} rows to grow new trees, got {X.shape[0]}"
+            logger.warning("Keeping the current IsolationForest trees: %s", reason)
+            return {"treesReplaced": 0, "trees": len(old.estimators_), "skipped": reason}
+        grown = IsolationForest(
+            n_estimators=n_new,
+            max_samples=old.max_samples_,
+            contamination=old.contamination,
+            random_state=seed,
+        ).fit(X)
+
+        # sklearn caches per-tree data next to estimators_; keep every per-tree sequence aligned
+        clf = copy.copy(old)
+        clf.estimators_ = old.estimators_[n_new:] + grown.estimators_
+        clf.estimators_features_ = old.estimators_features_[n_new:] + grown.estimators_features_
+        clf._seeds = np.concatenate([old._seeds[n_new:], grown._seeds])
+        clf._average_path_length_per_tree = (
+            tuple(old._average_path_length_per_tree[n_new:]) + tuple(grown._average_path_length_per_tree)
+        )
+        clf._decision_path_lengths = tuple(old._decision_path_lengths[n_new:]) + tuple(grown._decision_path_lengths)
+        clf.offset_ = float(np.percentile(clf.score_samples(X), 100.0 * clf.contamination))
+
+        self._clf = clf
+        self._path = None
+        self._compile()
+        self.is_fitted = True
+        self.reference = fit_reference(self, X)
+        return {"treesReplaced": n_new, "trees": len(clf.estimators_)}
+
+    @staticmethod
+    def synthetic_data(seed: int = 42, n: int = 5000) -> tuple[np.ndarray, None]:
+        rng = np.random.default_rng(seed)
+        normal = np.column_stack([
+            rng.normal(120, 40, n),
+            rng.normal(0, 1, n),
+            rng.poisson(2, n),
+            rng.normal(15, 8, n),
+            rng.normal(0.7, 0.2, n),
+        ])
+        return normal, None
+
+    def train_on_synthetic(self) -> None:
+        self.train(self.synthetic_data()[0])
+
+    # ------------------------------------------------------------------
+    def save(self, directory: str) -> str:
+        """Persist the fitted forest with joblib, plus its compiled arrays and drift reference; returns the artifact path."""
+        import joblib  # noqa: PLC0415
+
+        os.makedirs(directory, exist_ok=True)
+        path = artifact_path(directory, self.name, self.version, "joblib")
+        tmp = path + ".tmp"
+        joblib.dump(self._forest(), tmp)
+        os.replace(tmp, path)
+        if self._compiled is not None:
+            save_compiled(path, self._compiled.to_arrays())
+        save_reference(path, self.reference)
+        return path
+
+    def load(self, path: str) -> None:
+        self._clf = None
+        self._path = path
+        self._compiled = None
+        arrays = load_compiled(path) if IF_ENGINE == "compiled" else None
+        if arrays is not None:
+            self._compiled = CompiledForest.from_arrays(arrays)
+        else:
+            self._clf = self._unpickle(path)
+            self._compile()
+        self.reference = load_reference(path)
+        self.is_fitted = True
+
+    @staticmethod
+    def _unpickle(path: str) -> IsolationForest:
+        import joblib  # noqa: PLC0415
+        from sklearn.ensemble import IsolationForest  # noqa: PLC0415
+
+        clf = joblib.load(path)
+        if not isinstance(clf, IsolationForest):
+            raise TypeError(f"{path} does not contain an IsolationForest")
+        return clf
+
+    # ------------------------------------------------------------------
+    def score(self, features: list[float]) -> float:
+        """Return fraud probability in [0, 1]."""
+        return float(self.score_batch(np.array([features]))[0])
+
+    def score_batch(self, X: np.ndarray) -> np.ndarray:
+        """Return fraud probabilities in [0, 1] for an (N, 5) feature matrix."""
+        if not self.is_fitted:
+            self.train_on_synthetic()
+        if self._compiled is not None:
+            decision = self._compiled.decision_function(X)
+        else:
+            decision = self._forest().decision_function(X)
+        # Lower decision score → higher anomaly → higher fraud probability
+        prob = 1.0 / (1.0 + np.exp(8.0 * decision))
+        return np.clip(prob, 0.0, 1.0)
@@ -0,0 +1,94 @@
+"""
+Confirmed fraud outcomes for supervised training from the feature log.
+
+The feature log's is_fraud column is the ensemble's own decision. XGBoost is part
+of that ensemble, so training it on that column would teach it to repeat its past
+output. Supervised training from the log therefore needs confirmed outcomes:
+chargebacks and analyst dispositions, exported as a CSV with the columns
+
+    userId, timestamp, label      (label 1 = confirmed fraud, 0 = confirmed legitimate)
+
+Outcomes are joined to log rows on (hash of userId, event timestamp). That pair
+identifies a transaction in the log, which keeps no transactionId. Log rows with
+no outcome are left out. Without a label file, XGBoost keeps training on
+synthetic data, and the unsupervised models train on the rows the ensemble did
+not flag.
+
+    RETRAIN_LABELS_PATH  CSV of confirmed outcomes ("" = none)
+"""
+from __future__ import annotations
+
+import csv
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from feature_log import user_hash
+
+logger = logging.getLogger(__name__)
+
+RETRAIN_LABELS_PATH = os.getenv("RETRAIN_LABELS_PATH", "")
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+# Mixes the timestamp into the user hash, so one sorted uint64 key array covers both
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _keys(user_hashes: np.ndarray, ts_us: np.ndarray) -> np.ndarray:
+    with np.errstate(over="ignore"):
+        return np.asarray(user_hashes, dtype=np.uint64) ^ (np.asarray(ts_us, dtype=np.int64).view(np.uint64) * _MIX)
+
+
+class LabelStore:
+    """Confirmed outcomes, sorted by join key."""
+
+    def __init__(self, user_hashes: np.ndarray, ts_us: np.ndarray, labels: np.ndarray) -> None:
+        keys = _keys(user_hashes, ts_us)
+        order = np.argsort(keys, kind="stable")
+        self._keys = keys[order]
+        self._user_hashes = np.asarray(user_hashes, dtype=np.uint64)[order]
+        self._ts_us = np.asarray(ts_us, dtype=np.int64)[order]
+        self._labels = np.asarray(labels, dtype=np.uint8)[order]
+
+    def __len__(self) -> int:
+        return len(self._labels)
+
+    @classmethod
+    def load(cls, path: str = RETRAIN_LABELS_PATH) -> "LabelStore | None":
+        """The outcomes in the CSV at path; None if there is no path or no usable row."""
+        if not path:
+            return None
+        hashes, stamps, labels = [], [], []
+        with open(path, newline="", encoding="utf-8") as f:
+            for line_no, row in enumerate(csv.DictReader(f), start=2):
+                try:
+                    ts = datetime.fromisoformat(row["timestamp"])
+                    label = int(row["label"])
+                    if label not in (0, 1):
+                        raise ValueError(f"label must be 0 or 1, got {label}")
+                    user = row["userId"]
+                except (KeyError, TypeError, ValueError) as exc:
+                    logger.warning("Skipping %s line %d: %s", path, line_no, exc)
+                    continue
+                if ts.tzinfo is None:
+                    ts = ts.replace(tzinfo=timezone.utc)
+                hashes.append(user_hash(user))
+                stamps.append((ts - _EPOCH) // _MICROSECOND)
+                labels.append(label)
+        if not labels:
+            return None
+        return cls(np.array(hashes, dtype=np.uint64), np.array(stamps, dtype=np.int64), np.array(labels))
+
+    def join(self, records: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """(mask, labels): which feature-log records have a confirmed outcome, and those outcomes."""
+        keys = _keys(records["user_hash"], records["ts_us"])
+        pos = np.minimum(np.searchsorted(self._keys, keys), max(len(self._keys) - 1, 0))
+        mask = (
+            (self._keys[pos] == keys)
+            & (self._user_hashes[pos] == records["user_hash"])
+            & (self._ts_us[pos] == records["ts_us"])
+        )
+        return mask, self._labels[pos[mask]]
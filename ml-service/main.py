@@ -1,52 +1,443 @@
 from __future__ import annotations
 
+import asyncio
+import json
+import logging
+import math
+import threading
 import time
-from collections import deque
 from datetime import datetime, timezone
-
-from fastapi import FastAPI, BackgroundTasks, HTTPException
-from pydantic import BaseModel, Field
-from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
-from fastapi.responses import Response
-
+from typing import Callable, Literal, Sequence
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.routing import APIRoute
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
+from fastapi.responses import JSONResponse, Response
+
+from batching import MICROBATCH_ENABLED, MicroBatcher
+from drift import DRIFT_ENABLED, DriftMonitor
+from feature_log import FEATURE_LOG_DIR, FeatureLogWriter
+from feature_state import FEATURE_STATE_DIR, FeatureStateStore
 from features import FeatureEngineer
 from ensemble import EnsembleModel
+from graph import GRAPH_ENABLED, EntityGraph
+from idempotency import IDEMPOTENCY_ENABLED, IdempotencyCache, IdempotencyConflict, request_fingerprint, request_key
 from registry import ModelRegistry
+from retrain import RetrainInProgress, Retrainer
+from scoring import Record, add_contributions, explain_records, score_records, to_response
+from sketches import RollingSketch
+from shadow import ShadowEvaluator, load_challenger
+from sharding import SERVING_SHARDS, ShardedScorer, ShardUnavailable
+from streaming import DuplexStreamingResponse, StreamScorer
 
 
 # ── Pydantic schemas ────────────────────────────────────────────────────────
+class GraphContext(BaseModel):
+    ipAddress: str | None = Field(default=None, max_length=64)
+
+
 class PredictRequest(BaseModel):
-    userId: str = Field(min_length=1)
+    # Bounded so every field fits the feature-state WAL record (feature_state.py)
+    userId: str = Field(min_length=1, max_length=128)
     amount: float = Field(gt=0)
-    location: str = Field(min_length=2)
-    deviceId: str = Field(min_length=1)
+    location: str = Field(min_length=2, max_length=128)
+    deviceId: str = Field(min_length=1, max_length=128)
     timestamp: datetime
+    # Optional idempotency key; without it retries are matched on the fields above
+    transactionId: str | None = Field(default=None, min_length=1, max_length=128)
+    # Adds model-based featureContributions / modelContributions; costs nothing when False
+    explain: bool = False
+    # Extra entities for the entity graph (the IP links users across devices)
+    graphContext: GraphContext | None = None
+
+
+class PredictBatchRequest(BaseModel):
+    transactions: list[PredictRequest] = Field(min_length=1, max_length=10_000)
+
+
+class ExplainBatchRequest(BaseModel):
+    transactions: list[PredictRequest] = Field(min_length=1, max_length=10_000)
 
 
 class RetrainRequest(BaseModel):
     async_mode: bool = True
+    source: Literal["auto", "synthetic", "feature_log"] = "auto"
+    mode: Literal["full", "incremental"] = "full"
+
+
+class ChallengerRequest(BaseModel):
+    name: str = Field(min_length=1, max_length=64, pattern=r"^[A-Za-z0-9_.-]+$")
+    weights: dict[str, float] | None = None
+    fraud_threshold: float | None = Field(default=None, ge=0.0, le=1.0)
+    # model name -> registry revision or artifactSha256 to score with in place of the live version
+    artifacts: dict[str, int | str] | None = None
+
+
+class PromoteRequest(BaseModel):
+    revision: int = Field(ge=1)
+
+
+class PinRequest(BaseModel):
+    revision: int | None = Field(default=None, ge=1)  # defaults to the active version
 
 
 class EnsembleConfigRequest(BaseModel):
     weights: dict[str, float] | None = None
     fraud_threshold: float | None = None
+    cascade: bool | None = None  # turn cascade scoring on (loads the calibrated policy) or off
 
 
 # ── App bootstrap ────────────────────────────────────────────────────────────
+# Served while models are still loading; everything else answers 503 until /ready does
+_ALWAYS_SERVED = frozenset({"/health", "/ready", "/metrics"})
+
+
+class _TimedRoute(APIRoute):
+    """
+    Stamps request arrival so handlers can tell how long body parsing and validation took,
+    and turns requests away with 503 until the models are ready.
+    """
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+        gated = self.path not in _ALWAYS_SERVED
+
+        async def timed_handler(request: Request):
+            request.state.received_at = time.perf_counter()
+            if gated and not models_ready.is_set():
+                return JSONResponse({"detail": "Models are loading"}, status_code=503, headers={"Retry-After": "1"})
+            return await handler(request)
+
+        return timed_handler
+
+
 app = FastAPI(title="Fraud ML Service", version="2.0.0")
+app.router.route_class = _TimedRoute
+
+
+@app.exception_handler(ShardUnavailable)
+async def _shard_unavailable(request: Request, exc: ShardUnavailable) -> Response:
+    # The shard is restarting: a retry shortly after will be scored
+    return JSONResponse({"detail": str(exc)}, status_code=503, headers={"Retry-After": "1"})
+
+logger = logging.getLogger(__name__)
+
+_startup_began = time.perf_counter()
 
 feature_engineer = FeatureEngineer()
 registry = ModelRegistry()
 ensemble = EnsembleModel(registry)
-ensemble.train_all()
+
+# With SERVING_SHARDS=N, feature state and scoring live in N user-sharded worker processes
+sharded: ShardedScorer | None = None
+
+# Every scored transaction is appended to the feature log (training store); shards keep their own
+feature_log: FeatureLogWriter | None = (
+    FeatureLogWriter(FEATURE_LOG_DIR) if FEATURE_LOG_DIR and SERVING_SHARDS == 0 else None
+)
+
+# Per-user history survives restarts: load the last snapshot and replay the WAL after it
+feature_state: FeatureStateStore | None = (
+    FeatureStateStore(FEATURE_STATE_DIR) if FEATURE_STATE_DIR and SERVING_SHARDS == 0 else None
+)
+
+# Models load (or train), shards start and feature state recovers on a background
+# thread, so the process answers /health at once; /ready and scoring wait for it.
+models_ready = threading.Event()
+startup_finished = threading.Event()  # set once startup, deferred loads included, has succeeded or failed
+_model_sources: dict[str, str] = {}
+_startup_error: str | None = None
+STARTUP_SECONDS: float | None = None
+
+
+def _start_serving() -> None:
+    global sharded, _model_sources, _startup_error, STARTUP_SECONDS
+    try:
+        _model_sources = ensemble.load_or_train()
+        # Before the shards start, so they load the same references from disk
+        ensemble.backfill_references()
+        if SERVING_SHARDS > 0:
+            sharded = ShardedScorer(SERVING_SHARDS)
+        if feature_state is not None:
+            feature_state.recover(feature_engineer)
+        STARTUP_SECONDS = round(time.perf_counter() - _startup_began, 3)
+        startup_seconds_gauge.set(STARTUP_SECONDS)
+        models_ready.set()
+        logger.info("Ready to score after %.3fs", STARTUP_SECONDS)
+        # sklearn / xgboost objects the artifacts did not need for scoring, loaded now rather than on a request
+        ensemble.load_deferred()
+    except Exception as exc:  # noqa: BLE001
+        logger.exception("Startup failed; the service stays unready")
+        _startup_error = repr(exc)
+    finally:
+        startup_finished.set()
+
 
 # ── Prometheus metrics ───────────────────────────────────────────────────────
 requests_total = Counter("ml_requests_total", "Total ML requests", ["endpoint"])
+startup_seconds_gauge = Gauge("ml_startup_seconds", "Seconds from import to models ready")
 fraud_score_hist = Histogram("ml_fraud_score", "Distribution of fraud scores", buckets=[0.1 * i for i in range(11)])
+microbatch_size_hist = Histogram(
+    "ml_microbatch_size", "Requests scored per /predict micro-batch", buckets=[1, 2, 4, 8, 16, 32, 64, 128, 256],
+)
+microbatch_wait_hist = Histogram(
+    "ml_microbatch_queue_wait_seconds", "Time a /predict request waits before its micro-batch starts",
+    buckets=[0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0],
+)
+stream_records_total = Counter(
+    "ml_stream_records_total", "Lines received on /predict/stream, by outcome", ["outcome"],
+)
+stream_batch_size_hist = Histogram(
+    "ml_stream_batch_size", "Records scored per /predict/stream batch", buckets=[1, 2, 4, 8, 16, 32, 64, 128, 256, 512],
+)
+
+predict_latency_hist = Histogram(
+    "ml_predict_latency_seconds", "End-to-end /predict handler latency", ["during_retrain"],
+    buckets=[0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5],
+)
+feature_log_dropped_gauge = Gauge(
+    "ml_feature_log_rows_dropped", "Scored rows dropped because the feature log writer fell behind",
+)
+if feature_log is not None:
+    feature_log_dropped_gauge.set_function(lambda: feature_log.rows_dropped)
+feature_wal_gauge = Gauge("ml_feature_wal_records", "Feature state updates logged since the last snapshot")
+if feature_state is not None:
+    feature_wal_gauge.set_function(lambda: feature_state.wal_records)
+retrain_p99_gauge = Gauge(
+    "ml_predict_p99_during_retrain_seconds", "p99 /predict latency observed during the last retrain",
+)
+
+_STAGE_BUCKETS = [0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.1, 1.0]
+stage_latency_hist = Histogram(
+    "ml_stage_latency_seconds", "Latency of each scoring stage, per call (a micro-batch is one call)", ["stage"],
+    buckets=_STAGE_BUCKETS,
+)
+model_latency_hist = Histogram(
+    "ml_model_score_seconds", "Latency of each model's score / score_batch call", ["model"], buckets=_STAGE_BUCKETS,
+)
+model_failures_total = Counter("ml_model_failures_total", "Model scoring calls that raised", ["model"])
+model_fallbacks_total = Counter(
+    "ml_model_fallbacks_total", "Predictions that fell back: made without a model, or to the safe default",
+    ["model", "kind"],
+)
+ensemble.instrument(
+    stage_seconds=stage_latency_hist,
+    model_seconds=model_latency_hist,
+    model_failures=model_failures_total,
+    model_fallbacks=model_fallbacks_total,
+    cascade_exits=Counter(
+        "ml_cascade_exits_total", "Cascade-scored predictions by how many models ran before the decision",
+        ["models_run"],
+    ),
+)
+_parse_stage = stage_latency_hist.labels(stage="parse")
+_features_stage = stage_latency_hist.labels(stage="features")
+_contributions_stage = stage_latency_hist.labels(stage="contributions")
+
+# Gateway retries of the same transaction replay the first response
+idempotency_lookups_total = Counter(
+    "ml_idempotency_lookups_total", "/predict idempotency cache lookups (hit, inflight duplicate, miss)", ["result"],
+)
+idempotency_entries_gauge = Gauge("ml_idempotency_cache_entries", "Responses held in the idempotency cache")
+idempotency_cache: IdempotencyCache | None = (
+    IdempotencyCache(lookups=idempotency_lookups_total) if IDEMPOTENCY_ENABLED else None
+)
+if idempotency_cache is not None:
+    idempotency_entries_gauge.set_function(lambda: len(idempotency_cache))
+
+# Challengers score mirrored traffic on a background thread; in-process serving only
+shadow_rows_total = Counter(
+    "ml_shadow_rows_total", "Scored rows mirrored to shadow challengers, or dropped because the queue was full",
+    ["result"],
+)
+shadow_agreement_gauge = Gauge(
+    "ml_shadow_agreement_ratio", "Share of mirrored decisions a challenger agrees with", ["challenger"],
+)
+shadow: ShadowEvaluator | None = (
+    ShadowEvaluator(ensemble, rows=shadow_rows_total, agreement=shadow_agreement_gauge) if SERVING_SHARDS == 0 else None
+)
+
+# Users linked through shared devices / IPs; lives here, not in the shards, since rings span shards
+entity_graph: EntityGraph | None = EntityGraph() if GRAPH_ENABLED else None
+graph_nodes_gauge = Gauge("ml_graph_nodes", "Users, devices, IPs and locations in the entity graph")
+graph_clusters_gauge = Gauge("ml_graph_clusters", "Entity-graph clusters with two or more users")
+if entity_graph is not None:
+    graph_nodes_gauge.set_function(lambda: len(entity_graph))
+    graph_clusters_gauge.set_function(lambda: entity_graph.cluster_count)
+
+# Live features and model scores binned against each model's training reference; shards keep their own
+drift_monitor: DriftMonitor | None = DriftMonitor(ensemble) if DRIFT_ENABLED else None
+drift_psi_gauge = Gauge(
+    "ml_drift_psi", "Population stability index of live traffic against the model's training data",
+    ["model", "feature", "window"],
+)
+drift_ks_gauge = Gauge(
+    "ml_drift_ks", "Kolmogorov-Smirnov distance of live traffic from the model's training data",
+    ["model", "feature", "window"],
+)
+
+# ── Runtime stats: rolling 1m / 5m / 1h sketches over all traffic ────────────
+score_sketch = RollingSketch()
+latency_sketch = RollingSketch(min_value=1e-5, max_value=60.0)
+
+retrainer = Retrainer(
+    ensemble,
+    registry=registry,
+    on_swapped=(lambda: sharded.broadcast("reload")) if SERVING_SHARDS > 0 else None,
+    p99_gauge=retrain_p99_gauge,
+)
+
+
+def _record(tx: PredictRequest) -> Record:
+    return (tx.userId, tx.amount, tx.location, tx.deviceId, tx.timestamp)
+
+
+def _add_graph_scores(txs: Sequence[PredictRequest], responses: Sequence[dict]) -> None:
+    if entity_graph is None:
+        return
+    linked = entity_graph.observe_batch([
+        (
+            tx.userId, tx.deviceId, tx.location, tx.graphContext.ipAddress if tx.graphContext else None,
+            response["fraudScore"], response["isFraud"],
+        )
+        for tx, response in zip(txs, responses)
+    ])
+    for response, (graph_score, graph_metrics) in zip(responses, linked):
+        response["graphScore"] = graph_score
+        response["graphMetrics"] = graph_metrics
+
+
+def _score_transactions(txs: list[PredictRequest], time_ordered: bool) -> list[dict | Exception]:
+    """Responses in input order; a transaction whose features could not be built gets its exception instead."""
+    records = [_record(tx) for tx in txs]
+    explain = [tx.explain for tx in txs]
+    explain = explain if any(explain) else None
+    if sharded is not None:
+        responses = sharded.score(records, time_ordered=time_ordered, explain=explain)
+    else:
+        responses = score_records(
+            feature_engineer, ensemble, records,
+            time_ordered=time_ordered, feature_log=feature_log, features_hist=_features_stage, shadow=shadow,
+            explain=explain, explain_hist=_contributions_stage, drift=drift_monitor,
+        )
+
+    scored = [(tx, response) for tx, response in zip(txs, responses) if isinstance(response, dict)]
+    if not scored:
+        return responses
+    _add_graph_scores([tx for tx, _ in scored], [response for _, response in scored])
+    scores = [response["fraudScore"] for _, response in scored]
+    for score in scores:
+        fraud_score_hist.observe(score)
+    score_sketch.add(scores, flagged=sum(response["isFraud"] for _, response in scored))
+
+    return responses
+
+
+def _error_response(exc: Exception) -> dict:
+    return {"error": str(exc) or type(exc).__name__}
+
+
+def _predict_one(payload: PredictRequest) -> dict:
+    if sharded is not None:
+        response = _score_transactions([payload], time_ordered=False)[0]
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    started = time.perf_counter()
+    feats = feature_engineer.build(
+        user_id=payload.userId,
+        amount=payload.amount,
+        location=payload.location,
+        device_id=payload.deviceId,
+        timestamp=payload.timestamp,
+    )
+    feature_engineer.commit()
+    _features_stage.observe(time.perf_counter() - started)
+    result = ensemble.predict(feats, location=payload.location, device_id=payload.deviceId)
+    if feature_log is not None:
+        feature_log.append([_record(payload)], [feats], [result])
+    if shadow is not None:
+        shadow.submit([feats], [result])
+    if drift_monitor is not None:
+        drift_monitor.observe([feats], [result])
+
+    fraud_score_hist.observe(result.fraud_score)
+    score_sketch.add([result.fraud_score], flagged=int(result.is_fraud))
+
+    response = to_response(result)
+    if payload.explain:
+        add_contributions(ensemble, [feats], [response], _contributions_stage)
+    _add_graph_scores([payload], [response])
+    return response
+
+
+# Concurrent /predict calls are scored together; arrival order drives feature state
+micro_batcher: MicroBatcher[PredictRequest, dict] | None = (
+    MicroBatcher(
+        lambda txs: _score_transactions(txs, time_ordered=False),
+        batch_size_hist=microbatch_size_hist,
+        queue_wait_hist=microbatch_wait_hist,
+    )
+    if MICROBATCH_ENABLED else None
+)
+
+_predict_list = TypeAdapter(list[PredictRequest])
+_stream_scored = stream_records_total.labels(outcome="scored")
+_stream_invalid = stream_records_total.labels(outcome="invalid")
+
+
+def _parse_stream_lines(lines: list[bytes], first_line: int) -> list[PredictRequest | dict]:
+    """One PredictRequest per line, or an error object for a line that does not validate."""
+    try:
+        parsed = _predict_list.validate_json(b"[" + b",".join(lines) + b"]")
+        if len(parsed) == len(lines):
+            return parsed
+    except ValidationError:
+        pass
+    # Something in the batch is malformed (or a line held more than one value): go line by line
+    items: list[PredictRequest | dict] = []
+    for offset, line in enumerate(lines):
+        try:
+            items.append(PredictRequest.model_validate_json(line))
+        except ValidationError as exc:
+            items.append({
+                "line": first_line + offset,
+                "error": exc.errors(include_url=False, include_context=False, include_input=False),
+            })
+    return items
+
+
+async def _score_stream_batch(items: list[PredictRequest | dict]) -> bytes:
+    txs = [item for item in items if isinstance(item, PredictRequest)]
+    responses = iter(())
+    if txs:
+        def work() -> list[dict]:
+            return _score_transactions(txs, time_ordered=False)
+
+        # Same worker as /predict micro-batches, so feature state sees one ordered writer
+        responses = iter(await (micro_batcher.run_exclusive(work) if micro_batcher is not None else run_in_threadpool(work)))
+        stream_batch_size_hist.observe(len(txs))
+        _stream_scored.inc(len(txs))
+    if len(txs) < len(items):
+        _stream_invalid.inc(len(items) - len(txs))
+    lines = []
+    for item in items:
+        if isinstance(item, PredictRequest):
+            item = next(responses)
+            if isinstance(item, Exception):
+                item = _error_response(item)
+        lines.append(json.dumps(item, separators=(",", ":")))
+    return ("\n".join(lines) + "\n").encode()
 
-# ── Runtime stats (in-memory ring buffer for last 1000 predictions) ──────────
-_recent_scores: deque[float] = deque(maxlen=1000)
-_retraining = False
+
+def _stream_error(exc: Exception) -> bytes:
+    return (json.dumps({"error": str(exc) or type(exc).__name__, "fatal": True}) + "\n").encode()
+
+
+stream_scorer: StreamScorer[PredictRequest | dict] = StreamScorer(_parse_stream_lines, _score_stream_batch)
 
 
 # ── Routes ───────────────────────────────────────────────────────────────────
@@ -57,38 +448,163 @@ def health() -> dict:
         "service": "ml-service",
         "version": "2.0.0",
         "models": [m["modelName"] for m in registry.all()],
+        "ready": models_ready.is_set(),
+        "startupError": _startup_error,
+        "modelSources": _model_sources,
+        "startupSeconds": STARTUP_SECONDS,
+        "shards": sharded.n_shards if sharded is not None else 0,
+        "deadShards": sharded.dead_shards() if sharded is not None else [],
+        "shardRestarts": sharded.restarts if sharded is not None else 0,
+        "idempotency": idempotency_cache.stats() if idempotency_cache is not None else None,
+        "featureState": feature_state.stats() if feature_state is not None else None,
+        "geoPlaces": len(feature_engineer.geo),
+        "graph": entity_graph.stats() if entity_graph is not None else None,
     }
 
 
+@app.get("/ready")
+def ready() -> Response:
+    """
+    Readiness: 200 once requests can be scored, 503 while models load (or if startup failed)
+    and while any shard is down and restarting.
+    """
+    if not models_ready.is_set():
+        return JSONResponse(
+            {"ready": False, "error": _startup_error}, status_code=503, headers={"Retry-After": "1"},
+        )
+    dead = sharded.dead_shards() if sharded is not None else []
+    if dead:
+        return JSONResponse(
+            {"ready": False, "error": f"shards {dead} are down and restarting", "deadShards": dead},
+            status_code=503, headers={"Retry-After": "1"},
+        )
+    return JSONResponse({"ready": True, "startupSeconds": STARTUP_SECONDS, "modelSources": _model_sources})
+
+
 @app.get("/metrics")
 def metrics() -> Response:
+    if drift_monitor is not None:
+        _set_drift_gauges(_drift_report())
     return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
 
 
+def _drift_report() -> dict:
+    # In sharded mode the shards see the traffic; this process only merges their counts
+    return drift_monitor.report(sharded.broadcast("drift") if sharded is not None else ())
+
+
+def _set_drift_gauges(report: dict) -> None:
+    for model, entry in report["models"].items():
+        for window, stats in entry["windows"].items():
+            for feature, column in stats["columns"].items():
+                # NaN until the window has DRIFT_MIN_SAMPLES observations
+                psi, ks = column["psi"], column["ks"]
+                drift_psi_gauge.labels(model=model, feature=feature, window=window).set(math.nan if psi is None else psi)
+                drift_ks_gauge.labels(model=model, feature=feature, window=window).set(math.nan if ks is None else ks)
+
+
+def _observe_parse(request: Request) -> None:
+    received_at = getattr(request.state, "received_at", None)
+    if received_at is not None:
+        _parse_stage.observe(time.perf_counter() - received_at)
+
+
 @app.post("/predict")
-def predict(payload: PredictRequest) -> dict:
+async def predict(payload: PredictRequest, request: Request) -> dict:
+    _observe_parse(request)
     requests_total.labels(endpoint="predict").inc()
-
-    feats = feature_engineer.build(
-        user_id=payload.userId,
-        amount=payload.amount,
-        location=payload.location,
-        device_id=payload.deviceId,
-        timestamp=payload.timestamp,
+    started = time.perf_counter()
+
+    async def score() -> dict:
+        if micro_batcher is not None:
+            return await micro_batcher.submit(payload)
+        return await run_in_threadpool(_predict_one, payload)
+
+    if idempotency_cache is not None:
+        fingerprint = request_fingerprint(
+            payload.userId, payload.amount, payload.location, payload.deviceId, payload.timestamp,
+        )
+        key = request_key(
+            payload.transactionId, payload.userId, payload.amount, payload.location, payload.deviceId,
+            payload.timestamp,
+        )
+        try:
+            response = await idempotency_cache.get_or_compute(
+                key, score, "explain" if payload.explain else "", fingerprint,
+            )
+        except IdempotencyConflict as exc:
+            raise HTTPException(status_code=409, detail=f"Replay does not match the original request: {exc}") from exc
+    else:
+        response = await score()
+
+    elapsed = time.perf_counter() - started
+    during_retrain = retrainer.running
+    predict_latency_hist.labels(during_retrain="true" if during_retrain else "false").observe(elapsed)
+    retrainer.record_latency(elapsed)
+    latency_sketch.add([elapsed])
+    return response
+
+
+@app.post("/predict/batch")
+async def predict_batch(payload: PredictBatchRequest, request: Request) -> dict:
+    """
+    Score N transactions in one call. Features are built in timestamp order; results keep
+    request order. A transaction whose features cannot be built gets {"error"} in its place.
+    """
+    _observe_parse(request)
+    requests_total.labels(endpoint="predict_batch").inc()
+
+    def work() -> list[dict]:
+        return [
+            _error_response(r) if isinstance(r, Exception) else r
+            for r in _score_transactions(payload.transactions, time_ordered=True)
+        ]
+
+    # Share the micro-batch worker so feature state is never mutated from two threads
+    results = await (micro_batcher.run_exclusive(work) if micro_batcher is not None else run_in_threadpool(work))
+    return {"count": len(results), "results": results}
+
+
+@app.post("/predict/stream")
+async def predict_stream(request: Request) -> Response:
+    """
+    NDJSON in, NDJSON out: one PredictRequest per line, one response line per
+    input line, in order. A line that does not validate gets {"line", "error"}
+    in its place; a broken stream ends with {"error", "fatal": true}. Records are
+    scored in arrival order, like /predict; idempotency keys are not consulted.
+    """
+    requests_total.labels(endpoint="predict_stream").inc()
+    return DuplexStreamingResponse(
+        stream_scorer.run(request.stream(), _stream_error), media_type="application/x-ndjson",
     )
-    result = ensemble.predict(feats, location=payload.location, device_id=payload.deviceId)
 
-    fraud_score_hist.observe(result.fraud_score)
-    _recent_scores.append(result.fraud_score)
 
-    return {
-        "fraudScore":   result.fraud_score,
-        "isFraud":      result.is_fraud,
-        "confidence":   result.confidence,
-        "modelScores":  result.model_scores,
-        "modelWeights": result.model_weights,
-        "explanations": result.explanations,
-    }
+@app.post("/explain/batch")
+async def explain_batch(payload: ExplainBatchRequest, request: Request) -> dict:
+    """
+    Score and explain N transactions against the current user history without
+    recording them: for investigations, nothing is added to feature state or the log.
+    """
+    _observe_parse(request)
+    requests_total.labels(endpoint="explain_batch").inc()
+    records = [_record(tx) for tx in payload.transactions]
+
+    def work() -> list[dict]:
+        if sharded is not None:
+            return sharded.explain(records)
+        return explain_records(feature_engineer, ensemble, records, _contributions_stage)
+
+    # Read feature state on the micro-batch worker, never concurrently with its updates
+    results = await (micro_batcher.run_exclusive(work) if micro_batcher is not None else run_in_threadpool(work))
+    return {"count": len(results), "results": results}
+
+
+@app.get("/graph/analytics")
+def graph_analytics(limit: int = 50, max_nodes: int = 500) -> dict:
+    """Riskiest multi-user clusters of the entity graph and their member nodes."""
+    if entity_graph is None:
+        return {"nodes": [], "clusters": [], "totalNodes": 0, "totalEdges": 0}
+    return entity_graph.analytics(limit=max(1, min(limit, 1000)), max_nodes=max(0, min(max_nodes, 10_000)))
 
 
 @app.get("/model/info")
@@ -99,73 +615,221 @@ def model_info() -> dict:
         "ensemble": {
             "weights": ensemble._weights,
             "fraud_threshold": ensemble._threshold,
+            "cascade": ensemble.cascade_status(),
         },
     }
 
 
-@app.patch("/model/config")
-def update_ensemble_config(payload: EnsembleConfigRequest) -> dict:
-    """Update ensemble weights or fraud threshold dynamically."""
-    if payload.weights:
+@app.get("/model/versions")
+def model_versions() -> dict:
+    """Every registered version of every model: which one is active, pinned, and loaded in the pool."""
+    return ensemble.versions()
+
+
+def _switch_version(name: str, switch: Callable[[], dict]) -> dict:
+    started = time.perf_counter()
+    try:
+        entry = switch()
+    except KeyError as exc:
+        raise HTTPException(status_code=404, detail=f"Unknown model or revision: {name} {exc}") from exc
+    except (OSError, ValueError) as exc:
+        raise HTTPException(status_code=409, detail=f"Cannot switch {name}: {exc}") from exc
+    switch_seconds = time.perf_counter() - started
+    if sharded is not None:
+        # Shards re-read the registry and pick the version from their own pools
+        sharded.broadcast("reload")
+    return {
+        "model": name,
+        "active": entry,
+        "pinned": registry.pinned(name),
+        "switchMs": round(switch_seconds * 1000.0, 3),
+    }
+
+
+@app.post("/model/{name}/promote")
+def promote_version(name: str, payload: PromoteRequest) -> dict:
+    """Serve a recorded version of one model. No retraining; pool hits swap in milliseconds."""
+    return _switch_version(name, lambda: ensemble.activate(name, payload.revision))
+
+
+@app.post("/model/{name}/pin")
+def pin_version(name: str, payload: PinRequest) -> dict:
+    """Serve a version (default: the active one) and keep serving it when retrains register new ones."""
+
+    def switch() -> dict:
+        if payload.revision is None:
+            ensemble.set_pinned(name, True)
+            return _active_entry(name)
+        return ensemble.activate(name, payload.revision, pinned=True)
+
+    return _switch_version(name, switch)
+
+
+@app.delete("/model/{name}/pin")
+def unpin_version(name: str) -> dict:
+    """Let the next registered version of this model become active again."""
+
+    def switch() -> dict:
+        ensemble.set_pinned(name, False)
+        return _active_entry(name)
+
+    return _switch_version(name, switch)
+
+
+@app.post("/model/{name}/rollback")
+def rollback_version(name: str) -> dict:
+    """Return to the version that was active before the current one; repeat to keep walking back."""
+    return _switch_version(name, lambda: ensemble.rollback(name))
+
+
+def _active_entry(name: str) -> dict:
+    entry = registry.get(name)
+    if entry is None:
+        raise KeyError(name)
+    return entry
+
+
+def _validate_weights(weights: dict[str, float] | None) -> None:
+    if weights:
         # Validate weights sum to ~1.0
-        total = sum(payload.weights.values())
+        total = sum(weights.values())
         if abs(total - 1.0) > 0.001:
             raise HTTPException(status_code=400, detail=f"Weights must sum to 1.0 (got {total})")
         
         # Ensure all required keys are present if we want to replace, 
         # or just update the ones provided if they exist in ensemble._weights
-        for k in payload.weights:
+        for k in weights:
             if k not in ensemble._weights:
                 raise HTTPException(status_code=400, detail=f"Invalid model key: {k}")
-        
-        ensemble._weights.update(payload.weights)
 
-    if payload.fraud_threshold is not None:
-        ensemble._threshold = payload.fraud_threshold
+
+@app.patch("/model/config")
+def update_ensemble_config(payload: EnsembleConfigRequest) -> dict:
+    """Update ensemble weights or fraud threshold dynamically."""
+    _validate_weights(payload.weights)
+    ensemble.configure(payload.weights, payload.fraud_threshold)
+    if payload.cascade is not None:
+        try:
+            ensemble.enable_cascade(payload.cascade)
+        except (OSError, ValueError, KeyError) as exc:
+            raise HTTPException(status_code=409, detail=f"Cannot load cascade policy: {exc}") from exc
+
+    if sharded is not None:
+        sharded.broadcast("config", (payload.weights, payload.fraud_threshold, payload.cascade))
 
     return {
         "weights": ensemble._weights,
         "fraud_threshold": ensemble._threshold,
+        "cascade": ensemble.cascade_status(),
     }
 
 
+def _require_shadow() -> ShadowEvaluator:
+    if shadow is None:
+        raise HTTPException(status_code=409, detail="Shadow evaluation is not available with SERVING_SHARDS")
+    return shadow
+
+
+@app.get("/shadow")
+def shadow_stats() -> dict:
+    """Champion vs challenger agreement on mirrored traffic, plus queue and drop counts."""
+    return _require_shadow().stats()
+
+
+@app.post("/shadow/challengers")
+def register_challenger(payload: ChallengerRequest) -> dict:
+    """
+    Register (or replace) a challenger: weights, threshold and/or registered model
+    versions layered over the live ensemble. It scores mirrored traffic only and never
+    changes a served decision.
+    """
+    evaluator = _require_shadow()
+    _validate_weights(payload.weights)
+    try:
+        challenger = load_challenger(ensemble, payload.name, payload.weights, payload.fraud_threshold, payload.artifacts)
+    except (OSError, ValueError) as exc:
+        raise HTTPException(status_code=400, detail=f"Cannot load challenger: {exc}") from exc
+    evaluator.register(challenger)
+    return {"registered": challenger.name, **challenger.describe()}
+
+
+@app.delete("/shadow/challengers/{name}")
+def remove_challenger(name: str) -> dict:
+    if not _require_shadow().remove(name):
+        raise HTTPException(status_code=404, detail=f"No challenger named {name}")
+    return {"removed": name}
+
+
 @app.get("/model/metrics")
 def model_metrics() -> dict:
-    """Runtime prediction statistics from the in-memory ring buffer."""
-    scores = list(_recent_scores)
-    if not scores:
-        return {"message": "No predictions yet", "sampleSize": 0}
-
-    import numpy as np  # noqa: PLC0415
+    """
+    Runtime prediction statistics from rolling sketches over all traffic (1m / 5m / 1h).
+    Quantiles are within 1% relative error; the fraud rate counts the ensemble's
+    decisions at the threshold live when each transaction was scored.
+    """
+    scores = score_sketch.summary()
+    latencies = latency_sketch.summary()
+    windows = {}
+    for name, stats in scores.items():
+        n = stats["count"]
+        windows[name] = {
+            "sampleSize": n,
+            "meanScore":  _round(stats["mean"]),
+            "p50":        _round(stats["p50"]),
+            "p95":        _round(stats["p95"]),
+            "p99":        _round(stats["p99"]),
+            "fraudRate":  round(stats["flagged"] / n, 4) if n else None,
+            "latencyMs":  {q: _round(latencies[name][q], 1000.0) for q in ("p50", "p95", "p99")},
+        }
+
+    largest = windows[list(windows)[-1]]
+    if not largest["sampleSize"]:
+        return {"message": "No predictions yet", "sampleSize": 0, "windows": windows}
     return {
-        "sampleSize":    len(scores),
-        "meanScore":     round(float(np.mean(scores)), 4),
-        "p50":           round(float(np.percentile(scores, 50)), 4),
-        "p95":           round(float(np.percentile(scores, 95)), 4),
-        "fraudRate":     round(sum(s >= 0.55 for s in scores) / len(scores), 4),
-        "capturedAt":    datetime.now(tz=timezone.utc).isoformat(),
+        # Top-level figures describe the largest window
+        **{k: largest[k] for k in ("sampleSize", "meanScore", "p50", "p95", "fraudRate")},
+        "threshold":  round(ensemble.snapshot().threshold, 4),
+        "windows":    windows,
+        "capturedAt": datetime.now(tz=timezone.utc).isoformat(),
     }
 
 
-@app.post("/model/retrain")
-def retrain(payload: RetrainRequest, background_tasks: BackgroundTasks) -> dict:
-    """Trigger a full model retrain (on synthetic data for now)."""
-    global _retraining  # noqa: PLW0603
+@app.get("/model/drift")
+def model_drift() -> dict:
+    """
+    Drift of live traffic from each active model's training data, per window, model
+    and column (the five features and the model's own score): PSI and KS distance
+    over fixed bins. Counts restart when a model version changes.
+    """
+    if drift_monitor is None:
+        raise HTTPException(status_code=404, detail="Drift monitoring is disabled (DRIFT_ENABLED=0)")
+    return {**_drift_report(), "capturedAt": datetime.now(tz=timezone.utc).isoformat()}
 
-    if _retraining:
-        raise HTTPException(status_code=409, detail="Retrain already in progress")
 
-    def _do_retrain() -> None:
-        global _retraining  # noqa: PLW0603
-        _retraining = True
-        try:
-            ensemble.train_all()
-        finally:
-            _retraining = False
+def _round(value: float | None, scale: float = 1.0) -> float | None:
+    return None if value is None else round(value * scale, 4)
+
+
+@app.post("/model/retrain")
+async def retrain(payload: RetrainRequest) -> dict:
+    """Trigger a full model retrain (from the feature log or synthetic data) in a worker process, then hot-swap."""
+    try:
+        done = retrainer.start(payload.source, payload.mode)
+    except RetrainInProgress:
+        raise HTTPException(status_code=409, detail="Retrain already in progress")
 
     if payload.async_mode:
-        background_tasks.add_task(_do_retrain)
         return {"status": "started", "async": True}
 
-    _do_retrain()
-    return {"status": "complete", "async": False, "models": registry.all()}
+    status = await asyncio.wrap_future(done)
+    if status["status"] != "complete":
+        raise HTTPException(status_code=500, detail=f"Retrain failed: {status.get('error')}")
+    return {"status": "complete", "async": False, "models": registry.all(), "retrain": status}
+
+
+@app.get("/model/retrain/status")
+def retrain_status() -> dict:
+    return retrainer.status()
+
+
+threading.Thread(target=_start_serving, name="ml-startup", daemon=True).start()
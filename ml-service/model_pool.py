@@ -0,0 +1,63 @@
+"""
+LRU pool of loaded model versions.
+
+Switching the active version of a model (promote / pin / rollback) should not
+pay for reading and verifying an artifact again. Loaded models are kept here,
+keyed by (model name, artifact sha256), so a switch to a recently used version
+is a dictionary lookup plus a ModelSet swap. The pool is bounded; the least
+recently used version is dropped first. A dropped model stays alive for as long
+as a published ModelSet still references it.
+
+    MODEL_POOL_SIZE   loaded versions kept across all models (default 9)
+"""
+from __future__ import annotations
+
+import os
+import threading
+from collections import OrderedDict
+from typing import Hashable
+
+MODEL_POOL_SIZE = int(os.getenv("MODEL_POOL_SIZE", "9"))
+
+
+class ModelPool:
+    def __init__(self, capacity: int = MODEL_POOL_SIZE) -> None:
+        self._capacity = max(1, capacity)
+        self._items: OrderedDict[Hashable, object] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> object | None:
+        with self._lock:
+            model = self._items.get(key)
+            if model is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return model
+
+    def put(self, key: Hashable, model: object) -> None:
+        with self._lock:
+            self._items[key] = model
+            self._items.move_to_end(key)
+            while len(self._items) > self._capacity:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._items
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._items),
+            "capacity": self._capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -1,57 +1,315 @@
-"""
-Model registry — tracks version, training time, and metrics for each model.
-Persisted to a local JSON file inside the container.
-"""
-from __future__ import annotations
-
-import json
-import os
-from datetime import datetime, timezone
-from typing import Any
-
-
-REGISTRY_PATH = os.getenv("MODEL_REGISTRY_PATH", "model_registry.json")
-
-
-class ModelRegistry:
-    def __init__(self) -> None:
-        self._data: dict[str, dict[str, Any]] = {}
-        self._load()
-
-    # ------------------------------------------------------------------
-    def _load(self) -> None:
-        if os.path.exists(REGISTRY_PATH):
-            try:
-                with open(REGISTRY_PATH) as f:
-                    self._data = json.load(f)
-            except (json.JSONDecodeError, OSError):
-                self._data = {}
-
-    def _save(self) -> None:
-        try:
-            with open(REGISTRY_PATH, "w") as f:
-                json.dump(self._data, f, indent=2, default=str)
-        except OSError:
-            pass
-
-    # ------------------------------------------------------------------
-    def register(
-        self,
-        model_name: str,
-        version: str,
-        metrics: dict[str, float] | None = None,
-    ) -> None:
-        self._data[model_name] = {
-            "modelName": model_name,
-            "version": version,
-            "trainedAt": datetime.now(tz=timezone.utc).isoformat(),
-            "metrics": metrics or {},
-            "status": "active",
-        }
-        self._save()
-
-    def get(self, model_name: str) -> dict[str, Any] | None:
-        return self._data.get(model_name)
-
-    def all(self) -> list[dict[str, Any]]:
-        return list(self._data.values())
+"""
+Model registry — tracks version, training time, and metrics for each model.
+Persisted to a local JSON file inside the container.
+
+Every registered artifact is kept as an immutable version, numbered per model
+(revision 1, 2, ...); exactly one revision per model is active. Registering a
+new artifact activates it unless the model is pinned, in which case it is only
+recorded. Activations are kept in a history so a rollback returns to the
+revision that was active before.
+
+Writes go to a temp file that is renamed over the registry, so readers (other
+processes, a restart) never see a half-written file. Registrations inside
+batch() are written once, when the outermost batch exits.
+
+    MODEL_REGISTRY_PATH   registry file (default model_registry.json)
+    MODEL_ARTIFACT_DIR    artifact root (default artifacts)
+    MODEL_MAX_LINEAGE     lineage steps kept per version (default 100)
+    MODEL_MAX_HISTORY     activations kept per model for rollback (default 100)
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Iterator
+
+import numpy as np
+
+REGISTRY_PATH = os.getenv("MODEL_REGISTRY_PATH", "model_registry.json")
+ARTIFACT_DIR = os.getenv("MODEL_ARTIFACT_DIR", "artifacts")
+
+# Bump when the on-disk layout of any model artifact changes; older artifacts are then retrained.
+ARTIFACT_FORMAT = 1
+
+# Bump when the layout of the registry file itself changes; older files are migrated on load.
+REGISTRY_FORMAT = 2
+
+# Lineage steps kept per model; the oldest are dropped beyond this
+MAX_LINEAGE = int(os.getenv("MODEL_MAX_LINEAGE", "100"))
+MAX_HISTORY = int(os.getenv("MODEL_MAX_HISTORY", "100"))
+
+
+def artifact_path(directory: str, model_name: str, version: str, ext: str) -> str:
+    return os.path.join(directory, f"{model_name}-v{version}-f{ARTIFACT_FORMAT}.{ext}")
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def compiled_path(path: str, kind: str = "compiled") -> str:
+    return f"{path}.{kind}.npz"
+
+
+def save_compiled(path: str, arrays: dict[str, Any], kind: str = "compiled") -> None:
+    """
+    Write the NumPy form of the artifact at path next to it, tagged with the
+    artifact's hash, so serving can load it without importing the training library.
+    kind names the sidecar, for arrays that describe the artifact rather than
+    replace it (e.g. the drift reference).
+    """
+    target = compiled_path(path, kind)
+    tmp = f"{target}.{os.getpid()}.tmp"  # serving shards may write the same sidecar
+    with open(tmp, "wb") as f:
+        np.savez(f, source_sha256=np.array(file_sha256(path)), **arrays)
+    os.replace(tmp, target)
+
+
+def load_compiled(path: str, kind: str = "compiled") -> dict[str, np.ndarray] | None:
+    """The arrays saved by save_compiled for the artifact at path; None if missing, unreadable or stale."""
+    target = compiled_path(path, kind)
+    if not os.path.exists(target):
+        return None
+    try:
+        with np.load(target, allow_pickle=False) as data:
+            arrays = {key: data[key] for key in data.files}
+    except Exception:  # noqa: BLE001 — a damaged sidecar only costs the slower load
+        return None
+    if str(arrays.pop("source_sha256", "")) != file_sha256(path):
+        return None
+    return arrays
+
+
+def _empty_model() -> dict[str, Any]:
+    return {"active": None, "pinned": False, "history": [], "versions": []}
+
+
+class ModelRegistry:
+    def __init__(self, path: str = REGISTRY_PATH) -> None:
+        self._path = path
+        self._lock = threading.RLock()
+        self._models: dict[str, dict[str, Any]] = {}
+        self._batch_depth = 0
+        self._dirty = False
+        self._load()
+
+    # ------------------------------------------------------------------
+    def reload(self) -> None:
+        """Re-read the registry file, e.g. after another process registered new artifacts."""
+        with self._lock:
+            self._models = {}
+            self._load()
+
+    def _load(self) -> None:
+        if not os.path.exists(self._path):
+            return
+        try:
+            with open(self._path) as f:
+                data = json.load(f)
+        except (json.JSONDecodeError, OSError):
+            return
+        if isinstance(data, dict) and data.get("format") == REGISTRY_FORMAT:
+            self._models = data.get("models") or {}
+            return
+        # Format 1: one entry per model, overwritten on each registration
+        for name, entry in (data or {}).items():
+            if isinstance(entry, dict) and entry.get("modelName"):
+                self._models[name] = {
+                    "active": 1, "pinned": False, "history": [1],
+                    "versions": [{**entry, "revision": 1, "status": "active"}],
+                }
+
+    def _save(self) -> None:
+        if self._batch_depth:
+            self._dirty = True
+            return
+        self._write()
+
+    def _write(self) -> None:
+        self._dirty = False
+        tmp = f"{self._path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump({"format": REGISTRY_FORMAT, "models": self._models}, f, indent=2, default=str)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self._path)
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        """Defer writes until the outermost batch exits, then write once."""
+        with self._lock:
+            self._batch_depth += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._batch_depth -= 1
+                if not self._batch_depth and self._dirty:
+                    self._write()
+
+    # ------------------------------------------------------------------
+    def register(
+        self,
+        model_name: str,
+        version: str,
+        metrics: dict[str, float] | None = None,
+        artifact_path: str | None = None,
+        artifact_sha256: str | None = None,
+        lineage_step: dict[str, Any] | None = None,
+    ) -> dict[str, Any]:
+        """
+        Record a new version of a model and, unless the model is pinned, make it the
+        active one. lineage_step describes how it was produced: a "full" step starts
+        a new lineage, an "incremental" step is appended to the active version's
+        lineage with parentSha256 set to the artifact it started from.
+        Returns the new entry.
+        """
+        trained_at = datetime.now(tz=timezone.utc).isoformat()
+        with self._lock:
+            record = self._models.setdefault(model_name, _empty_model())
+            lineage: list[dict[str, Any]] = []
+            if lineage_step is not None:
+                step = {**lineage_step, "trainedAt": trained_at, "artifactSha256": artifact_sha256}
+                previous = self.get(model_name) or {}
+                if step.get("mode") == "incremental":
+                    step.setdefault("parentSha256", previous.get("artifactSha256"))
+                    lineage = list(previous.get("lineage") or [])
+                lineage = (lineage + [step])[-MAX_LINEAGE:]
+            versions = record["versions"]
+            entry = {
+                "modelName": model_name,
+                "version": version,
+                "revision": (versions[-1]["revision"] + 1) if versions else 1,
+                "trainedAt": trained_at,
+                "metrics": metrics or {},
+                "status": "inactive",
+                "artifactPath": artifact_path,
+                "artifactSha256": artifact_sha256,
+                "artifactFormat": ARTIFACT_FORMAT if artifact_path else None,
+                "lineage": lineage,
+            }
+            versions.append(entry)
+            if not record["pinned"] or record["active"] is None:
+                self._activate(record, entry["revision"])
+            self._save()
+            return entry
+
+    def activate(
+        self, model_name: str, revision: int, pinned: bool | None = None, rollback: bool = False,
+    ) -> dict[str, Any]:
+        """
+        Make a recorded revision the active one; pinned sets or clears the pin.
+        rollback=True drops the current revision from the history instead of
+        pushing the new one, so repeated rollbacks keep walking back.
+        Raises KeyError for an unknown model or revision.
+        """
+        with self._lock:
+            record = self._models[model_name]
+            entry = self._find(record, revision)
+            if rollback:
+                record["history"] = record["history"][:-1]
+                record["active"] = None
+            self._activate(record, revision)
+            if pinned is not None:
+                record["pinned"] = pinned
+            self._save()
+            return entry
+
+    def set_pinned(self, model_name: str, pinned: bool) -> None:
+        with self._lock:
+            self._models[model_name]["pinned"] = pinned
+            self._save()
+
+    def pinned(self, model_name: str) -> bool:
+        with self._lock:
+            return self._models[model_name]["pinned"]
+
+    def previous(self, model_name: str) -> int | None:
+        """The revision that was active before the current one, if any."""
+        with self._lock:
+            history = self._models[model_name]["history"]
+            return history[-2] if len(history) >= 2 else None
+
+    @staticmethod
+    def _find(record: dict[str, Any], revision: int) -> dict[str, Any]:
+        for entry in record["versions"]:
+            if entry["revision"] == revision:
+                return entry
+        raise KeyError(revision)
+
+    def _activate(self, record: dict[str, Any], revision: int) -> None:
+        if record["active"] == revision:
+            return
+        for entry in record["versions"]:
+            entry["status"] = "active" if entry["revision"] == revision else "inactive"
+        record["active"] = revision
+        if not record["history"] or record["history"][-1] != revision:
+            record["history"] = (record["history"] + [revision])[-MAX_HISTORY:]
+
+    # ------------------------------------------------------------------
+    def get(self, model_name: str) -> dict[str, Any] | None:
+        """The active version of a model."""
+        with self._lock:
+            record = self._models.get(model_name)
+            if not record or record["active"] is None:
+                return None
+            return self._find(record, record["active"])
+
+    def version(self, model_name: str, revision: int) -> dict[str, Any]:
+        """A recorded version of a model. Raises KeyError if there is none."""
+        with self._lock:
+            return self._find(self._models[model_name], revision)
+
+    def find(self, model_name: str, ref: int | str) -> dict[str, Any]:
+        """
+        A recorded version of a model by revision number or artifact sha256.
+        Raises KeyError if there is none.
+        """
+        with self._lock:
+            record = self._models[model_name]
+            if isinstance(ref, int):
+                return self._find(record, ref)
+            for entry in record["versions"]:
+                if entry.get("artifactSha256") == ref:
+                    return entry
+            raise KeyError(ref)
+
+    def describe(self, model_name: str) -> dict[str, Any]:
+        """All versions of a model, plus which one is active and whether it is pinned. Raises KeyError."""
+        with self._lock:
+            record = self._models[model_name]
+            return {
+                "modelName": model_name,
+                "active": record["active"],
+                "pinned": record["pinned"],
+                "previous": self.previous(model_name),
+                "versions": [dict(entry) for entry in record["versions"]],
+            }
+
+    def names(self) -> list[str]:
+        with self._lock:
+            return list(self._models)
+
+    def all(self) -> list[dict[str, Any]]:
+        """The active version of every model."""
+        with self._lock:
+            out = []
+            for name, record in self._models.items():
+                entry = self.get(name)
+                if entry is not None:
+                    out.append({**entry, "pinned": record["pinned"], "versionCount": len(record["versions"])})
+            return out
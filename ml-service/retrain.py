@@ -0,0 +1,327 @@
+"""
+Out-of-process retraining with atomic hot-swap.
+
+A retrain runs in a separate, lower-priority worker process, so it never holds
+the serving process's GIL. The worker trains a complete model set and writes
+it to a fresh artifact directory. The serving process then loads the new
+artifacts, checks their hashes, and publishes them with
+EnsembleModel.load_artifacts, a single reference swap of an immutable ModelSet.
+In-flight requests finish on the set they started with.
+
+The worker trains from the feature log (feature_log.py) when asked to, or, with
+source="auto", once the log holds at least RETRAIN_MIN_LOG_ROWS rows; otherwise
+it trains on the synthetic sets. The log's is_fraud column is the ensemble's
+own decision, so it is never a training label. XGBoost only trains from the
+log when confirmed outcomes are available (labels.py), and stays on synthetic
+data otherwise. The unsupervised models learn from the rows the ensemble
+did not flag.
+
+mode="incremental" starts from the registered artifacts instead of from scratch:
+each model's update() continues from its current state on the newest
+RETRAIN_INCREMENTAL_ROWS log rows (under the same label rule), or on a fresh
+synthetic draw. XGBoost boosts
+a few more rounds, the autoencoder fine-tunes, and IsolationForest regrows a
+fraction of its trees. Every step is appended to the model's lineage in the
+registry.
+
+The worker process is kept alive between retrains (RETRAIN_KEEP_WORKER=1), so
+only the first one pays for spawning it and importing torch / xgboost / sklearn;
+otherwise that fixed cost would dominate an incremental retrain.
+
+While a retrain is running, /predict latencies are recorded; when it finishes,
+their p99 is published as ml_predict_p99_during_retrain_seconds and reported
+by GET /model/retrain/status.
+"""
+from __future__ import annotations
+
+import logging
+import multiprocessing as mp
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timezone
+from typing import Callable
+
+import numpy as np
+from prometheus_client import Gauge
+
+from ensemble import EnsembleModel
+from feature_log import FEATURE_LOG_DIR
+from registry import ARTIFACT_DIR, ModelRegistry
+
+logger = logging.getLogger(__name__)
+
+RETRAIN_NICE = int(os.getenv("RETRAIN_NICE", "10"))
+RETRAIN_THREADS = os.getenv("RETRAIN_THREADS", "1")
+RETRAIN_MIN_LOG_ROWS = int(os.getenv("RETRAIN_MIN_LOG_ROWS", "10000"))
+RETRAIN_INCREMENTAL_ROWS = int(os.getenv("RETRAIN_INCREMENTAL_ROWS", "50000"))
+RETRAIN_KEEP_WORKER = os.getenv("RETRAIN_KEEP_WORKER", "1") == "1"
+
+
+class RetrainInProgress(RuntimeError):
+    pass
+
+
+def _init_worker() -> None:
+    # Leave the cores to request handling: lower priority and a small thread budget
+    for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[var] = RETRAIN_THREADS
+    try:
+        os.nice(RETRAIN_NICE)
+    except (AttributeError, OSError):
+        pass
+
+
+def _train_model_set(
+    directory: str, source: str, log_dir: str, mode: str = "full", base: dict[str, dict] | None = None,
+) -> dict[str, dict]:
+    """
+    Runs in the worker process: train (mode="full") or update (mode="incremental",
+    from the base artifacts) every model and persist it under directory.
+    """
+    from ensemble import MODEL_CLASSES  # noqa: PLC0415
+    from feature_log import FeatureLogReader  # noqa: PLC0415
+    from registry import file_sha256  # noqa: PLC0415
+
+    reader = FeatureLogReader(log_dir) if source != "synthetic" and log_dir else None
+    log_rows = len(reader) if reader is not None else 0
+    if source == "feature_log" and log_rows == 0:
+        raise ValueError(f"feature log {log_dir!r} is empty")
+    use_log = log_rows > 0 and (source == "feature_log" or log_rows >= RETRAIN_MIN_LOG_ROWS)
+    recent = reader.recent(RETRAIN_INCREMENTAL_ROWS) if use_log and mode == "incremental" else None
+    labels = _load_labels() if use_log else None
+
+    artifacts: dict[str, dict] = {}
+    for name, cls in MODEL_CLASSES.items():
+        model = cls()
+        if mode == "incremental":
+            step = _update_model(model, base[name], recent, labels)
+        else:
+            step = _train_model(model, name, reader if use_log else None, labels, strict=source == "feature_log")
+        path = model.save(directory)
+        artifacts[name] = {
+            "version": model.version,
+            "path": path,
+            "sha256": file_sha256(path),
+            "metrics": {k: step[k] for k in ("mode", "trainingSource", "trainingRows") if k in step},
+            "lineage": step,
+        }
+    return artifacts
+
+
+def _load_labels():
+    from labels import RETRAIN_LABELS_PATH, LabelStore  # noqa: PLC0415
+
+    try:
+        labels = LabelStore.load(RETRAIN_LABELS_PATH)
+    except OSError as exc:
+        logger.warning("Cannot read confirmed labels from %s: %s", RETRAIN_LABELS_PATH, exc)
+        return None
+    if labels is not None:
+        logger.info("Loaded %d confirmed outcomes from %s", len(labels), RETRAIN_LABELS_PATH)
+    return labels
+
+
+def _train_model(model, name: str, reader, labels, strict: bool) -> dict:
+    if reader is not None and model.supervised and labels is None:
+        logger.info("No confirmed labels (RETRAIN_LABELS_PATH); training %s on synthetic data", name)
+        reader = None
+    if reader is not None:
+        try:
+            rows = model.train_from_log(reader, labels) if model.supervised else model.train_from_log(reader)
+            return {"mode": "full", "generation": 0, "trainingSource": "feature_log", "trainingRows": rows}
+        except ValueError as exc:
+            if strict:
+                raise
+            logger.warning("Cannot train %s from the feature log, using synthetic data: %s", name, exc)
+    model.train_on_synthetic()
+    return {"mode": "full", "generation": 0, "trainingSource": "synthetic"}
+
+
+def _update_rows(model, recent, labels) -> tuple[np.ndarray, np.ndarray | None] | None:
+    """
+    (X, y) for an incremental update from recent log rows, or None to use synthetic
+    data. XGBoost needs confirmed outcomes covering both classes; the unsupervised
+    models take the rows the ensemble did not flag.
+    """
+    if recent is None or not len(recent):
+        return None
+    if not model.supervised:
+        X = recent["features"][recent["is_fraud"] == 0]
+        return (X, None) if len(X) else None
+    if labels is None:
+        return None
+    mask, y = labels.join(recent)
+    if len(np.unique(y)) < 2:
+        return None
+    return recent["features"][mask], y
+
+
+def _update_model(model, base: dict, recent, labels) -> dict:
+    from registry import file_sha256  # noqa: PLC0415
+
+    if file_sha256(base["path"]) != base["sha256"]:
+        raise ValueError(f"base artifact failed hash check: {base['path']}")
+    model.load(base["path"])
+    generation = base["generation"] + 1
+    rows = _update_rows(model, recent, labels)
+    if rows is not None:
+        (X, y), origin = rows, "feature_log"
+    else:
+        # A new draw per generation, so successive synthetic updates see new rows
+        (X, y), origin = model.synthetic_data(seed=generation), "synthetic"
+    details = model.update(X, y, seed=generation)
+    return {
+        "mode": "incremental",
+        "generation": generation,
+        "parentSha256": base["sha256"],
+        "trainingSource": origin,
+        "trainingRows": int(len(X)),
+        **details,
+    }
+
+
+class Retrainer:
+    def __init__(
+        self,
+        ensemble: EnsembleModel,
+        registry: ModelRegistry | None = None,
+        artifact_root: str = ARTIFACT_DIR,
+        feature_log_dir: str = FEATURE_LOG_DIR,
+        on_swapped: Callable[[], None] | None = None,
+        p99_gauge: Gauge | None = None,
+    ) -> None:
+        self._ensemble = ensemble
+        self._registry = registry
+        self._artifact_root = artifact_root
+        self._feature_log_dir = feature_log_dir
+        self._on_swapped = on_swapped
+        self._p99_gauge = p99_gauge
+        self._lock = threading.Lock()
+        self._executor: ProcessPoolExecutor | None = None
+        self._running = False
+        self._started_at = 0.0
+        self._latencies: deque[float] = deque(maxlen=200_000)
+        self._last: dict | None = None
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def record_latency(self, seconds: float) -> None:
+        if self._running:
+            self._latencies.append(seconds)
+
+    def status(self) -> dict:
+        return {"running": self._running, "last": self._last}
+
+    # ------------------------------------------------------------------
+    def _base_artifacts(self) -> dict[str, dict] | None:
+        """Registered artifact + lineage generation of every model, or None if any is missing."""
+        if self._registry is None:
+            return None
+        from ensemble import MODEL_NAMES  # noqa: PLC0415
+
+        base: dict[str, dict] = {}
+        for name in MODEL_NAMES:
+            entry = self._registry.get(name) or {}
+            path = entry.get("artifactPath")
+            if not path or not entry.get("artifactSha256") or not os.path.exists(path):
+                return None
+            lineage = entry.get("lineage") or []
+            base[name] = {
+                "path": path,
+                "sha256": entry["artifactSha256"],
+                "generation": lineage[-1].get("generation", 0) if lineage else 0,
+            }
+        return base
+
+    def start(self, source: str = "auto", mode: str = "full") -> Future:
+        """
+        Launch a retrain; the returned future resolves with the status once the new set is live.
+        source is "synthetic", "feature_log" or "auto"; mode is "full" or "incremental"
+        (falls back to full when a model has no registered artifact to start from).
+        """
+        with self._lock:
+            if self._running:
+                raise RetrainInProgress("Retrain already in progress")
+            self._running = True
+            self._started_at = time.perf_counter()
+            self._latencies.clear()
+
+        executor: ProcessPoolExecutor | None = None
+        try:
+            base = self._base_artifacts() if mode == "incremental" else None
+            if mode == "incremental" and base is None:
+                logger.warning("No registered artifacts to update; running a full retrain")
+                mode = "full"
+
+            stamp = datetime.now(tz=timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+            directory = os.path.join(self._artifact_root, f"retrain-{stamp}")
+            done: Future = Future()
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=1, mp_context=mp.get_context("spawn"), initializer=_init_worker,
+                )
+            executor = self._executor
+            job = executor.submit(_train_model_set, directory, source, self._feature_log_dir, mode, base)
+        except BaseException:
+            # Nothing was started: a later call must not see a retrain "already in progress",
+            # nor reuse a pool that refused the job
+            if executor is not None:
+                self._drop_executor(executor)
+            with self._lock:
+                self._running = False
+            raise
+        job.add_done_callback(lambda f: self._finish(f, directory, mode, executor, done))
+        logger.info("Retrain (%s) started in worker process → %s", mode, directory)
+        return done
+
+    def _drop_executor(self, executor: ProcessPoolExecutor) -> None:
+        executor.shutdown(wait=False)
+        if self._executor is executor:
+            self._executor = None
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._drop_executor(self._executor)
+
+    def _finish(self, job: Future, directory: str, mode: str, executor: ProcessPoolExecutor, done: Future) -> None:
+        status: dict = {"artifactDir": directory, "mode": mode}
+        try:
+            artifacts = job.result()
+            train_seconds = time.perf_counter() - self._started_at
+            swap_started = time.perf_counter()
+            self._ensemble.load_artifacts(artifacts)
+            status.update(
+                status="complete",
+                trainSeconds=round(train_seconds, 3),
+                swapSeconds=round(time.perf_counter() - swap_started, 4),
+                training={name: art["metrics"] for name, art in artifacts.items()},
+            )
+            if self._on_swapped is not None:
+                self._on_swapped()
+        except Exception as exc:  # noqa: BLE001
+            logger.exception("Retrain failed; keeping the live model set")
+            status.update(status="failed", error=str(exc))
+            if isinstance(exc, BrokenProcessPool):
+                self._drop_executor(executor)
+        if not RETRAIN_KEEP_WORKER:
+            self._drop_executor(executor)
+
+        latencies = list(self._latencies)
+        status["predictRequestsDuring"] = len(latencies)
+        if latencies:
+            p99 = float(np.percentile(latencies, 99))
+            status["predictP99MsDuring"] = round(p99 * 1000.0, 3)
+            if self._p99_gauge is not None:
+                self._p99_gauge.set(p99)
+        status["finishedAt"] = datetime.now(tz=timezone.utc).isoformat()
+
+        with self._lock:
+            self._last = status
+            self._running = False
+        done.set_result(status)
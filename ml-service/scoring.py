@@ -0,0 +1,120 @@
+"""
+Feature building + ensemble scoring shared by every serving path: the in-process
+micro-batcher, /predict/batch, and the per-shard worker processes in sharding.py.
+"""
+from __future__ import annotations
+
+import time
+from datetime import datetime
+from typing import Sequence
+
+from prometheus_client import Histogram
+
+from drift import DriftMonitor
+from ensemble import EnsembleModel, EnsembleResult
+from explain import explain_batch
+from feature_log import FeatureLogWriter
+from features import FeatureEngineer
+from shadow import ShadowEvaluator
+
+# (user_id, amount, location, device_id, timestamp)
+Record = tuple[str, float, str, str, datetime]
+
+
+def to_response(result: EnsembleResult) -> dict:
+    return {
+        "fraudScore":   result.fraud_score,
+        "isFraud":      result.is_fraud,
+        "confidence":   result.confidence,
+        "modelScores":  result.model_scores,
+        "modelWeights": result.model_weights,
+        "modelsRun":    result.models_run,
+        "explanations": result.explanations,
+    }
+
+
+def score_records(
+    feature_engineer: FeatureEngineer,
+    ensemble: EnsembleModel,
+    records: Sequence[Record],
+    time_ordered: bool,
+    feature_log: FeatureLogWriter | None = None,
+    features_hist: Histogram | None = None,
+    shadow: ShadowEvaluator | None = None,
+    explain: Sequence[bool] | None = None,
+    explain_hist: Histogram | None = None,
+    drift: DriftMonitor | None = None,
+) -> list[dict | Exception]:
+    """
+    Update feature state for records and score them as one batch. Responses keep
+    input order. With a feature_log, the scored rows are queued for the log; with
+    a shadow evaluator, they are mirrored to its challengers; with a drift
+    monitor, they are added to its histograms. Rows flagged in explain also get
+    model-based feature contributions.
+
+    A record whose features cannot be built gets its exception in place of a
+    response; it leaves feature state untouched and the rest of the batch is scored.
+    """
+    started = time.perf_counter()
+    errors: dict[int, Exception] = {}
+    feats = feature_engineer.build_batch(records, time_ordered=time_ordered, errors=errors)
+    if features_hist is not None:
+        features_hist.observe(time.perf_counter() - started)
+    if errors:
+        ok = [i for i in range(len(records)) if i not in errors]
+        records, feats = [records[i] for i in ok], [feats[i] for i in ok]
+        explain = [explain[i] for i in ok] if explain is not None else None
+    results = ensemble.predict_batch(
+        feats,
+        locations=[r[2] for r in records],
+        device_ids=[r[3] for r in records],
+    )
+    if feature_log is not None and results:
+        feature_log.append(records, feats, results)
+    if shadow is not None and results:
+        shadow.submit(feats, results)
+    if drift is not None and results:
+        drift.observe(feats, results)
+    responses = [to_response(r) for r in results]
+    if explain is not None and any(explain):
+        rows = [i for i, flag in enumerate(explain) if flag]
+        add_contributions(ensemble, [feats[i] for i in rows], [responses[i] for i in rows], explain_hist)
+    if not errors:
+        return responses
+    scored = iter(responses)
+    return [errors[i] if i in errors else next(scored) for i in range(len(errors) + len(responses))]
+
+
+def add_contributions(
+    ensemble: EnsembleModel,
+    feats: Sequence[Sequence[float]],
+    responses: Sequence[dict],
+    explain_hist: Histogram | None = None,
+) -> None:
+    """Attach featureContributions / modelContributions to responses, one batched call per model."""
+    started = time.perf_counter()
+    for response, extra in zip(responses, explain_batch(ensemble.snapshot(), feats)):
+        response.update(extra)
+    if explain_hist is not None:
+        explain_hist.observe(time.perf_counter() - started)
+
+
+def explain_records(
+    feature_engineer: FeatureEngineer,
+    ensemble: EnsembleModel,
+    records: Sequence[Record],
+    explain_hist: Histogram | None = None,
+) -> list[dict]:
+    """
+    Score and explain records against the current feature state without recording
+    them (FeatureEngineer.peek): nothing is logged, mirrored or added to history.
+    """
+    feats = [feature_engineer.peek(*r) for r in records]
+    results = ensemble.predict_batch(
+        feats,
+        locations=[r[2] for r in records],
+        device_ids=[r[3] for r in records],
+    )
+    responses = [to_response(r) for r in results]
+    add_contributions(ensemble, feats, responses, explain_hist)
+    return responses
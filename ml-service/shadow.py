@@ -0,0 +1,269 @@
+"""
+Shadow / challenger evaluation off the hot path.
+
+A challenger is a candidate ensemble: other weights, another threshold and/or
+other registered model versions, layered over the live (champion) set at scoring time so
+it follows retrains of the models it does not replace. Scored batches are
+mirrored into a bounded queue with put_nowait, so the serving path never waits;
+when the queue is full the batch is dropped and counted. A single background
+thread drains the queue, scores everything queued with each challenger in one
+call, and accumulates agreement statistics against the decisions actually served.
+
+    SHADOW_QUEUE_BATCHES   bound on queued batches (default 1024)
+    SHADOW_SAMPLE_RATE     share of batches mirrored (default 1.0)
+"""
+from __future__ import annotations
+
+import atexit
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from dataclasses import dataclass, field, replace
+from typing import Sequence
+
+import numpy as np
+from prometheus_client import Counter, Gauge
+
+from ensemble import EnsembleModel, EnsembleResult, ModelSet
+
+logger = logging.getLogger(__name__)
+
+SHADOW_QUEUE_BATCHES = int(os.getenv("SHADOW_QUEUE_BATCHES", "1024"))
+SHADOW_SAMPLE_RATE = float(os.getenv("SHADOW_SAMPLE_RATE", "1.0"))
+
+
+@dataclass(frozen=True)
+class Challenger:
+    name: str
+    weights: dict[str, float] | None = None
+    threshold: float | None = None
+    models: dict[str, object] = field(default_factory=dict)  # replacement models, loaded from the registry
+    artifacts: dict[str, dict] = field(default_factory=dict)  # model name -> revision and artifactSha256
+
+    def model_set(self, champion: ModelSet) -> ModelSet:
+        return replace(
+            champion,
+            weights={**champion.weights, **(self.weights or {})},
+            threshold=champion.threshold if self.threshold is None else self.threshold,
+            cascade=None,  # a challenger is always judged with every model
+            **self.models,
+        )
+
+    def describe(self) -> dict:
+        return {"weights": self.weights, "fraudThreshold": self.threshold, "artifacts": self.artifacts}
+
+
+def load_challenger(
+    ensemble: EnsembleModel,
+    name: str,
+    weights: dict[str, float] | None = None,
+    threshold: float | None = None,
+    artifacts: dict[str, int | str] | None = None,
+) -> Challenger:
+    """
+    Build a challenger, loading any replacement models up front. artifacts maps a
+    model name to a registry revision or artifact sha256: only artifacts the
+    registry recorded are loaded, and only after their hash checks out, never an
+    arbitrary path. Raises ValueError / OSError on bad input.
+    """
+    models, loaded = {}, {}
+    for model_name, ref in (artifacts or {}).items():
+        try:
+            model, entry = ensemble.load_version(model_name, ref)
+        except KeyError as exc:
+            raise ValueError(f"no registered version {ref!r} of {model_name}") from exc
+        models[model_name] = model
+        loaded[model_name] = {"revision": entry["revision"], "artifactSha256": entry["artifactSha256"]}
+    return Challenger(name, weights, threshold, models, loaded)
+
+
+class _Agreement:
+    """Running champion-vs-challenger statistics."""
+
+    def __init__(self) -> None:
+        self.rows = 0
+        self.agree = 0
+        self.fraud_to_legit = 0  # champion flagged, challenger would not
+        self.legit_to_fraud = 0
+        self.champion_fraud = 0
+        self.challenger_fraud = 0
+        self.abs_diff = 0.0
+        self.max_abs_diff = 0.0
+        self.seconds = 0.0
+        self._sums = np.zeros(5)  # x, y, xx, yy, xy for the score correlation
+
+    def add(self, champion: np.ndarray, champion_fraud: np.ndarray, scores: np.ndarray, fraud: np.ndarray) -> None:
+        self.rows += len(scores)
+        self.agree += int((champion_fraud == fraud).sum())
+        self.fraud_to_legit += int((champion_fraud & ~fraud).sum())
+        self.legit_to_fraud += int((~champion_fraud & fraud).sum())
+        self.champion_fraud += int(champion_fraud.sum())
+        self.challenger_fraud += int(fraud.sum())
+        diff = np.abs(scores - champion)
+        self.abs_diff += float(diff.sum())
+        self.max_abs_diff = max(self.max_abs_diff, float(diff.max()))
+        self._sums += (
+            champion.sum(), scores.sum(), (champion * champion).sum(), (scores * scores).sum(), (champion * scores).sum(),
+        )
+
+    def summary(self) -> dict:
+        n = self.rows
+        if not n:
+            return {"rows": 0}
+        sx, sy, sxx, syy, sxy = self._sums
+        var_x, var_y = sxx / n - (sx / n) ** 2, syy / n - (sy / n) ** 2
+        corr = (sxy / n - sx * sy / n / n) / np.sqrt(var_x * var_y) if var_x > 0 and var_y > 0 else None
+        return {
+            "rows": n,
+            "agreementRate": round(self.agree / n, 6),
+            "fraudToLegit": self.fraud_to_legit,
+            "legitToFraud": self.legit_to_fraud,
+            "championFraudRate": round(self.champion_fraud / n, 6),
+            "challengerFraudRate": round(self.challenger_fraud / n, 6),
+            "meanAbsScoreDiff": round(self.abs_diff / n, 6),
+            "maxAbsScoreDiff": round(self.max_abs_diff, 6),
+            "scoreCorrelation": round(float(corr), 6) if corr is not None else None,
+            "usPerRow": round(self.seconds / n * 1e6, 2),
+        }
+
+
+class ShadowEvaluator:
+    def __init__(
+        self,
+        champion: EnsembleModel,
+        queue_batches: int = SHADOW_QUEUE_BATCHES,
+        sample_rate: float = SHADOW_SAMPLE_RATE,
+        rows: Counter | None = None,
+        agreement: Gauge | None = None,
+    ) -> None:
+        self._champion = champion
+        # Separate, uninstrumented scorer: shadow work must not show up in the serving metrics
+        self._scorer = EnsembleModel(champion._registry)
+        self._queue: queue.Queue = queue.Queue(maxsize=max(1, queue_batches))
+        self._sample_rate = sample_rate
+        # Label children resolved once, to keep submit() cheap
+        self._count_enqueued = rows.labels(result="enqueued").inc if rows is not None else None
+        self._count_dropped = rows.labels(result="dropped").inc if rows is not None else None
+        self._agreement_gauge = agreement
+        self._lock = threading.Lock()
+        self._challengers: dict[str, tuple[Challenger, _Agreement, float]] = {}
+        self.rows_enqueued = 0
+        self.rows_dropped = 0
+        self.rows_scored = 0
+        self._thread = threading.Thread(target=self._run, name="shadow-eval", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    # ------------------------------------------------------------------
+    def register(self, challenger: Challenger) -> None:
+        """Add or replace a challenger; its statistics start from zero."""
+        with self._lock:
+            self._challengers[challenger.name] = (challenger, _Agreement(), time.time())
+
+    def remove(self, name: str) -> bool:
+        with self._lock:
+            removed = self._challengers.pop(name, None) is not None
+        if removed and self._agreement_gauge is not None:
+            try:
+                self._agreement_gauge.remove(name)
+            except KeyError:
+                pass
+        return removed
+
+    def submit(self, features, results: Sequence[EnsembleResult]) -> bool:
+        """Mirror one scored batch to the challengers. Never blocks; returns False if dropped or not sampled."""
+        if not self._challengers or (self._sample_rate < 1.0 and random.random() >= self._sample_rate):
+            return False
+        try:
+            self._queue.put_nowait((features, results))
+        except queue.Full:
+            self.rows_dropped += len(results)
+            if self._count_dropped is not None:
+                self._count_dropped(len(results))
+            return False
+        self.rows_enqueued += len(results)
+        if self._count_enqueued is not None:
+            self._count_enqueued(len(results))
+        return True
+
+    def flush(self, timeout: float = 5.0) -> None:
+        """Block until everything enqueued so far has been scored (tests / shutdown)."""
+        marker = threading.Event()
+        self._queue.put(marker, timeout=timeout)
+        marker.wait(timeout)
+
+    def close(self) -> None:
+        if self._thread.is_alive():
+            try:
+                self._queue.put(None, timeout=5)
+            except queue.Full:
+                pass
+            self._thread.join(timeout=5)
+
+    def stats(self) -> dict:
+        with self._lock:
+            challengers = {
+                name: {
+                    **challenger.describe(),
+                    "registeredAt": registered_at,
+                    **agreement.summary(),
+                }
+                for name, (challenger, agreement, registered_at) in self._challengers.items()
+            }
+        return {
+            "queueDepth": self._queue.qsize(),
+            "rowsEnqueued": self.rows_enqueued,
+            "rowsDropped": self.rows_dropped,
+            "rowsScored": self.rows_scored,
+            "sampleRate": self._sample_rate,
+            "challengers": challengers,
+        }
+
+    # ------------------------------------------------------------------
+    def _evaluate(self, batches: list[tuple]) -> None:
+        X = np.concatenate([np.asarray(f, dtype=np.float64).reshape(-1, 5) for f, _ in batches])
+        results = [r for _, rs in batches for r in rs]
+        champion = np.array([r.fraud_score for r in results], dtype=np.float64)
+        champion_fraud = np.array([r.is_fraud for r in results], dtype=bool)
+        live = self._champion.snapshot()
+        with self._lock:
+            challengers = list(self._challengers.values())
+        for challenger, agreement, _ in challengers:
+            model_set = challenger.model_set(live)
+            started = time.perf_counter()
+            scores, _ = self._scorer.score_batch(X, model_set)
+            fraud = scores >= model_set.threshold
+            with self._lock:
+                agreement.seconds += time.perf_counter() - started
+                # Served scores are rounded to 4 places; compare like with like
+                agreement.add(champion, champion_fraud, np.round(scores, 4), fraud)
+            if self._agreement_gauge is not None:
+                self._agreement_gauge.labels(challenger=challenger.name).set(agreement.agree / agreement.rows)
+        self.rows_scored += len(X)
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            pending = [item]
+            # Drain whatever else is queued so each challenger scores many requests in one call
+            while True:
+                try:
+                    pending.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = any(entry is None for entry in pending)
+            batches = [entry for entry in pending if isinstance(entry, tuple)]
+            if batches:
+                try:
+                    self._evaluate(batches)
+                except Exception:  # noqa: BLE001
+                    logger.exception("Shadow evaluation failed; dropping %d batches", len(batches))
+                    self.rows_dropped += sum(len(rs) for _, rs in batches)
+            for entry in pending:
+                if isinstance(entry, threading.Event):
+                    entry.set()
+            if stop:
+                return
@@ -0,0 +1,383 @@
+"""
+User-sharded multi-process serving.
+
+Per-user feature state only makes sense if every transaction of a user goes
+through the same FeatureEngineer. With SERVING_SHARDS=N the API process keeps
+no feature state itself: it routes each userId to one of N worker processes by
+consistent hashing, and each worker owns the FeatureEngineer for its users
+plus its own copy of the ensemble (loaded from the persisted artifacts). Feature
+values are therefore identical to single-process mode while scoring runs on N
+cores. Run uvicorn with a single worker in this mode; the shards provide the
+parallelism.
+
+Messages to a worker are processed in the order they are sent, so a user's
+transactions keep their arrival order.
+
+A worker that dies is restarted in the background. It recovers its users'
+feature state from its snapshot and WAL, and gets the last /model/config
+again. Until it is ready, requests for its users fail fast and /ready reports
+it; a batch that needs it is rejected before any other shard records a row. Restarts wait SHARD_RESTART_DELAY_S, doubling while a worker keeps dying
+before it is ready, up to SHARD_RESTART_MAX_DELAY_S.
+"""
+from __future__ import annotations
+
+import bisect
+import hashlib
+import logging
+import multiprocessing as mp
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Future
+from typing import Any, Callable, Sequence
+
+from scoring import Record
+
+logger = logging.getLogger(__name__)
+
+SERVING_SHARDS = int(os.getenv("SERVING_SHARDS", "0"))
+SHARD_VNODES = int(os.getenv("SHARD_VNODES", "128"))
+SHARD_READY_TIMEOUT_S = float(os.getenv("SHARD_READY_TIMEOUT_S", "600"))
+SHARD_RESTART_DELAY_S = float(os.getenv("SHARD_RESTART_DELAY_S", "1"))
+SHARD_RESTART_MAX_DELAY_S = float(os.getenv("SHARD_RESTART_MAX_DELAY_S", "60"))
+
+
+class ShardUnavailable(RuntimeError):
+    """The shard owning a user is down and being restarted."""
+
+
+def _hash64(key: str) -> int:
+    # Stable across processes and restarts, unlike the builtin hash()
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class ConsistentHashRing:
+    """Maps keys to shard indices; adding a shard moves only ~1/N of the keys."""
+
+    def __init__(self, n_shards: int, vnodes: int = SHARD_VNODES) -> None:
+        points = sorted(
+            (_hash64(f"shard-{shard}#{v}"), shard)
+            for shard in range(n_shards)
+            for v in range(vnodes)
+        )
+        self._hashes = [h for h, _ in points]
+        self._shards = [s for _, s in points]
+
+    def shard_for(self, key: str) -> int:
+        idx = bisect.bisect_left(self._hashes, _hash64(key))
+        return self._shards[idx if idx < len(self._shards) else 0]
+
+
+# ── Worker process ───────────────────────────────────────────────────────────
+def _worker_main(conn, shard: int, n_shards: int) -> None:
+    # One core per shard: keep BLAS / OpenMP from oversubscribing
+    for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ.setdefault(var, "1")
+
+    from drift import DRIFT_ENABLED, DriftMonitor  # noqa: PLC0415
+    from ensemble import EnsembleModel  # noqa: PLC0415
+    from feature_log import FEATURE_LOG_DIR, FeatureLogWriter  # noqa: PLC0415
+    from feature_state import FEATURE_STATE_DIR, FeatureStateStore  # noqa: PLC0415
+    from features import FeatureEngineer  # noqa: PLC0415
+    from registry import ModelRegistry  # noqa: PLC0415
+    from scoring import explain_records, score_records  # noqa: PLC0415
+
+    registry = ModelRegistry()
+    ensemble = EnsembleModel(registry)
+    ensemble.load_or_train()
+    drift = DriftMonitor(ensemble) if DRIFT_ENABLED else None
+    feature_engineer = FeatureEngineer()
+    # Users map to shards by the ring, so saved state is only valid for the same shard count
+    feature_state = (
+        FeatureStateStore(os.path.join(FEATURE_STATE_DIR, f"shard{shard}-of-{n_shards}")) if FEATURE_STATE_DIR else None
+    )
+    if feature_state is not None:
+        feature_state.recover(feature_engineer)
+    feature_log = FeatureLogWriter(FEATURE_LOG_DIR, writer_id=f"shard{shard}") if FEATURE_LOG_DIR else None
+    conn.send((None, True, {"shard": shard, "pid": os.getpid()}))
+
+    while True:
+        try:
+            msg_id, kind, args = conn.recv()
+        except EOFError:
+            return
+        try:
+            if kind == "score":
+                records, time_ordered, explain = args
+                payload: Any = score_records(
+                    feature_engineer, ensemble, records, time_ordered, feature_log, explain=explain, drift=drift,
+                )
+            elif kind == "explain":
+                payload = explain_records(feature_engineer, ensemble, args)
+            elif kind == "config":
+                weights, threshold, cascade = args
+                ensemble.configure(weights, threshold)
+                if cascade is not None:
+                    ensemble.enable_cascade(cascade)
+                payload = None
+            elif kind == "reload":
+                registry.reload()
+                payload = ensemble.load_or_train()
+            elif kind == "drift":
+                payload = drift.counts() if drift is not None else {}
+            elif kind == "stop":
+                if feature_log is not None:
+                    feature_log.close()
+                if feature_state is not None:
+                    feature_state.close()
+                conn.send((msg_id, True, None))
+                return
+            else:
+                raise ValueError(f"unknown message {kind}")
+            conn.send((msg_id, True, payload))
+        except Exception as exc:  # noqa: BLE001
+            logger.exception("Shard %d failed on %s", shard, kind)
+            conn.send((msg_id, False, repr(exc)))
+
+
+# ── Router (API process) ─────────────────────────────────────────────────────
+class _Shard:
+    def __init__(
+        self, ctx, index: int, n_shards: int, worker: Callable = _worker_main,
+        on_exit: Callable[["_Shard"], None] | None = None,
+    ) -> None:
+        self.index = index
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(
+            target=worker, args=(child, index, n_shards), name=f"ml-shard-{index}", daemon=True,
+        )
+        self.process.start()
+        child.close()
+        self.send_lock = threading.Lock()
+        # Guards pending and dead, so no future is added after the reader has failed the rest
+        self.pending_lock = threading.Lock()
+        self.pending: dict[int, Future] = {}
+        self.dead = False
+        self.ready: Future = Future()
+        self._on_exit = on_exit
+        self.reader = threading.Thread(target=self._read_loop, name=f"ml-shard-{index}-reader", daemon=True)
+        self.reader.start()
+
+    @property
+    def alive(self) -> bool:
+        return not self.dead and self.ready.done() and self.ready.exception() is None
+
+    def _read_loop(self) -> None:
+        while True:
+            try:
+                msg_id, ok, payload = self.conn.recv()
+            except (EOFError, OSError):
+                error = ShardUnavailable(f"shard {self.index} exited")
+                with self.pending_lock:
+                    self.dead = True
+                    pending, self.pending = list(self.pending.values()), {}
+                if not self.ready.done():
+                    self.ready.set_exception(error)
+                for future in pending:
+                    if not future.done():
+                        future.set_exception(error)
+                if self._on_exit is not None:
+                    self._on_exit(self)
+                return
+            if msg_id is None:
+                self.ready.set_result(payload)
+                continue
+            with self.pending_lock:
+                future = self.pending.pop(msg_id, None)
+            if future is None:
+                continue
+            if ok:
+                future.set_result(payload)
+            else:
+                future.set_exception(RuntimeError(f"shard {self.index}: {payload}"))
+
+
+class ShardedScorer:
+    def __init__(self, n_shards: int, vnodes: int = SHARD_VNODES, worker: Callable = _worker_main) -> None:
+        self._ctx = mp.get_context("spawn")
+        self._worker = worker
+        self._n_shards = n_shards
+        self._ring = ConsistentHashRing(n_shards, vnodes)
+        self._ids = iter(range(1, 1 << 62))
+        self._id_lock = threading.Lock()
+        self._closing = False
+        # Accumulated /model/config changes (weights, threshold, cascade), replayed to restarted shards
+        self._config: tuple[dict[str, float], float | None, bool | None] = ({}, None, None)
+        self._failures = [0] * n_shards  # consecutive deaths before ready, per shard
+        self.restarts = 0
+        self._shards = [self._spawn(i) for i in range(n_shards)]
+        try:
+            for shard in self._shards:
+                info = shard.ready.result(timeout=SHARD_READY_TIMEOUT_S)
+                logger.info("Shard %d ready (pid %s)", shard.index, info["pid"])
+        except BaseException:
+            # Startup failed: stop every shard, and do not restart the ones that died
+            self.close()
+            raise
+
+    @property
+    def n_shards(self) -> int:
+        return len(self._shards)
+
+    def shard_for(self, user_id: str) -> int:
+        return self._ring.shard_for(user_id)
+
+    def dead_shards(self) -> list[int]:
+        """Shards that cannot score right now: exited, or restarting and not yet ready."""
+        return [shard.index for shard in self._shards if not shard.alive]
+
+    def _spawn(self, index: int) -> _Shard:
+        return _Shard(self._ctx, index, self._n_shards, self._worker, on_exit=self._restart)
+
+    def _restart(self, dead: _Shard) -> None:
+        # Runs on the dead shard's reader thread, which has nothing else left to do
+        if self._closing or self._shards[dead.index] is not dead:
+            return
+        dead.process.join(timeout=5)
+        index = dead.index
+        delay = min(SHARD_RESTART_MAX_DELAY_S, SHARD_RESTART_DELAY_S * 2.0 ** self._failures[index])
+        logger.error(
+            "Shard %d (pid %s) exited with code %s; restarting it in %.1fs",
+            index, dead.process.pid, dead.process.exitcode, delay,
+        )
+        time.sleep(delay)
+        if self._closing:
+            return
+        shard = self._spawn(index)
+        self._shards[index] = shard
+        self.restarts += 1
+        try:
+            info = shard.ready.result(timeout=SHARD_READY_TIMEOUT_S)
+            if self._config != ({}, None, None):
+                self._call(shard, "config", self._config).result(timeout=SHARD_READY_TIMEOUT_S)
+        except Exception as exc:  # noqa: BLE001
+            # A worker that died is restarted again by its own reader thread
+            self._failures[index] += 1
+            logger.error("Shard %d failed to restart: %s", index, exc)
+            if shard.process.is_alive() and not shard.ready.done():
+                shard.process.kill()
+            return
+        self._failures[index] = 0
+        logger.info("Shard %d restarted (pid %s)", index, info["pid"])
+
+    def _call(self, shard: _Shard, kind: str, args: Any) -> Future:
+        with self._id_lock:
+            msg_id = next(self._ids)
+        future: Future = Future()
+        with shard.pending_lock:
+            if shard.dead:
+                raise ShardUnavailable(f"shard {shard.index} is down; it is being restarted")
+            shard.pending[msg_id] = future
+        try:
+            with shard.send_lock:
+                shard.conn.send((msg_id, kind, args))
+        except (OSError, ValueError) as exc:
+            with shard.pending_lock:
+                shard.pending.pop(msg_id, None)
+            raise ShardUnavailable(f"shard {shard.index} is down; it is being restarted") from exc
+        return future
+
+    def _call_ready(self, index: int, kind: str, args: Any) -> Future:
+        shard = self._shards[index]
+        if not shard.alive:
+            raise ShardUnavailable(f"shard {index} is down; it is being restarted")
+        return self._call(shard, kind, args)
+
+    # ------------------------------------------------------------------
+    def score(
+        self, records: Sequence[Record], time_ordered: bool, explain: Sequence[bool] | None = None,
+    ) -> list[dict | Exception]:
+        """
+        Score records on their owning shards in parallel; responses keep input order.
+
+        Scoring records them in feature state, so a batch is only sent once every
+        shard it needs is up: ShardUnavailable is raised before any shard has
+        recorded anything, and a retry counts no row twice. A shard that dies
+        after the batch went out fails only its own rows, which get the
+        ShardUnavailable in place of a response; the other shards' rows were
+        recorded and are returned.
+        """
+        by_shard = self._partition(records)
+        down = [s for s in by_shard if not self._shards[s].alive]
+        if down:
+            raise ShardUnavailable(f"shard {down[0]} is down; it is being restarted")
+        calls = []
+        for s, indices in by_shard.items():
+            try:
+                future = self._call_ready(
+                    s, "score",
+                    (
+                        [records[i] for i in indices],
+                        time_ordered,
+                        [explain[i] for i in indices] if explain is not None else None,
+                    ),
+                )
+            except ShardUnavailable as exc:  # died since the check
+                future = Future()
+                future.set_exception(exc)
+            calls.append((indices, future))
+        return self._gather(records, calls, row_errors=True)
+
+    def explain(self, records: Sequence[Record]) -> list[dict]:
+        """Explain records against their owning shards' feature state, without recording them."""
+        calls = [
+            (indices, self._call_ready(s, "explain", [records[i] for i in indices]))
+            for s, indices in self._partition(records).items()
+        ]
+        return self._gather(records, calls)
+
+    def _partition(self, records: Sequence[Record]) -> dict[int, list[int]]:
+        by_shard: dict[int, list[int]] = defaultdict(list)
+        for i, record in enumerate(records):
+            by_shard[self._ring.shard_for(record[0])].append(i)
+        return by_shard
+
+    @staticmethod
+    def _gather(
+        records: Sequence[Record], calls: list[tuple[list[int], Future]], row_errors: bool = False,
+    ) -> list[Any]:
+        out: list[Any] = [{} for _ in records]
+        for indices, future in calls:
+            try:
+                responses = future.result()
+            except ShardUnavailable as exc:
+                if not row_errors:
+                    raise
+                responses = [exc] * len(indices)
+            for i, response in zip(indices, responses):
+                out[i] = response
+        return out
+
+    def broadcast(self, kind: str, args: Any = None) -> list[Any]:
+        """
+        Send a control message (config / reload / drift) to every live shard and wait for
+        all of them. Shards that are down are skipped: a restarted shard loads the active
+        models and gets the accumulated config anyway.
+        """
+        if kind == "config":
+            weights, threshold, cascade = args
+            current_weights, current_threshold, current_cascade = self._config
+            self._config = (
+                {**current_weights, **(weights or {})},
+                current_threshold if threshold is None else threshold,
+                current_cascade if cascade is None else cascade,
+            )
+        futures = []
+        for shard in self._shards:
+            if not shard.alive:
+                logger.warning("Shard %d is down; not sending it %s", shard.index, kind)
+                continue
+            futures.append(self._call(shard, kind, args))
+        return [f.result() for f in futures]
+
+    def close(self) -> None:
+        self._closing = True
+        for shard in self._shards:
+            try:
+                self._call(shard, "stop", None).result(timeout=5)
+            except Exception:  # noqa: BLE001
+                pass
+            shard.process.join(timeout=5)
+            if shard.process.is_alive():
+                shard.process.terminate()
@@ -0,0 +1,187 @@
+"""
+Streaming quantile sketches over rolling time windows.
+
+DDSketch keeps log-spaced bucket counts: any quantile it returns is within
+relative_accuracy of the true value, sketches merge (and un-merge) by adding
+counts, and memory is fixed by the value range rather than by traffic.
+
+RollingSketch keeps one small sketch per time slot plus a running aggregate
+per window (1m / 5m / 1h by default). A slot leaving a window is subtracted
+from that window's aggregate, so adding values and querying a window cost the
+same no matter how much traffic the window holds.
+"""
+from __future__ import annotations
+
+import math
+import threading
+import time
+from typing import Callable, Iterable
+
+import numpy as np
+
+
+class DDSketch:
+    """
+    Fixed-range DDSketch (Masson et al., 2019). Values below min_value share one
+    bucket reported as 0; values above max_value are clamped to the top bucket.
+    """
+
+    def __init__(self, relative_accuracy: float = 0.01, min_value: float = 1e-6, max_value: float = 1.0) -> None:
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.max_value = max_value
+        self.gamma = (1.0 + relative_accuracy) / (1.0 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self._key_offset = math.ceil(math.log(min_value) / self._log_gamma)
+        n_keys = math.ceil(math.log(max_value) / self._log_gamma) - self._key_offset + 1
+        # counts[0] holds values below min_value; counts[i] the key (i - 1 + _key_offset)
+        self.counts = np.zeros(n_keys + 1, dtype=np.int64)
+        self.sum = 0.0
+
+    @property
+    def count(self) -> int:
+        return int(self.counts.sum())
+
+    def empty_like(self) -> "DDSketch":
+        return DDSketch(self.relative_accuracy, self.min_value, self.max_value)
+
+    # ------------------------------------------------------------------
+    # Below this many values, per-value Python arithmetic beats NumPy call overhead
+    _SMALL = 16
+
+    def bucket_indices(self, values: np.ndarray) -> np.ndarray | list[int]:
+        values = np.asarray(values, dtype=np.float64)
+        if values.size <= self._SMALL:
+            top = len(self.counts) - 1
+            return [
+                min(max(math.ceil(math.log(min(v, self.max_value)) / self._log_gamma) - self._key_offset + 1, 1), top)
+                if v >= self.min_value else 0
+                for v in values.tolist()
+            ]
+        idx = np.zeros(values.shape, dtype=np.intp)
+        above = values >= self.min_value
+        keys = np.ceil(np.log(np.minimum(values[above], self.max_value)) / self._log_gamma)
+        idx[above] = np.clip(keys.astype(np.intp) - self._key_offset + 1, 1, len(self.counts) - 1)
+        return idx
+
+    def add(self, values: Iterable[float] | np.ndarray) -> None:
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if values.size:
+            self.add_indices(self.bucket_indices(values), float(values.sum()))
+
+    def add_indices(self, idx: np.ndarray | list[int], total: float) -> None:
+        """Add values already mapped by bucket_indices (lets one mapping feed several sketches)."""
+        if isinstance(idx, list):
+            counts = self.counts
+            for i in idx:
+                counts[i] += 1
+        else:
+            self.counts += np.bincount(idx, minlength=len(self.counts))
+        self.sum += total
+
+    def merge(self, other: "DDSketch") -> None:
+        self.counts += other.counts
+        self.sum += other.sum
+
+    def subtract(self, other: "DDSketch") -> None:
+        """Remove a sketch previously merged into this one."""
+        self.counts -= other.counts
+        self.sum -= other.sum
+
+    def clear(self) -> None:
+        self.counts[:] = 0
+        self.sum = 0.0
+
+    # ------------------------------------------------------------------
+    def quantile(self, q: float) -> float | None:
+        total = self.count
+        if total == 0:
+            return None
+        rank = q * (total - 1)
+        i = int(np.searchsorted(np.cumsum(self.counts), rank, side="right"))
+        if i == 0:
+            return 0.0
+        key = i - 1 + self._key_offset
+        return min(2.0 * self.gamma ** key / (self.gamma + 1.0), self.max_value)
+
+    def mean(self) -> float | None:
+        total = self.count
+        return self.sum / total if total else None
+
+
+class RollingSketch:
+    """
+    DDSketch per slot_seconds slot, with running aggregates for each window.
+    add() also takes a count of flagged values (e.g. fraud decisions), so a
+    window can report its flagged rate exactly.
+    """
+
+    def __init__(
+        self,
+        windows: dict[str, int] | None = None,
+        slot_seconds: int = 10,
+        clock: Callable[[], float] = time.monotonic,
+        **sketch_kwargs,
+    ) -> None:
+        self.windows = windows or {"1m": 60, "5m": 300, "1h": 3600}
+        self._slot_seconds = slot_seconds
+        self._window_slots = {name: max(1, math.ceil(s / slot_seconds)) for name, s in self.windows.items()}
+        n_slots = max(self._window_slots.values())
+        template = DDSketch(**sketch_kwargs)
+        self._slots = [template.empty_like() for _ in range(n_slots)]
+        self._slot_flagged = np.zeros(n_slots, dtype=np.int64)
+        self._agg = {name: template.empty_like() for name in self.windows}
+        self._agg_flagged = dict.fromkeys(self.windows, 0)
+        self._clock = clock
+        self._current = int(clock() // slot_seconds)
+        self._lock = threading.Lock()
+
+    # ------------------------------------------------------------------
+    def _advance(self) -> None:
+        now = int(self._clock() // self._slot_seconds)
+        if now - self._current >= len(self._slots):
+            for sketch in self._slots:
+                sketch.clear()
+            self._slot_flagged[:] = 0
+            for name in self.windows:
+                self._agg[name].clear()
+                self._agg_flagged[name] = 0
+            self._current = now
+            return
+        n = len(self._slots)
+        while self._current < now:
+            self._current += 1
+            for name, w in self._window_slots.items():
+                leaving = (self._current - w) % n
+                self._agg[name].subtract(self._slots[leaving])
+                self._agg_flagged[name] -= int(self._slot_flagged[leaving])
+            reused = self._current % n
+            self._slots[reused].clear()
+            self._slot_flagged[reused] = 0
+
+    def add(self, values: Iterable[float] | np.ndarray, flagged: int = 0) -> None:
+        values = np.asarray(values, dtype=np.float64).ravel()
+        with self._lock:
+            self._advance()
+            slot = self._current % len(self._slots)
+            idx = self._slots[slot].bucket_indices(values)
+            total = float(values.sum())
+            self._slots[slot].add_indices(idx, total)
+            self._slot_flagged[slot] += flagged
+            for name in self.windows:
+                self._agg[name].add_indices(idx, total)
+                self._agg_flagged[name] += flagged
+
+    def summary(self, quantiles: Iterable[float] = (0.5, 0.95, 0.99)) -> dict[str, dict]:
+        """{window: {"count", "mean", "flagged", "p50", ...}} for every window."""
+        quantiles = tuple(quantiles)
+        out: dict[str, dict] = {}
+        with self._lock:
+            self._advance()
+            for name in self.windows:
+                sketch = self._agg[name]
+                stats = {"count": sketch.count, "mean": sketch.mean(), "flagged": self._agg_flagged[name]}
+                for q in quantiles:
+                    stats[f"p{round(q * 100):d}"] = sketch.quantile(q)
+                out[name] = stats
+        return out
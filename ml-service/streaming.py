@@ -0,0 +1,132 @@
+"""
+NDJSON stream scoring for POST /predict/stream.
+
+The client sends one PredictRequest per line over a single long-lived request
+and reads one response line per input line, in the same order. Lines are
+validated a batch at a time and queued for scoring; the scorer takes whatever
+has queued up (up to STREAM_MAX_BATCH records) as one batch. So a slow producer
+sees per-event latency, and a fast one gets large batches.
+
+Backpressure: the queue between reading and scoring holds at most
+STREAM_QUEUE_BATCHES batches. When it is full the reader stops pulling the
+request body, so the transport's flow control pushes back on the producer and
+memory stays bounded. Responses are produced only as fast as the client reads
+them, and the same chain throttles scoring.
+
+    STREAM_MAX_BATCH       records scored together at most (default 256)
+    STREAM_QUEUE_BATCHES   parsed batches buffered ahead of scoring (default 8)
+    STREAM_MAX_LINE_BYTES  longest accepted line (default 65536)
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+from typing import AsyncIterator, Awaitable, Callable, Generic, TypeVar
+
+from starlette.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+T = TypeVar("T")
+
+STREAM_MAX_BATCH = int(os.getenv("STREAM_MAX_BATCH", "256"))
+STREAM_QUEUE_BATCHES = int(os.getenv("STREAM_QUEUE_BATCHES", "8"))
+STREAM_MAX_LINE_BYTES = int(os.getenv("STREAM_MAX_LINE_BYTES", "65536"))
+
+
+class StreamError(ValueError):
+    pass
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that leaves receive() to the handler. The stock one may
+    poll receive() for a disconnect while it sends, which would swallow request
+    body chunks the handler is still reading. Here a disconnect shows up as the
+    request stream ending with ClientDisconnect instead.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+async def ndjson_lines(chunks: AsyncIterator[bytes], max_line_bytes: int = STREAM_MAX_LINE_BYTES) -> AsyncIterator[list[bytes]]:
+    """Complete, non-blank lines of a byte stream, grouped by the chunk that completed them."""
+    tail = b""
+    async for chunk in chunks:
+        if not chunk:
+            continue
+        parts = (tail + chunk).split(b"\n")
+        tail = parts.pop()
+        if len(tail) > max_line_bytes:
+            raise StreamError(f"line longer than {max_line_bytes} bytes")
+        lines = [line for line in parts if line.strip()]
+        if lines:
+            yield lines
+    if tail.strip():
+        yield [tail]
+
+
+class StreamScorer(Generic[T]):
+    """
+    parse turns a list of raw lines into one item per line (a record, or an error
+    the caller knows how to report); score turns a list of items into the
+    encoded response lines, in order.
+    """
+
+    def __init__(
+        self,
+        parse: Callable[[list[bytes], int], list[T]],
+        score: Callable[[list[T]], Awaitable[bytes]],
+        max_batch: int = STREAM_MAX_BATCH,
+        queue_batches: int = STREAM_QUEUE_BATCHES,
+    ) -> None:
+        self._parse = parse
+        self._score = score
+        self._max_batch = max(1, max_batch)
+        self._queue_batches = max(1, queue_batches)
+
+    async def run(self, chunks: AsyncIterator[bytes], on_error: Callable[[Exception], bytes]) -> AsyncIterator[bytes]:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self._queue_batches)
+        done = object()
+
+        async def read() -> None:
+            line_no = 0
+            try:
+                async for lines in ndjson_lines(chunks):
+                    for start in range(0, len(lines), self._max_batch):
+                        part = lines[start:start + self._max_batch]
+                        # Blocks while the queue is full: the request body is not read any further
+                        await queue.put(self._parse(part, line_no))
+                        line_no += len(part)
+            except Exception as exc:  # noqa: BLE001 — reported in-stream after the lines before it
+                await queue.put(exc)
+            await queue.put(done)
+
+        reader = asyncio.create_task(read())
+        pending = None
+        try:
+            while True:
+                item, pending = (pending if pending is not None else await queue.get()), None
+                if item is done:
+                    return
+                if isinstance(item, Exception):
+                    yield on_error(item)
+                    return
+                batch = item
+                # Take whatever else has queued up, so a fast producer gets large batches
+                while not queue.empty():
+                    nxt = queue.get_nowait()
+                    if nxt is done or isinstance(nxt, Exception) or len(batch) + len(nxt) > self._max_batch:
+                        pending = nxt
+                        break
+                    batch = batch + nxt
+                try:
+                    scored = await self._score(batch)
+                except Exception as exc:  # noqa: BLE001 — the client must see a fatal line, not a truncated stream
+                    yield on_error(exc)
+                    return
+                yield scored
+        finally:
+            reader.cancel()
@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+# The service is a flat set of modules run from ml-service/, not an installed package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def ensemble(tmp_path_factory):
+    """An ensemble trained on synthetic data, with its registry and artifacts in a temp directory."""
+    from ensemble import EnsembleModel
+    from registry import ModelRegistry
+
+    directory = tmp_path_factory.mktemp("models")
+    model = EnsembleModel(ModelRegistry(str(directory / "model_registry.json")), artifact_dir=str(directory / "artifacts"))
+    model.train_all()
+    return model
@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from autoencoder_model import AutoencoderModel, _build_mlp  # noqa: E402
+
+
+@pytest.fixture(scope="module")
+def model():
+    model = AutoencoderModel()
+    model.train_on_synthetic()
+    return model
+
+
+def _torch_errors(model, X):
+    net = _build_mlp()
+    net.load_state_dict({k: torch.from_numpy(np.array(v)) for k, v in model._state_dict().items()})
+    net.eval()
+    X_norm = model._normalize(X).astype(np.float32)
+    with torch.no_grad():
+        recon = net(torch.from_numpy(X_norm)).numpy()
+    return ((X_norm - recon) ** 2).mean(axis=1)
+
+
+def test_numpy_forward_pass_matches_torch(model):
+    X, _ = AutoencoderModel.synthetic_data(seed=7, n=2000)
+    X = np.vstack([X, X[:50] * 30.0])
+    X_norm = model._normalize(X).astype(np.float32)
+    np.testing.assert_allclose(model._reconstruct_error(X_norm), _torch_errors(model, X), rtol=1e-5, atol=1e-6)
+
+
+def test_loaded_model_scores_like_the_trained_one(model, tmp_path):
+    loaded = AutoencoderModel()
+    loaded.load(model.save(str(tmp_path)))
+    X, _ = AutoencoderModel.synthetic_data(seed=8, n=500)
+    np.testing.assert_allclose(loaded.score_batch(X), model.score_batch(X), rtol=0, atol=1e-12)
+    X_norm = loaded._normalize(X).astype(np.float32)
+    np.testing.assert_allclose(loaded._reconstruct_error(X_norm), _torch_errors(model, X), rtol=1e-5, atol=1e-6)
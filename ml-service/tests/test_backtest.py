@@ -0,0 +1,87 @@
+import csv
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+from backtest import SCORE_BINS, read_chunks, replay_partition, run_backtest, spill, threshold_metrics
+
+START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+LOCATIONS = ("NY", "LONDON", "TOKYO", "SYDNEY")
+
+
+@pytest.fixture(scope="module")
+def workdir(tmp_path_factory):
+    # The workers load models from the registry in the working directory, training them on first use
+    directory = tmp_path_factory.mktemp("backtest")
+    with pytest.MonkeyPatch.context() as mp:
+        mp.chdir(directory)
+        yield directory
+
+
+@pytest.fixture
+def history(workdir, tmp_path):
+    rng = np.random.default_rng(4)
+    path = tmp_path / "history.csv"
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["transactionId", "userId", "amount", "location", "deviceId", "timestamp", "isFraud"])
+        for i in range(300):
+            fraud = i % 10 == 0
+            ts = START + timedelta(minutes=int(rng.integers(10_000)))
+            writer.writerow([
+                f"tx-{i}", f"user-{rng.integers(20)}", round(float(rng.uniform(2000, 9000) if fraud else rng.uniform(5, 200)), 2),
+                LOCATIONS[rng.integers(4)], f"dev-{rng.integers(5)}", ts.isoformat(), "" if i % 7 == 0 else str(fraud).lower(),
+            ])
+        writer.writerow(["tx-bad", "user-1", "-5", "NY", "dev-1", START.isoformat(), "true"])
+    return path
+
+
+def _read(path):
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def test_backtest_scores_every_row_and_reports_metrics(history, tmp_path):
+    report = run_backtest(str(history), str(tmp_path / "scores.csv"), workers=1, chunk_rows=64, batch_rows=50)
+    scores = _read(tmp_path / "scores.csv")
+
+    assert report["rows"] == len(scores) == 300 and report["skipped"] == 1
+    assert [s["timestamp"] for s in scores] == sorted(s["timestamp"] for s in scores)
+    assert {s["transactionId"] for s in scores} == {f"tx-{i}" for i in range(300)}
+
+    labelled = [s for s in scores if s["label"]]
+    assert report["labelled"] == len(labelled) == 300 - len(range(0, 300, 7))
+    threshold = report["threshold"]
+    at = report["atThreshold"]
+    assert at["tp"] == sum(s["label"] == "1" and float(s["fraudScore"]) >= threshold for s in labelled)
+    assert at["fp"] == sum(s["label"] == "0" and float(s["fraudScore"]) >= threshold for s in labelled)
+    assert at["tp"] + at["fp"] + at["fn"] + at["tn"] == report["labelled"]
+    assert all(s["isFraud"] == str(int(float(s["fraudScore"]) >= threshold)) for s in scores)
+
+
+def test_partitioning_by_user_does_not_change_scores(history, tmp_path):
+    def scores(n_parts):
+        directory = tmp_path / f"parts-{n_parts}"
+        directory.mkdir()
+        runs, _, _ = spill(read_chunks(str(history), chunk_rows=64), n_parts, str(directory))
+        out = {}
+        for part, part_runs in enumerate(runs):
+            result = replay_partition(part, part_runs, str(directory), batch_rows=32)
+            with open(result["path"], newline="") as f:
+                out.update((row[2], row[5]) for row in csv.reader(f))
+        return out
+
+    single, split = scores(1), scores(3)
+    assert len(single) == 300 and split == single
+
+
+def test_threshold_metrics_counts_scores_at_or_above():
+    positives, negatives = np.zeros(SCORE_BINS, dtype=np.int64), np.zeros(SCORE_BINS, dtype=np.int64)
+    for score in (0.9, 0.6, 0.2):
+        positives[round(score * (SCORE_BINS - 1))] += 1
+    for score in (0.7, 0.1, 0.1):
+        negatives[round(score * (SCORE_BINS - 1))] += 1
+    [row] = threshold_metrics(positives, negatives, [0.6])
+    assert (row["tp"], row["fp"], row["fn"], row["tn"]) == (2, 1, 1, 2)
+    assert row["precision"] == round(2 / 3, 4) and row["recall"] == round(2 / 3, 4)
@@ -0,0 +1,61 @@
+from dataclasses import asdict
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from features import FeatureConfig, FeatureEngineer
+from xgboost_model import XGBoostModel
+
+START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+LOCATIONS = ("NY", "LONDON", "TOKYO", "SYDNEY")
+
+
+def test_predict_batch_matches_predict(ensemble):
+    X, _ = XGBoostModel.synthetic_data()
+    X = X[np.random.default_rng(0).choice(len(X), 200, replace=False)]
+    locations = [LOCATIONS[i % 4] for i in range(len(X))]
+    devices = [f"dev-{i % 7}" for i in range(len(X))]
+
+    batched = ensemble.predict_batch(X, locations, devices)
+    single = [ensemble.predict(list(x), loc, dev) for x, loc, dev in zip(X, locations, devices)]
+    assert [asdict(r) for r in batched] == [asdict(r) for r in single]
+    assert any(r.is_fraud for r in single) and not all(r.is_fraud for r in single)
+
+
+def test_empty_batch(ensemble):
+    assert ensemble.predict_batch(np.zeros((0, 5)), [], []) == []
+
+
+def test_build_batch_matches_sequential_builds():
+    rng = np.random.default_rng(1)
+    records = [
+        (f"user-{rng.integers(10)}", float(rng.uniform(1, 500)), LOCATIONS[rng.integers(4)], f"dev-{rng.integers(3)}",
+         START + timedelta(minutes=int(rng.integers(600))))
+        for _ in range(300)
+    ]
+    batched = FeatureEngineer(config=FeatureConfig()).build_batch(records)
+
+    sequential = FeatureEngineer(config=FeatureConfig())
+    by_time = sorted(range(len(records)), key=lambda i: records[i][4])
+    expected = [None] * len(records)
+    for i in by_time:
+        expected[i] = sequential.build(*records[i])
+    assert batched == expected
+
+
+def test_build_batch_orders_mixed_naive_and_aware_timestamps():
+    # Naive timestamps count as UTC; each user keeps one kind, as a single /predict would require
+    records = [
+        ("aware", 10.0, "NY", "d", START + timedelta(minutes=30)),
+        ("naive", 20.0, "NY", "d", (START + timedelta(minutes=20)).replace(tzinfo=None)),
+        ("aware", 30.0, "NY", "d", START + timedelta(minutes=10)),
+        ("naive", 40.0, "NY", "d", (START + timedelta(minutes=40)).replace(tzinfo=None)),
+    ]
+    batched = FeatureEngineer(config=FeatureConfig()).build_batch(records)
+
+    sequential = FeatureEngineer(config=FeatureConfig())
+    expected = [None] * len(records)
+    for i in (2, 1, 0, 3):
+        expected[i] = sequential.build(*records[i])
+    assert batched == expected
+    assert batched[0][2] == 1.0 and batched[3][2] == 1.0
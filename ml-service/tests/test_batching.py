@@ -0,0 +1,47 @@
+import asyncio
+
+import pytest
+
+from batching import MicroBatcher
+
+
+def _process(items):
+    return [ValueError(f"bad {item}") if item < 0 else item * 10 for item in items]
+
+
+def test_a_failed_item_fails_only_its_caller():
+    async def run():
+        batcher = MicroBatcher(_process, max_size=8, max_wait_ms=50)
+        return await asyncio.gather(*(batcher.submit(item) for item in (1, -2, 3, 4, -5, 6)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert results[0] == 10 and results[2:4] == [30, 40] and results[5] == 60
+    assert [str(results[i]) for i in (1, 4)] == ["bad -2", "bad -5"]
+
+
+def test_a_failed_batch_fails_every_caller():
+    def broken(items):
+        raise RuntimeError("down")
+
+    async def run():
+        batcher = MicroBatcher(broken, max_size=4, max_wait_ms=50)
+        return await asyncio.gather(*(batcher.submit(item) for item in range(4)), return_exceptions=True)
+
+    assert all(isinstance(r, RuntimeError) for r in asyncio.run(run()))
+
+
+def test_run_exclusive_shares_the_worker():
+    async def run():
+        batcher = MicroBatcher(_process, max_size=4, max_wait_ms=1)
+        return await batcher.run_exclusive(lambda: 7)
+
+    assert asyncio.run(run()) == 7
+
+
+@pytest.mark.parametrize("size", [1, 3])
+def test_full_batches_flush_without_waiting(size):
+    async def run():
+        batcher = MicroBatcher(_process, max_size=size, max_wait_ms=10_000)
+        return await asyncio.wait_for(asyncio.gather(*(batcher.submit(i) for i in range(size))), timeout=5)
+
+    assert asyncio.run(run()) == [i * 10 for i in range(size)]
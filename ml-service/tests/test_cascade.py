@@ -0,0 +1,81 @@
+import numpy as np
+
+from cascade import MODEL_NAMES, CascadePolicy, calibrate, live_scores, simulate
+from ensemble import EnsembleModel
+from registry import ModelRegistry, file_sha256
+from xgboost_model import XGBoostModel
+
+ARTIFACTS = {name: f"sha-{name}" for name in MODEL_NAMES}
+
+
+def _scores(n=5000, seed=0):
+    rng = np.random.default_rng(seed)
+    base = rng.beta(0.6, 2.0, n)
+    return np.clip(base[:, None] + rng.normal(0, 0.08, (n, 3)), 0, 1)
+
+
+def _policy(**overrides):
+    kwargs = dict(weights={"isolation_forest": 0.35, "xgboost": 0.45, "autoencoder": 0.2}, threshold=0.55,
+                  max_flip_rate=0.01, artifacts=ARTIFACTS)
+    kwargs.update(overrides)
+    return calibrate(_scores(), **kwargs)
+
+
+def test_calibrated_bands_keep_flips_within_budget():
+    policy = _policy()
+    sim = simulate(policy, _scores(seed=1))
+    assert sim["flipRate"] <= 0.02
+    assert sim["exitRate"][-1] < 1.0  # some rows exit early
+    assert policy.artifacts == ARTIFACTS
+
+
+def test_policy_round_trips(tmp_path):
+    policy = _policy()
+    path = str(tmp_path / "cascade.json")
+    policy.save(path)
+    assert CascadePolicy.load(path) == policy
+
+
+def test_matches_requires_the_calibrated_artifacts():
+    policy = _policy()
+    weights, threshold = dict(policy.weights), policy.threshold
+    assert policy.matches(weights, threshold, ARTIFACTS)
+    assert not policy.matches(weights, threshold, {**ARTIFACTS, "xgboost": "sha-retrained"})
+    assert not policy.matches(weights, 0.6, ARTIFACTS)
+    assert not _policy(artifacts=None).matches(weights, threshold, ARTIFACTS)
+
+
+def test_swapping_models_turns_the_cascade_off(tmp_path):
+    ensemble = EnsembleModel(ModelRegistry(str(tmp_path / "registry.json")), artifact_dir=str(tmp_path / "artifacts"))
+    snap = ensemble.snapshot()
+    ensemble.swap_models({name: model for name, model in snap.models()}, ARTIFACTS)
+    path = str(tmp_path / "cascade.json")
+    _policy(weights=dict(snap.weights), threshold=snap.threshold).save(path)
+
+    assert ensemble.enable_cascade(True, path).cascade is not None
+    # A retrain / promote / rollback brings in another artifact: back to full scoring
+    assert ensemble.swap_models({"xgboost": snap.xgboost}, {"xgboost": "sha-other"}).cascade is None
+    assert ensemble.cascade_status() | {"policy": None} == {"enabled": True, "active": False, "policy": None}
+    # Rolling back to the calibrated artifact brings it back
+    assert ensemble.swap_models({"xgboost": snap.xgboost}, {"xgboost": ARTIFACTS["xgboost"]}).cascade is not None
+    # A model swapped in without a known artifact cannot be matched
+    assert ensemble.swap_models({"autoencoder": snap.autoencoder}).cascade is None
+
+
+def test_live_models_carry_their_artifact_hashes(ensemble):
+    snap = ensemble.snapshot()
+    assert sorted(snap.artifacts) == sorted(MODEL_NAMES)
+    for name, sha in snap.artifacts.items():
+        assert file_sha256(ensemble._registry.get(name)["artifactPath"]) == sha
+
+
+def test_live_scores_come_from_the_live_models(ensemble):
+    X, _ = XGBoostModel.synthetic_data(seed=9)
+    X = X[:300].astype(np.float64)
+    snap = ensemble.snapshot()
+    scores = live_scores(snap, X)
+    assert scores.shape == (len(X), len(MODEL_NAMES)) and np.isfinite(scores).all()
+    # The same per-model scores the full ensemble serves
+    served = ensemble.predict_batch(X, ["NY"] * len(X), ["d"] * len(X))
+    expected = [[r.model_scores[name] for name in MODEL_NAMES] for r in served]
+    np.testing.assert_allclose(scores, expected, atol=5e-5)
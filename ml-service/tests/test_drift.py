@@ -0,0 +1,78 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from drift import COLUMNS, DriftMonitor, DriftReference, bin_indices, compare
+
+
+def _reference(rng, n=20_000):
+    X = rng.normal(0, 1, (n, 5))
+    return DriftReference.fit(X, rng.uniform(0, 1, n), bins=10)
+
+
+def _counts(reference, data):
+    idx = bin_indices(data, reference.lo, reference.scale, reference.bins)
+    return np.stack([np.bincount(idx[:, c], minlength=reference.bins) for c in range(data.shape[1])])
+
+
+def test_compare_is_zero_for_matching_distributions():
+    expected = np.full((2, 4), 0.25)
+    psi, ks, samples = compare(expected, np.full((2, 4), 25))
+    np.testing.assert_allclose(psi, 0.0, atol=1e-12)
+    np.testing.assert_allclose(ks, 0.0, atol=1e-12)
+    assert samples.tolist() == [100, 100]
+
+
+def test_compare_matches_hand_computed_psi_and_ks():
+    expected = np.array([[0.5, 0.5]])
+    psi, ks, _ = compare(expected, np.array([[80, 20]]))
+    assert psi[0] == pytest.approx(0.3 * np.log(0.8 / 0.5) + (-0.3) * np.log(0.2 / 0.5))
+    assert ks[0] == pytest.approx(0.3)
+
+
+def test_reference_fit_and_binning():
+    rng = np.random.default_rng(0)
+    reference = _reference(rng)
+    assert reference.expected.shape == (len(COLUMNS), 10)
+    np.testing.assert_allclose(reference.expected.sum(axis=1), 1.0)
+    assert DriftReference.from_arrays(reference.to_arrays()).key == reference.key
+
+    same = np.column_stack([rng.normal(0, 1, (5000, 5)), rng.uniform(0, 1, 5000)])
+    shifted = same + np.array([2.0, 0, 0, 0, 0, 0])
+    psi_same, _, _ = compare(reference.expected, _counts(reference, same))
+    psi_shifted, ks_shifted, _ = compare(reference.expected, _counts(reference, shifted))
+    assert psi_same.max() < 0.02
+    assert psi_shifted[0] > 1.0 and ks_shifted[0] > 0.5
+    assert psi_shifted[1:].max() < 0.02
+
+
+def test_monitor_reports_per_window_and_merges_shard_counts():
+    rng = np.random.default_rng(1)
+    model = SimpleNamespace(reference=_reference(rng))
+    ensemble = SimpleNamespace(snapshot=lambda: SimpleNamespace(models=lambda: [("isolation_forest", model)]))
+    now = [0.0]
+    monitor = DriftMonitor(ensemble, windows={"1h": 3600}, slot_seconds=300, min_samples=50, clock=lambda: now[0])
+
+    def observe(n, shift=0.0):
+        feats = rng.normal(shift, 1, (n, 5))
+        monitor.observe(feats, [SimpleNamespace(model_scores={"isolation_forest": s}) for s in rng.uniform(0, 1, n)])
+
+    observe(3)  # per-row path
+    assert monitor.report()["models"]["isolation_forest"]["windows"]["1h"]["columns"]["amount"]["psi"] is None
+    observe(2000)  # batch path
+    window = monitor.report()["models"]["isolation_forest"]["windows"]["1h"]
+    assert window["sampleSize"] == 2003
+    assert window["maxPsi"] < 0.05
+
+    shard = monitor.counts()
+    merged = monitor.report([shard])["models"]["isolation_forest"]["windows"]["1h"]
+    assert merged["sampleSize"] == 4006
+    stale = {"isolation_forest": {**shard["isolation_forest"], "key": "other"}}
+    assert monitor.report([stale])["models"]["isolation_forest"]["windows"]["1h"]["sampleSize"] == 2003
+
+    now[0] = 7200.0
+    observe(500, shift=3.0)
+    window = monitor.report()["models"]["isolation_forest"]["windows"]["1h"]
+    assert window["sampleSize"] == 500
+    assert window["columns"]["amount"]["psi"] > 1.0
@@ -0,0 +1,33 @@
+import numpy as np
+
+from explain import FEATURE_NAMES, explain_batch
+from xgboost_model import XGBoostModel
+
+
+def _rows():
+    X, y = XGBoostModel.synthetic_data(seed=7)
+    return np.vstack([X[y == 0][:20], X[y == 1][:20]]).astype(np.float64)
+
+
+def test_feature_contributions_are_absolute_shares(ensemble):
+    snap = ensemble.snapshot()
+    X = _rows()
+    out = explain_batch(snap, X)
+    contribs = snap.xgboost.contributions(X)[:, :-1]
+    errors = snap.autoencoder.feature_errors(X)
+    wx, wa = snap.weights["xgboost"], snap.weights["autoencoder"]
+    expected = (wx * np.abs(contribs) / np.abs(contribs).sum(axis=1, keepdims=True)
+                + wa * errors / errors.sum(axis=1, keepdims=True)) / (wx + wa)
+    # Fraud rows have negative SHAP values too, so signed shares would cancel out
+    assert (contribs < 0).any()
+
+    for row, exp in zip(out, expected):
+        shares = [c["share"] for c in row["featureContributions"]]
+        assert all(s >= 0 for s in shares) and shares == sorted(shares, reverse=True)
+        assert abs(sum(shares) - 1.0) < 1e-3
+        by_name = {c["feature"]: c["share"] for c in row["featureContributions"]}
+        np.testing.assert_allclose([by_name[f] for f in FEATURE_NAMES], exp, atol=1e-4)
+    # The signed values stay per model
+    assert out[0]["modelContributions"]["xgboost"]["values"] == {
+        f: round(float(v), 4) for f, v in zip(FEATURE_NAMES, contribs[0])
+    }
@@ -0,0 +1,66 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from ensemble import EnsembleResult
+from feature_log import FeatureLogReader, FeatureLogWriter, user_hash
+
+START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def _batch(start, n):
+    records = [(f"user-{i}", float(i), "NY", "dev", START + timedelta(seconds=i)) for i in range(start, start + n)]
+    features = [[float(i), 0.0, 1.0, 0.0, 0.5] for i in range(start, start + n)]
+    results = [
+        EnsembleResult(
+            fraud_score=i / 1000, is_fraud=i % 10 == 0, confidence=1.0,
+            model_scores={"isolation_forest": 0.1, "xgboost": 0.2}, model_weights={}, explanations=[],
+        )
+        for i in range(start, start + n)
+    ]
+    return records, features, results
+
+
+def test_writer_reader_round_trip(tmp_path):
+    writer = FeatureLogWriter(str(tmp_path), segment_records=250)
+    for start in range(0, 1000, 100):
+        assert writer.append(*_batch(start, 100))
+    writer.flush()
+    writer.close()
+
+    reader = FeatureLogReader(str(tmp_path))
+    assert len(reader.segments()) == 4
+    assert len(reader) == 1000
+    rows = np.concatenate(list(reader.iter_chunks(chunk_rows=300)))
+    np.testing.assert_array_equal(rows["features"][:, 0], np.arange(1000))
+    assert rows["user_hash"][7] == user_hash("user-7")
+    assert rows["ts_us"][1] - rows["ts_us"][0] == 1_000_000
+    assert rows["is_fraud"].sum() == 100
+    np.testing.assert_allclose(rows["fraud_score"], np.arange(1000) / 1000, atol=1e-6)
+    # A model the cascade skipped is logged as NaN
+    assert np.isnan(rows["model_scores"][:, 2]).all()
+
+    np.testing.assert_array_equal(np.sort(reader.recent(10)["features"][:, 0]), np.arange(990, 1000))
+    sample = reader.sample(50)
+    assert len(sample) == 50 and len(np.unique(sample["user_hash"])) == 50
+
+
+def test_reader_ignores_a_torn_tail(tmp_path):
+    writer = FeatureLogWriter(str(tmp_path))
+    writer.append(*_batch(0, 10))
+    writer.flush()
+    writer.close()
+    (segment,) = FeatureLogReader(str(tmp_path)).segments()
+    with open(segment, "ab") as f:
+        f.write(b"\0" * 13)
+    assert len(FeatureLogReader(str(tmp_path))) == 10
+
+
+def test_writer_continues_after_existing_segments(tmp_path):
+    for _ in range(2):
+        writer = FeatureLogWriter(str(tmp_path))
+        writer.append(*_batch(0, 5))
+        writer.flush()
+        writer.close()
+    reader = FeatureLogReader(str(tmp_path))
+    assert len(reader.segments()) == 2 and len(reader) == 10
@@ -0,0 +1,180 @@
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from feature_state import _WAL_HEADER, _WAL_RECORD, _WAL_RECORD_V1, WAL_MAGIC, FeatureStateStore, load_snapshot, replay_wal, write_snapshot
+from features import FeatureConfig, FeatureEngineer
+
+START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def _events(n=300):
+    return [
+        (f"user-{i % 17}", 10.0 + (i * 7) % 90, ("NY", "LA", "CHI")[i % 3], f"dev-{i % 5}", START + timedelta(minutes=i))
+        for i in range(n)
+    ]
+
+
+def _store(path):
+    return FeatureStateStore(str(path), snapshot_interval_s=1e9, wal_max_records=10**9)
+
+
+def _probe(fe):
+    # One more event per user, applied without the journal: equal state builds equal features
+    return [fe._build(f"user-{u}", 50.0, "NY", "dev-0", START + timedelta(days=1)) for u in range(17)]
+
+
+def _engineer():
+    return FeatureEngineer(config=FeatureConfig())
+
+
+def test_wal_round_trip(tmp_path):
+    live, store = _engineer(), _store(tmp_path)
+    assert store.recover(live)["users"] == 0
+    for event in _events():
+        live.build(*event)
+    live.commit()
+    store.close()
+
+    recovered = _engineer()
+    assert _store(tmp_path).recover(recovered)["walRecords"] == 300
+    assert _probe(recovered) == _probe(live)
+
+
+def test_failed_record_changes_nothing_and_is_not_logged(tmp_path):
+    live, store = _engineer(), _store(tmp_path)
+    store.recover(live)
+    events = _events(20)
+    live.build_batch(events[:10])
+
+    # A naive timestamp for users whose history is aware fails those rows alone
+    bad = [("user-1", 5.0, "LA", "dev-9", START.replace(tzinfo=None)), ("user-2", 6.0, "LA", "dev-9", START.replace(tzinfo=None))]
+    errors = {}
+    feats = live.build_batch([bad[0], events[10], bad[1]], time_ordered=False, errors=errors)
+    assert set(errors) == {0, 2} and all(isinstance(e, TypeError) for e in errors.values())
+    assert feats[0] == feats[2] == [] and len(feats[1]) == 5
+    assert store.wal_records == 11
+    store.close()
+
+    recovered, reference = _engineer(), _engineer()
+    assert _store(tmp_path).recover(recovered)["walRecords"] == 11
+    reference.build_batch(events[:11], time_ordered=False)
+    assert _probe(live) == _probe(reference) == _probe(recovered)
+
+
+def test_replay_restores_idle_time(tmp_path, monkeypatch):
+    wall = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: wall[0])
+    config = FeatureConfig(user_ttl_s=60)
+    live, store = FeatureEngineer(config=config, clock=lambda: wall[0]), _store(tmp_path)
+    store.recover(live)
+    live.build("a", 1.0, "NY", "d", START)
+    wall[0] = 1050.0
+    live.build("b", 1.0, "NY", "d", START)
+    live.commit()
+    store.close()
+
+    # Restarted 20s later, in a process whose monotonic clock reads differently
+    wall[0] = 1070.0
+    recovered = FeatureEngineer(config=config, clock=lambda: wall[0] + 5000.0)
+    _store(tmp_path).recover(recovered)
+    assert [u.last_seen for u in recovered.state.values()] == [6000.0, 6050.0]
+    wall[0] = 1075.0
+    recovered.build("c", 1.0, "NY", "d", START)
+    assert list(recovered.state) == ["b", "c"]  # a has been idle 75s, past the 60s TTL
+
+
+def test_snapshot_round_trip(tmp_path):
+    live = _engineer()
+    live.build_batch(_events())
+    path = str(tmp_path / "snapshot.npz")
+    assert write_snapshot(live, path) == 17
+
+    loaded = _engineer()
+    assert load_snapshot(path, loaded) == 17
+    assert _probe(loaded) == _probe(live)
+
+
+def test_replay_skips_undecodable_records(tmp_path):
+    live, store = _engineer(), _store(tmp_path)
+    store.recover(live)
+    events = _events(10)
+    for event in events[:5]:
+        live.build(*event)
+    bad = b"\xff\xfe"
+    store._wal.write(_WAL_RECORD.pack(0, 1.0, 0.0, False, len(bad), 2, 1) + bad + b"NY" + b"d")
+    for event in events[5:]:
+        live.build(*event)
+    live.commit()
+    wal = store._wal.name
+    store.close()
+
+    recovered = _engineer()
+    assert replay_wal(wal, recovered) == 10
+    assert _probe(recovered) == _probe(live)
+
+
+def test_replay_ignores_a_torn_tail(tmp_path):
+    live, store = _engineer(), _store(tmp_path)
+    store.recover(live)
+    for event in _events(10):
+        live.build(*event)
+    live.commit()
+    wal = store._wal.name
+    store.close()
+    os.truncate(wal, os.path.getsize(wal) - 3)
+
+    assert replay_wal(wal, _engineer()) == 9
+
+
+def test_replay_reads_version_1_segments(tmp_path):
+    path = tmp_path / "wal-00000001.log"
+    records = [_WAL_RECORD_V1.pack(i, 10.0 + i, False, 1, 2, 1) + b"u" + b"NY" + b"d" for i in range(3)]
+    path.write_bytes(_WAL_HEADER.pack(WAL_MAGIC, 1) + b"".join(records))
+    fe = _engineer()
+    assert replay_wal(str(path), fe) == 3
+    assert fe.state["u"].count == 3
+
+
+def test_replay_rejects_other_files(tmp_path):
+    path = tmp_path / "wal-00000001.log"
+    path.write_bytes(b"not a wal")
+    with pytest.raises(ValueError):
+        replay_wal(str(path), _engineer())
+
+
+def _snapshot_now(store, fe):
+    with store.lock:
+        store._snapshot(fe)
+        store._reap(block=True)
+
+
+def test_an_unreadable_snapshot_falls_back_without_losing_history(tmp_path):
+    live, store = _engineer(), _store(tmp_path)
+    store.recover(live)
+    events = _events()
+    for part in (events[:100], events[100:200]):
+        live.build_batch(part)
+        live.commit()
+        _snapshot_now(store, live)
+    live.build_batch(events[200:])
+    live.commit()
+    store.close()
+    assert store.snapshots_written == 2
+    # The previous snapshot and the WAL after it outlive the newest snapshot
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "snapshot-00000002.npz", "snapshot-00000003.npz", "wal-00000002.log", "wal-00000003.log",
+    ]
+
+    (tmp_path / "snapshot-00000003.npz").write_bytes(b"torn")
+    recovered = _engineer()
+    recovery = _store(tmp_path).recover(recovered)
+    assert recovery["complete"] and recovery["walRecords"] == 200
+    assert _probe(recovered) == _probe(live)
+
+    # Without the segment between the two snapshots the restore is reported as partial
+    os.remove(tmp_path / "wal-00000002.log")
+    recovery = _store(tmp_path).recover(_engineer())
+    assert not recovery["complete"] and recovery["walRecords"] == 100
@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta, timezone
+from math import log2
+
+import numpy as np
+import pytest
+
+from features import FeatureConfig, FeatureEngineer
+
+START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+LOCATIONS = ("NY", "LONDON", "TOKYO", "SYDNEY", "PARIS")
+
+
+def _events(n=2000, users=20, seed=0):
+    rng = np.random.default_rng(seed)
+    # Minutes jitter backwards as well as forwards, so some events arrive out of order
+    return [
+        (f"user-{rng.integers(users)}", float(rng.lognormal(4, 1)), LOCATIONS[rng.integers(5)],
+         f"dev-{rng.integers(4)}", START + timedelta(minutes=i // 3 - int(rng.integers(0, 90))))
+        for i in range(n)
+    ]
+
+
+class FullHistory:
+    """The original two-pass computation over each user's whole history."""
+
+    def __init__(self, geo):
+        self.geo = geo
+        self.history = {}
+
+    def build(self, user_id, amount, location, device_id, timestamp):
+        amounts, stamps, locations, devices = self.history.setdefault(user_id, ([], [], [], []))
+        z = 0.0
+        if len(amounts) >= 2:
+            mean = sum(amounts) / len(amounts)
+            std = (sum((a - mean) ** 2 for a in amounts) / len(amounts)) ** 0.5
+            z = (amount - mean) / std if std else 0.0
+        tx_freq = sum(1 for t in stamps if t >= timestamp - timedelta(hours=1))
+        geo_delta = self.geo.distance_km(locations[-1], location) if locations else 0.0
+        entropy = 0.0
+        for device in set(devices):
+            p = devices.count(device) / len(devices)
+            entropy -= p * log2(p)
+        amounts.append(amount)
+        stamps.append(timestamp)
+        locations.append(location)
+        devices.append(device_id)
+        return [amount, z, float(tx_freq), geo_delta, entropy]
+
+
+def test_parity_mode_matches_full_history():
+    fe = FeatureEngineer(config=FeatureConfig.parity_mode())
+    reference = FullHistory(fe.geo)
+    for event in _events():
+        got, want = fe.build(*event), reference.build(*event)
+        assert got[0] == want[0]
+        assert got[2] == want[2]  # tx_freq exactly, out-of-order events included
+        assert got[3] == want[3]
+        assert got[1] == pytest.approx(want[1], rel=1e-9, abs=1e-9)
+        assert got[4] == pytest.approx(want[4], rel=1e-9, abs=1e-9)
+
+
+def test_parity_mode_disables_every_bound(monkeypatch):
+    monkeypatch.setenv("FEATURE_PARITY_MODE", "1")
+    monkeypatch.setenv("FEATURE_MAX_USERS", "5")
+    config = FeatureConfig.from_env()
+    assert config.parity
+    assert (config.amount_window, config.device_window, config.velocity_cap, config.user_ttl_s, config.max_users) == (
+        0, 0, 0, 0.0, 0,
+    )
+
+
+def test_default_bounds_match_in_order_history():
+    fe = FeatureEngineer(config=FeatureConfig())
+    reference = FullHistory(fe.geo)
+    for i in range(500):
+        event = (f"user-{i % 7}", float(10 + i % 50), LOCATIONS[i % 5], f"dev-{i % 3}", START + timedelta(minutes=i))
+        got, want = fe.build(*event), reference.build(*event)
+        assert got == pytest.approx(want, rel=1e-9, abs=1e-9)
+
+
+def test_amount_and_device_windows():
+    fe = FeatureEngineer(config=FeatureConfig(amount_window=3, device_window=2))
+    for i, amount in enumerate([1000.0, 10.0, 20.0, 30.0]):
+        fe.build("u", amount, "NY", f"dev-{i}", START + timedelta(minutes=i))
+    amount, z, _, _, entropy = fe.build("u", 20.0, "NY", "dev-9", START + timedelta(minutes=5))
+    assert z == 0.0  # 20 is the mean of the last 3 amounts; 1000 has left the window
+    assert entropy == pytest.approx(1.0)  # two distinct devices in the window
+
+
+def test_velocity_cap_saturates_tx_freq():
+    fe = FeatureEngineer(config=FeatureConfig(velocity_cap=5))
+    for i in range(20):
+        feats = fe.build("u", 1.0, "NY", "d", START + timedelta(seconds=i))
+    assert feats[2] == 5.0
+
+
+def test_idle_and_lru_eviction():
+    now = [0.0]
+    fe = FeatureEngineer(config=FeatureConfig(user_ttl_s=60, max_users=2), clock=lambda: now[0])
+    fe.build("a", 1.0, "NY", "d", START)
+    fe.build("b", 1.0, "NY", "d", START)
+    fe.build("c", 1.0, "NY", "d", START)
+    assert list(fe.state) == ["b", "c"]
+    now[0] = 120.0
+    fe.build("d", 1.0, "NY", "d", START)
+    assert list(fe.state) == ["d"]
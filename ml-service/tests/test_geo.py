@@ -0,0 +1,63 @@
+import csv
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from geo import GEO_LOCATIONS_PATH, UNKNOWN, GeoIndex, default_index, haversine_km, normalize
+
+
+@pytest.fixture(scope="module")
+def geo():
+    return default_index()
+
+
+def test_names_aliases_and_spellings_resolve_to_one_place(geo):
+    london = geo.resolve("LONDON")
+    assert london != UNKNOWN and geo.place(london)["kind"] == "city"
+    assert {geo.resolve(s) for s in ("london", " London ", "LHR", "lgw")} == {london}
+    assert geo.resolve("London, CA") != london  # Ontario
+    assert geo.distance_km("London, CA", "London") == pytest.approx(5876, abs=5)
+    assert geo.distance_km("NY", "London") == pytest.approx(5570, abs=5)
+    assert geo.distance_km("LONDON", "LHR") == 0.0
+
+
+def test_merged_aliases_are_the_same_place(geo):
+    # NEWYORK and PUERTORICO used to be rows of their own, a few hundred metres from NY and PR
+    assert {geo.resolve(s) for s in ("NY", "NEWYORK", "New York", "NYC", "JFK")} == {geo.resolve("NY")}
+    assert geo.resolve("Puerto Rico") == geo.resolve("PR")
+    assert geo.place(geo.resolve("PR"))["kind"] == "region"
+    assert geo.distance_km("New York", "NY") == 0.0
+
+
+def test_every_name_and_alias_is_unique():
+    # resolution keeps the first definition, so a clash would silently hide a place
+    with open(GEO_LOCATIONS_PATH, newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(line for line in f if not line.startswith("#")))
+    names = Counter(normalize(n) for row in rows for n in (row["name"], *filter(None, row["aliases"].split("|"))))
+    assert [name for name, count in names.items() if count > 1] == []
+    assert len(rows) > 3000
+
+
+def test_unknown_locations_score_zero(geo):
+    assert geo.resolve("Atlantis") == UNKNOWN
+    assert geo.distance_km("Atlantis", "London") == 0.0
+
+
+def test_coordinates_resolve_to_the_nearest_city(geo):
+    assert geo.resolve("51.50,-0.12") == geo.resolve("London")
+    assert geo.resolve("40.71, -74.01") == geo.resolve("NY")
+    assert geo.resolve("95.0,10.0") == UNKNOWN  # out of range
+
+
+def test_pair_cache_matches_the_matrix():
+    names = ["A", "B", "C", "D"]
+    lat, lon = np.array([0.0, 10.0, -33.9, 51.5]), np.array([0.0, 20.0, 151.2, -0.1])
+    matrix = GeoIndex(names, lat, lon)
+    cached = GeoIndex(names, lat, lon, matrix_max_places=2, cache_size=2)
+    assert matrix._matrix is not None and cached._matrix is None
+    for a in names:
+        for b in names:
+            assert cached.distance_km(a, b) == pytest.approx(matrix.distance_km(a, b), abs=1e-6)
+    assert len(cached._pairs) <= 2
+    assert matrix.distance_km("A", "B") == pytest.approx(haversine_km(0.0, 0.0, 10.0, 20.0))
@@ -0,0 +1,52 @@
+from graph import EntityGraph
+
+
+def test_shared_device_merges_users_into_a_ring():
+    graph = EntityGraph()
+    graph.observe("alice", "dev-1", "NY", "10.0.0.1", 0.1, False)
+    assert graph.cluster_count == 0
+    score, metrics = graph.observe("bob", "dev-1", "LA", "10.0.0.2", 0.9, True)
+    assert graph.cluster_count == 1
+    assert metrics["clusterUsers"] == 2
+    assert metrics["sharedDeviceCount"] == 1
+    assert metrics["sharedIPCount"] == 0
+    assert score > 0
+
+
+def test_locations_never_merge_clusters():
+    graph = EntityGraph()
+    for i in range(10):
+        graph.observe(f"user-{i}", f"dev-{i}", "NY", None, 0.5, False)
+    assert graph.cluster_count == 0
+    assert len(graph) == 21  # 10 users, 10 devices, 1 location
+
+
+def test_unions_are_transitive():
+    graph = EntityGraph()
+    graph.observe("a", "dev-1", "NY", "ip-1", 0.1, False)
+    graph.observe("b", "dev-1", "NY", "ip-2", 0.1, False)
+    graph.observe("c", "dev-2", "NY", "ip-2", 0.1, False)
+    _, metrics = graph.observe("d", "dev-3", "NY", "ip-3", 0.1, False)
+    assert metrics["clusterUsers"] == 1
+    _, metrics = graph.observe("c", "dev-2", "NY", "ip-2", 0.1, False)
+    assert metrics["clusterUsers"] == 3
+    assert metrics["clusterSize"] == 7  # a, b, c, dev-1, dev-2, ip-1, ip-2
+    assert graph.cluster_count == 1
+
+
+def test_hub_devices_stop_merging():
+    graph = EntityGraph(hub_degree=3)
+    for i in range(6):
+        graph.observe(f"user-{i}", "kiosk", "NY", None, 0.1, False)
+    assert graph.analytics()["clusters"][0]["users"] == 3
+
+
+def test_analytics_lists_cluster_members():
+    graph = EntityGraph()
+    graph.observe("a", "dev-1", "NY", None, 0.2, False)
+    graph.observe("b", "dev-1", "NY", None, 0.8, True)
+    report = graph.analytics()
+    assert report["totalClusters"] == 1
+    cluster = report["clusters"][0]
+    assert cluster["users"] == 2 and cluster["transactions"] == 2 and cluster["fraudRate"] == 0.5
+    assert {n["nodeId"] for n in report["nodes"]} == {"a", "b", "dev-1"}
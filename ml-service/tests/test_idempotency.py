@@ -0,0 +1,95 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+
+from idempotency import IdempotencyCache, IdempotencyConflict, request_fingerprint, request_key
+
+TS = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+class _Scorer:
+    def __init__(self, fail=False):
+        self.calls = 0
+        self.fail = fail
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        if self.fail:
+            raise RuntimeError("scoring failed")
+        return {"fraudScore": 0.1 * self.calls}
+
+
+def test_request_key_prefers_the_transaction_id():
+    assert request_key("tx-1", "u", 10.0, "NY", "d", TS) == "id:tx-1"
+    assert request_key(None, "u", 10.0, "NY", "d", TS) == "h:" + request_fingerprint("u", 10.0, "NY", "d", TS)
+    assert request_key(None, "u", 10.0, "NY", "d", TS) != request_key(None, "u", 11.0, "NY", "d", TS)
+
+
+def test_replay_returns_the_cached_response():
+    cache, scorer = IdempotencyCache(), _Scorer()
+
+    async def run():
+        first = await cache.get_or_compute("id:tx-1", scorer, fingerprint="a")
+        return first, await cache.get_or_compute("id:tx-1", scorer, fingerprint="a")
+
+    first, second = asyncio.run(run())
+    assert second is first and scorer.calls == 1
+    assert cache.stats() == {"entries": 1, "hits": 1, "misses": 1, "hitRate": 0.5}
+
+
+def test_concurrent_duplicates_share_one_score():
+    cache, scorer = IdempotencyCache(), _Scorer()
+
+    async def run():
+        return await asyncio.gather(*(cache.get_or_compute("id:tx-1", scorer) for _ in range(5)))
+
+    results = asyncio.run(run())
+    assert scorer.calls == 1 and all(r is results[0] for r in results)
+
+
+def test_a_different_body_or_variant_conflicts():
+    cache, scorer = IdempotencyCache(), _Scorer()
+    body = request_fingerprint("u", 10.0, "NY", "d", TS)
+
+    async def run():
+        await cache.get_or_compute("id:tx-1", scorer, fingerprint=body)
+        with pytest.raises(IdempotencyConflict, match="different body"):
+            await cache.get_or_compute("id:tx-1", scorer, fingerprint=request_fingerprint("u", 99.0, "NY", "d", TS))
+        with pytest.raises(IdempotencyConflict, match="'explain'"):
+            await cache.get_or_compute("id:tx-1", scorer, "explain", fingerprint=body)
+
+    asyncio.run(run())
+    assert scorer.calls == 1
+
+
+def test_a_failure_is_not_cached():
+    cache, scorer = IdempotencyCache(), _Scorer(fail=True)
+
+    async def run():
+        results = await asyncio.gather(
+            *(cache.get_or_compute("id:tx-1", scorer) for _ in range(3)), return_exceptions=True,
+        )
+        assert all(isinstance(r, RuntimeError) for r in results) and scorer.calls == 1
+        scorer.fail = False
+        return await cache.get_or_compute("id:tx-1", scorer)
+
+    assert asyncio.run(run()) == {"fraudScore": 0.2}
+    assert scorer.calls == 2 and len(cache) == 1
+
+
+def test_entries_expire_and_are_bounded():
+    now = [0.0]
+    cache, scorer = IdempotencyCache(max_entries=2, ttl_s=10.0, clock=lambda: now[0]), _Scorer()
+
+    async def run():
+        for key in ("a", "b", "c"):
+            await cache.get_or_compute(key, scorer)
+        assert len(cache) == 2
+        await cache.get_or_compute("a", scorer)  # evicted as least recently used: scored again
+        now[0] = 11.0
+        await cache.get_or_compute("c", scorer)  # expired
+
+    asyncio.run(run())
+    assert scorer.calls == 5
@@ -0,0 +1,79 @@
+import numpy as np
+
+from feature_log import RECORD_DTYPE
+from isolation_forest_model import IsolationForestModel
+from labels import LabelStore
+from registry import file_sha256
+from retrain import _update_model, _update_rows
+from xgboost_model import XGBoostModel
+
+
+def _recent(n=1000, seed=0):
+    rng = np.random.default_rng(seed)
+    out = np.zeros(n, dtype=RECORD_DTYPE)
+    out["features"] = IsolationForestModel.synthetic_data(seed=seed, n=n)[0]
+    out["user_hash"] = rng.integers(0, 2**63, n, dtype=np.uint64)
+    out["ts_us"] = np.arange(n)
+    out["is_fraud"] = np.arange(n) % 10 == 0
+    return out
+
+
+def test_isolation_forest_update_keeps_forest_size():
+    model = IsolationForestModel(n_estimators=20)
+    model.train_on_synthetic()
+    X, _ = IsolationForestModel.synthetic_data(seed=7, n=1000)
+    before = model.score_batch(X)
+
+    summary = model.update(X, seed=1)
+    assert summary["trees"] == 20
+    assert 1 <= summary["treesReplaced"] < 20
+    after = model.score_batch(X)
+    assert after.shape == before.shape
+    assert 0.0 <= after.min() and after.max() <= 1.0
+    # Most trees are kept, so scores move but stay correlated
+    assert np.corrcoef(before, after)[0, 1] > 0.8
+
+
+def test_isolation_forest_update_keeps_trees_without_a_full_sample():
+    model = IsolationForestModel(n_estimators=10)
+    model.train_on_synthetic()
+    X = IsolationForestModel.synthetic_data(seed=3, n=100)[0]
+    before = model.score_batch(X)
+
+    summary = model.update(X)
+    assert summary["treesReplaced"] == 0 and summary["trees"] == 10 and "256" in summary["skipped"]
+    np.testing.assert_array_equal(model.score_batch(X), before)
+
+
+def test_incremental_retrain_on_a_young_log_keeps_the_base_forest(tmp_path):
+    base = IsolationForestModel(n_estimators=10)
+    base.train_on_synthetic()
+    path = base.save(str(tmp_path))
+
+    model = IsolationForestModel(n_estimators=10)
+    step = _update_model(model, {"path": path, "sha256": file_sha256(path), "generation": 0}, _recent(n=200), None)
+    assert step["generation"] == 1 and step["trainingSource"] == "feature_log" and step["trainingRows"] == 180
+    assert step["treesReplaced"] == 0 and "skipped" in step
+    X = IsolationForestModel.synthetic_data(seed=5, n=300)[0]
+    np.testing.assert_allclose(model.score_batch(X), base.score_batch(X), rtol=0, atol=1e-12)
+
+
+def test_unsupervised_updates_skip_flagged_rows():
+    recent = _recent()
+    X, y = _update_rows(IsolationForestModel(), recent, None)
+    assert len(X) == 900 and y is None
+    np.testing.assert_array_equal(X, recent["features"][recent["is_fraud"] == 0])
+
+
+def test_supervised_updates_need_confirmed_labels():
+    recent = _recent()
+    assert _update_rows(XGBoostModel(), recent, None) is None
+
+    picked = np.arange(0, 1000, 4)
+    one_class = LabelStore(recent["user_hash"][picked], recent["ts_us"][picked], np.zeros(len(picked)))
+    assert _update_rows(XGBoostModel(), recent, one_class) is None
+
+    labels = LabelStore(recent["user_hash"][picked], recent["ts_us"][picked], picked % 8 == 0)
+    X, y = _update_rows(XGBoostModel(), recent, labels)
+    np.testing.assert_array_equal(X, recent["features"][picked])
+    np.testing.assert_array_equal(y, (picked % 8 == 0).astype(np.uint8))
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from isolation_forest_model import CompiledForest, IsolationForestModel
+
+
+@pytest.fixture(scope="module")
+def model():
+    model = IsolationForestModel()
+    model.train_on_synthetic()
+    return model
+
+
+def _rows(n=2000, seed=3):
+    X, _ = IsolationForestModel.synthetic_data(seed=seed, n=n)
+    # Far outside the training range too, where paths end at the tree depth limit
+    return np.vstack([X, X[:50] * 40.0, np.zeros((1, X.shape[1]))])
+
+
+def test_compiled_forest_matches_sklearn(model):
+    X = _rows()
+    expected = model._forest().decision_function(X)
+    np.testing.assert_allclose(CompiledForest(model._forest()).decision_function(X), expected, rtol=0, atol=1e-12)
+
+
+def test_saved_engine_matches_sklearn(model, tmp_path):
+    loaded = IsolationForestModel()
+    loaded.load(model.save(str(tmp_path)))
+    assert loaded._compiled is not None and loaded._clf is None  # scored without unpickling sklearn
+    X = _rows(seed=4)
+    np.testing.assert_allclose(
+        loaded._compiled.decision_function(X), model._forest().decision_function(X), rtol=0, atol=1e-12,
+    )
+    np.testing.assert_allclose(loaded.score_batch(X), model.score_batch(X), rtol=0, atol=1e-12)
+    assert loaded.score(list(X[0])) == pytest.approx(float(loaded.score_batch(X[:1])[0]), abs=1e-15)
@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from feature_log import RECORD_DTYPE, _ts_us, user_hash
+from labels import LabelStore
+
+START = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def _records(rows):
+    out = np.zeros(len(rows), dtype=RECORD_DTYPE)
+    out["user_hash"] = [user_hash(u) for u, _ in rows]
+    out["ts_us"] = [_ts_us(ts) for _, ts in rows]
+    return out
+
+
+def test_load_and_join(tmp_path):
+    path = tmp_path / "labels.csv"
+    path.write_text(
+        "userId,timestamp,label\n"
+        f"alice,{START.isoformat()},1\n"
+        f"bob,{(START + timedelta(seconds=1)).isoformat()},0\n"
+        "carol,not-a-date,1\n"
+        f"dave,{START.isoformat()},2\n"
+        # Naive timestamps are UTC, as in the feature log
+        f"erin,{START.replace(tzinfo=None).isoformat()},1\n",
+        encoding="utf-8",
+    )
+    store = LabelStore.load(str(path))
+    assert len(store) == 3
+
+    records = _records([
+        ("bob", START + timedelta(seconds=1)),
+        ("alice", START + timedelta(seconds=1)),  # no outcome at this time
+        ("alice", START),
+        ("mallory", START),
+        ("erin", START),
+    ])
+    mask, labels = store.join(records)
+    assert mask.tolist() == [True, False, True, False, True]
+    assert labels.tolist() == [0, 1, 1]
+
+
+def test_load_without_usable_rows(tmp_path):
+    assert LabelStore.load("") is None
+    path = tmp_path / "labels.csv"
+    path.write_text("userId,timestamp,label\n", encoding="utf-8")
+    assert LabelStore.load(str(path)) is None
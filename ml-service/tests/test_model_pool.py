@@ -0,0 +1,23 @@
+from model_pool import ModelPool
+
+
+def test_least_recently_used_version_is_evicted():
+    pool = ModelPool(capacity=2)
+    pool.put(("xgboost", "a"), "model-a")
+    pool.put(("xgboost", "b"), "model-b")
+    assert pool.get(("xgboost", "a")) == "model-a"  # a is now the most recently used
+    pool.put(("xgboost", "c"), "model-c")
+
+    assert ("xgboost", "b") not in pool
+    assert ("xgboost", "a") in pool and ("xgboost", "c") in pool
+    assert pool.get(("xgboost", "b")) is None
+    assert pool.stats() == {"size": 2, "capacity": 2, "hits": 1, "misses": 1, "evictions": 1}
+
+
+def test_putting_an_existing_key_refreshes_it():
+    pool = ModelPool(capacity=2)
+    pool.put("a", 1)
+    pool.put("b", 2)
+    pool.put("a", 3)
+    pool.put("c", 4)
+    assert "b" not in pool and pool.get("a") == 3 and len(pool) == 2
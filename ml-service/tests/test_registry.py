@@ -0,0 +1,100 @@
+import json
+
+import pytest
+
+from ensemble import EnsembleModel
+from model_pool import ModelPool
+from registry import REGISTRY_FORMAT, ModelRegistry, file_sha256
+from xgboost_model import XGBoostModel
+
+
+def test_register_keeps_every_version_and_activates_the_newest(tmp_path):
+    registry = ModelRegistry(str(tmp_path / "registry.json"))
+    for version in ("1.0", "1.1", "1.2"):
+        registry.register("xgboost", version, artifact_path=f"/a/{version}", artifact_sha256=version)
+
+    described = registry.describe("xgboost")
+    assert described["active"] == 3 and described["previous"] == 2
+    assert [(v["revision"], v["status"]) for v in described["versions"]] == [
+        (1, "inactive"), (2, "inactive"), (3, "active"),
+    ]
+    assert registry.get("xgboost")["version"] == "1.2"
+
+
+def test_activate_and_rollback_walk_the_history(tmp_path):
+    registry = ModelRegistry(str(tmp_path / "registry.json"))
+    for version in ("1.0", "1.1", "1.2"):
+        registry.register("xgboost", version)
+
+    registry.activate("xgboost", 1)
+    assert registry.get("xgboost")["revision"] == 1 and registry.previous("xgboost") == 3
+    registry.activate("xgboost", 3, rollback=True)
+    # Rollbacks keep walking back instead of bouncing between two revisions
+    assert registry.get("xgboost")["revision"] == 3 and registry.previous("xgboost") == 2
+    registry.activate("xgboost", 2, rollback=True)
+    assert registry.get("xgboost")["revision"] == 2 and registry.previous("xgboost") == 1
+    registry.activate("xgboost", 1, rollback=True)
+    assert registry.get("xgboost")["revision"] == 1 and registry.previous("xgboost") is None
+
+    with pytest.raises(KeyError):
+        registry.activate("xgboost", 9)
+    with pytest.raises(KeyError):
+        registry.activate("autoencoder", 1)
+
+
+def test_a_pinned_model_only_records_new_versions(tmp_path):
+    registry = ModelRegistry(str(tmp_path / "registry.json"))
+    registry.register("xgboost", "1.0")
+    registry.set_pinned("xgboost", True)
+    registry.register("xgboost", "1.1")
+    assert registry.get("xgboost")["revision"] == 1
+    assert len(registry.describe("xgboost")["versions"]) == 2
+
+    registry.activate("xgboost", 2, pinned=False)
+    registry.register("xgboost", "1.2")
+    assert registry.get("xgboost")["revision"] == 3 and not registry.pinned("xgboost")
+
+
+def test_batched_writes_land_once_and_survive_a_reload(tmp_path):
+    path = tmp_path / "registry.json"
+    registry = ModelRegistry(str(path))
+    with registry.batch():
+        registry.register("xgboost", "1.0")
+        registry.register("autoencoder", "1.0")
+        assert not path.exists()
+    assert json.loads(path.read_text())["format"] == REGISTRY_FORMAT
+    assert not list(tmp_path.glob("*.tmp"))
+
+    registry.set_pinned("xgboost", True)
+    reloaded = ModelRegistry(str(path))
+    assert reloaded.names() == ["xgboost", "autoencoder"] and reloaded.pinned("xgboost")
+
+
+def test_ensemble_switches_versions_without_retraining(tmp_path):
+    pool = ModelPool(capacity=3)
+    registry = ModelRegistry(str(tmp_path / "registry.json"))
+    model = EnsembleModel(registry, artifact_dir=str(tmp_path / "artifacts"), pool=pool)
+    model.train_all()
+    first = model.snapshot().xgboost
+
+    # A second xgboost version on disk only: registered while pinned, so it is recorded but not served
+    candidate = XGBoostModel()
+    candidate.train(*XGBoostModel.synthetic_data(seed=7))
+    path = candidate.save(str(tmp_path / "candidate"))
+    model.set_pinned("xgboost", True)
+    registry.register("xgboost", candidate.version, artifact_path=path, artifact_sha256=file_sha256(path))
+    assert registry.get("xgboost")["revision"] == 1 and model.snapshot().xgboost is first
+
+    entry = model.activate("xgboost", 2, pinned=False)
+    loaded = model.snapshot()
+    assert entry["revision"] == 2 and registry.get("xgboost")["revision"] == 2
+    assert loaded.xgboost is not first and loaded.artifacts["xgboost"] == entry["artifactSha256"]
+    # Loading it took the pool's last slot: the least recently used model went
+    assert len(pool) == 3 and pool.stats()["evictions"] == 1
+
+    model.rollback("xgboost")
+    assert model.snapshot().xgboost is first  # still pooled
+    assert registry.get("xgboost")["revision"] == 1 and registry.previous("xgboost") is None
+    with pytest.raises(ValueError, match="no earlier version"):
+        model.rollback("xgboost")
+    assert model.versions()["models"]["xgboost"]["versions"][1]["loaded"]
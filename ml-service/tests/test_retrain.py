@@ -0,0 +1,77 @@
+import shutil
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+import retrain
+from ensemble import MODEL_NAMES, EnsembleModel
+from registry import ModelRegistry, file_sha256
+from retrain import Retrainer
+
+
+class _BrokenPool:
+    created = 0
+
+    def __init__(self, *args, **kwargs):
+        _BrokenPool.created += 1
+        self.shut_down = False
+
+    def submit(self, *args, **kwargs):
+        raise BrokenProcessPool("pool is broken")
+
+    def shutdown(self, wait=True):
+        self.shut_down = True
+
+
+def test_failed_submit_does_not_leave_a_retrain_running(monkeypatch, tmp_path):
+    monkeypatch.setattr(retrain, "ProcessPoolExecutor", _BrokenPool)
+    monkeypatch.setattr(_BrokenPool, "created", 0)
+    retrainer = Retrainer(ensemble=None, artifact_root=str(tmp_path))
+
+    for attempt in (1, 2):
+        with pytest.raises(BrokenProcessPool):
+            retrainer.start("synthetic")
+        assert not retrainer.running
+        # The refused pool is dropped, so the next attempt starts a fresh one
+        assert retrainer._executor is None and _BrokenPool.created == attempt
+
+
+@pytest.fixture
+def live_copy(ensemble, tmp_path):
+    """A second ensemble serving the session fixture's artifacts, from its own copy of the registry."""
+    path = tmp_path / "model_registry.json"
+    shutil.copy(ensemble._registry._path, path)
+    registry = ModelRegistry(str(path))
+    model = EnsembleModel(registry, artifact_dir=str(tmp_path / "artifacts"))
+    model.load_or_train()
+    return model, registry
+
+
+@pytest.mark.parametrize("mode", ["full", "incremental"])
+def test_retrain_swaps_in_the_new_set(live_copy, tmp_path, mode):
+    model, registry = live_copy
+    before = model.snapshot()
+    revisions = {name: registry.get(name)["revision"] for name in MODEL_NAMES}
+    retrainer = Retrainer(model, registry, artifact_root=str(tmp_path / "retrained"), feature_log_dir="")
+    try:
+        done = retrainer.start("synthetic", mode)
+        assert retrainer.running
+        status = done.result(timeout=300)
+    finally:
+        retrainer.close()
+
+    assert status["status"] == "complete" and status["mode"] == mode
+    assert retrainer.status()["last"] == status and not retrainer.running
+    after = model.snapshot()
+    for name in MODEL_NAMES:
+        entry = registry.get(name)
+        # A new revision from the worker's directory, live and verified by hash
+        assert entry["revision"] == revisions[name] + 1
+        assert entry["artifactPath"].startswith(status["artifactDir"])
+        assert after.artifacts[name] == entry["artifactSha256"] == file_sha256(entry["artifactPath"])
+        assert getattr(after, name) is not getattr(before, name)
+        assert entry["lineage"][-1]["mode"] == mode
+    if mode == "incremental":
+        # Updated from the live artifacts, so every model changed. A full retrain on the
+        # fixed synthetic sets may reproduce identical forest and booster files.
+        assert all(after.artifacts[name] != before.artifacts[name] for name in MODEL_NAMES)
@@ -0,0 +1,114 @@
+import os
+import shutil
+import time
+
+import numpy as np
+import pytest
+from prometheus_client import CollectorRegistry, Counter
+
+from ensemble import EnsembleModel
+from registry import ModelRegistry
+from shadow import Challenger, ShadowEvaluator, load_challenger
+from xgboost_model import XGBoostModel
+
+
+@pytest.fixture(scope="module")
+def batch(ensemble):
+    X, y = XGBoostModel.synthetic_data(seed=3)
+    X = np.vstack([X[y == 0][:300], X[y == 1][:100]]).astype(np.float64)
+    return X, ensemble.predict_batch(X, ["NY"] * len(X), ["d"] * len(X))
+
+
+def _wait_for(predicate, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return
+        time.sleep(0.01)
+    raise AssertionError("timed out")
+
+
+def test_agreement_statistics(ensemble, batch):
+    X, results = batch
+    shadow = ShadowEvaluator(ensemble)
+    try:
+        shadow.register(Challenger("same"))
+        shadow.register(Challenger("flag-all", threshold=0.0))
+        for start in range(0, len(X), 100):
+            assert shadow.submit(X[start:start + 100], results[start:start + 100])
+        shadow.flush()
+        stats = shadow.stats()
+    finally:
+        shadow.close()
+
+    flagged = sum(r.is_fraud for r in results)
+    assert 0 < flagged < len(X)
+    assert stats["rowsEnqueued"] == stats["rowsScored"] == len(X) and stats["rowsDropped"] == 0
+
+    same = stats["challengers"]["same"]
+    assert same["rows"] == len(X) and same["agreementRate"] == 1.0
+    assert same["fraudToLegit"] == same["legitToFraud"] == 0 and same["maxAbsScoreDiff"] == 0.0
+    assert same["scoreCorrelation"] == pytest.approx(1.0)
+
+    flag_all = stats["challengers"]["flag-all"]
+    assert flag_all["legitToFraud"] == len(X) - flagged and flag_all["fraudToLegit"] == 0
+    assert flag_all["agreementRate"] == round(flagged / len(X), 6) and flag_all["challengerFraudRate"] == 1.0
+
+
+def test_a_full_queue_drops_and_counts(ensemble, batch):
+    X, results = batch
+    rows = Counter("shadow_rows", "rows", ["result"], registry=CollectorRegistry())
+    shadow = ShadowEvaluator(ensemble, queue_batches=1, rows=rows)
+    try:
+        shadow.register(Challenger("same"))
+        with shadow._lock:  # holds the worker inside its first batch
+            assert shadow.submit(X[:10], results[:10])
+            _wait_for(lambda: shadow._queue.qsize() == 0)
+            assert shadow.submit(X[10:20], results[10:20])
+            assert not shadow.submit(X[20:50], results[20:50])  # never blocks
+        shadow.flush()
+        stats = shadow.stats()
+    finally:
+        shadow.close()
+
+    assert stats["rowsEnqueued"] == stats["rowsScored"] == 20 and stats["rowsDropped"] == 30
+    assert rows.labels(result="dropped")._value.get() == 30
+    assert rows.labels(result="enqueued")._value.get() == 20
+    assert stats["challengers"]["same"]["rows"] == 20
+
+
+def test_nothing_is_mirrored_without_challengers(ensemble, batch):
+    X, results = batch
+    shadow = ShadowEvaluator(ensemble)
+    try:
+        assert not shadow.submit(X[:10], results[:10])
+    finally:
+        shadow.close()
+    assert shadow.stats()["rowsEnqueued"] == 0
+
+
+def test_challenger_models_come_from_the_registry_only(ensemble, tmp_path):
+    live = ensemble._registry.get("xgboost")
+    for ref in (live["revision"], live["artifactSha256"]):
+        challenger = load_challenger(ensemble, "by-ref", artifacts={"xgboost": ref})
+        assert challenger.models["xgboost"] is ensemble.snapshot().xgboost
+        assert challenger.describe()["artifacts"] == {
+            "xgboost": {"revision": live["revision"], "artifactSha256": live["artifactSha256"]},
+        }
+    # A path is not a registered version, even when it names a real artifact
+    with pytest.raises(ValueError, match="no registered version"):
+        load_challenger(ensemble, "by-path", artifacts={"xgboost": live["artifactPath"]})
+    with pytest.raises(ValueError, match="no registered version"):
+        load_challenger(ensemble, "unknown", artifacts={"graph": 1})
+
+    # A recorded artifact that changed on disk fails its hash check and is never loaded
+    registry = ModelRegistry(str(tmp_path / "registry.json"))
+    tampered = tmp_path / os.path.basename(live["artifactPath"])
+    shutil.copy(live["artifactPath"], tampered)
+    registry.register(
+        "xgboost", live["version"], artifact_path=str(tampered), artifact_sha256=live["artifactSha256"],
+    )
+    with open(tampered, "ab") as f:
+        f.write(b"\0")
+    with pytest.raises(ValueError, match="hash check"):
+        load_challenger(EnsembleModel(registry), "tampered", artifacts={"xgboost": 1})
@@ -0,0 +1,115 @@
+import os
+import time
+from datetime import datetime, timezone
+
+import pytest
+
+from sharding import ConsistentHashRing, ShardedScorer, ShardUnavailable
+
+USERS = [f"user-{i}" for i in range(5000)]
+
+
+def test_ring_is_deterministic_and_in_range():
+    a, b = ConsistentHashRing(4), ConsistentHashRing(4)
+    shards = [a.shard_for(u) for u in USERS]
+    assert shards == [b.shard_for(u) for u in USERS]
+    assert set(shards) == {0, 1, 2, 3}
+
+
+def test_ring_spreads_keys_evenly():
+    ring = ConsistentHashRing(4)
+    counts = [0] * 4
+    for u in USERS:
+        counts[ring.shard_for(u)] += 1
+    assert min(counts) > 0.15 * len(USERS)
+
+
+def test_adding_a_shard_moves_only_its_share():
+    before, after = ConsistentHashRing(4), ConsistentHashRing(5)
+    moved = [u for u in USERS if before.shard_for(u) != after.shard_for(u)]
+    # Keys only move to the new shard, and roughly 1/5 of them do
+    assert all(after.shard_for(u) == 4 for u in moved)
+    assert 0.1 * len(USERS) < len(moved) < 0.3 * len(USERS)
+
+
+def _echo_worker(conn, shard, n_shards):
+    """Stands in for sharding._worker_main: answers score / config, and dies on "crash" or a "crash" user."""
+    conn.send((None, True, {"shard": shard, "pid": os.getpid()}))
+    config = None
+    scored = 0
+    while True:
+        try:
+            msg_id, kind, args = conn.recv()
+        except EOFError:
+            return
+        if kind == "crash":
+            os._exit(1)
+        if kind == "stop":
+            conn.send((msg_id, True, None))
+            return
+        if kind == "config":
+            config = args
+            payload = None
+        elif kind == "score":
+            if any(record[0] == "crash" for record in args[0]):
+                os._exit(1)
+            scored += len(args[0])
+            payload = [{"shard": shard, "pid": os.getpid(), "config": config} for _ in args[0]]
+        else:
+            payload = {"shard": shard, "config": config, "scored": scored}
+        conn.send((msg_id, True, payload))
+
+
+def _wait_for(predicate, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return
+        time.sleep(0.05)
+    raise AssertionError("timed out")
+
+
+def _records(users):
+    start = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    return [(u, 1.0, "NY", "d", start) for u in users]
+
+
+def test_dead_shard_is_restarted_with_its_config():
+    scorer = ShardedScorer(2, worker=_echo_worker)
+    try:
+        scorer.broadcast("config", ({"xgboost": 0.5}, None, None))
+        scorer.broadcast("config", (None, 0.6, None))
+        user = next(u for u in USERS if scorer.shard_for(u) == 0)
+        old_pid = scorer.score(_records([user]), time_ordered=False)[0]["pid"]
+
+        scorer._call(scorer._shards[0], "crash", None)
+        _wait_for(lambda: scorer.dead_shards() == [0])
+        with pytest.raises(ShardUnavailable, match="shard 0 is down"):
+            scorer.score(_records([user]), time_ordered=False)
+        # The other shard keeps serving, and broadcasts skip the dead one
+        other = next(u for u in USERS if scorer.shard_for(u) == 1)
+        assert scorer.score(_records([other]), time_ordered=False)[0]["shard"] == 1
+        assert scorer.broadcast("drift") == [{"shard": 1, "config": (None, 0.6, None), "scored": 1}]
+        # A batch that needs the dead shard is sent to no shard at all, so a retry counts nothing twice
+        with pytest.raises(ShardUnavailable):
+            scorer.score(_records([other, user, other]), time_ordered=False)
+        assert scorer.broadcast("drift")[0]["scored"] == 1
+
+        _wait_for(lambda: not scorer.dead_shards())
+        response = scorer.score(_records([user]), time_ordered=False)[0]
+        # Replayed as one accumulated config message
+        assert response["pid"] != old_pid and scorer.restarts == 1
+        assert response["config"] == ({"xgboost": 0.5}, 0.6, None)
+    finally:
+        scorer.close()
+
+
+def test_a_shard_dying_mid_batch_fails_only_its_rows():
+    scorer = ShardedScorer(2, worker=_echo_worker)
+    try:
+        other = next(u for u in USERS if scorer.shard_for(u) != scorer.shard_for("crash"))
+        responses = scorer.score(_records([other, "crash", other]), time_ordered=False)
+        assert isinstance(responses[1], ShardUnavailable)
+        assert [r["shard"] for r in (responses[0], responses[2])] == [scorer.shard_for(other)] * 2
+    finally:
+        scorer.close()
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from sketches import DDSketch, RollingSketch
+
+
+@pytest.mark.parametrize("q", [0.01, 0.5, 0.9, 0.99])
+def test_quantile_within_relative_accuracy(q):
+    values = np.random.default_rng(0).lognormal(-4, 1, 20_000).clip(1e-6, 1.0)
+    sketch = DDSketch(relative_accuracy=0.01)
+    sketch.add(values)
+    exact = np.quantile(values, q, method="lower")
+    assert sketch.quantile(q) == pytest.approx(exact, rel=0.01)
+    assert sketch.count == len(values)
+    assert sketch.mean() == pytest.approx(values.mean())
+
+
+def test_small_and_large_batches_bucket_alike():
+    values = np.random.default_rng(1).uniform(0, 1, 64)
+    one_by_one, batched = DDSketch(), DDSketch()
+    for v in values:
+        one_by_one.add([v])
+    batched.add(values)
+    np.testing.assert_array_equal(one_by_one.counts, batched.counts)
+
+
+def test_merge_then_subtract_restores_sketch():
+    a, b = DDSketch(), DDSketch()
+    a.add([0.01, 0.02, 0.5])
+    b.add([0.3, 0.9])
+    counts = a.counts.copy()
+    a.merge(b)
+    assert a.count == 5
+    a.subtract(b)
+    np.testing.assert_array_equal(a.counts, counts)
+
+
+def test_empty_and_out_of_range_values():
+    sketch = DDSketch(min_value=1e-3, max_value=1.0)
+    assert sketch.quantile(0.5) is None and sketch.mean() is None
+    sketch.add([0.0, 5.0])
+    assert sketch.quantile(0.0) == 0.0
+    assert sketch.quantile(1.0) == pytest.approx(1.0, rel=0.01)  # clamped to the top bucket
+
+
+def test_rolling_windows_expire_old_slots():
+    now = [0.0]
+    rolling = RollingSketch(windows={"1m": 60, "5m": 300}, slot_seconds=10, clock=lambda: now[0])
+    rolling.add([0.1] * 10, flagged=2)
+    now[0] = 120.0
+    rolling.add([0.2] * 5)
+    summary = rolling.summary()
+    assert summary["1m"]["count"] == 5 and summary["1m"]["flagged"] == 0
+    assert summary["5m"]["count"] == 15 and summary["5m"]["flagged"] == 2
+
+    now[0] = 10_000.0
+    assert rolling.summary()["5m"]["count"] == 0
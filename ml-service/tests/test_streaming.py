@@ -0,0 +1,62 @@
+import asyncio
+import json
+
+from streaming import StreamScorer, ndjson_lines
+
+
+async def _chunks(*chunks):
+    for chunk in chunks:
+        yield chunk
+
+
+def _parse(lines, first_line):
+    items = []
+    for offset, line in enumerate(lines):
+        try:
+            items.append(int(line))
+        except ValueError:
+            items.append({"line": first_line + offset, "error": "not an int"})
+    return items
+
+
+async def _score(items):
+    return "".join(json.dumps(item if isinstance(item, dict) else item * 2) + "\n" for item in items).encode()
+
+
+def _on_error(exc):
+    return (json.dumps({"error": str(exc), "fatal": True}) + "\n").encode()
+
+
+def _run(scorer, *chunks):
+    async def collect():
+        return b"".join([out async for out in scorer.run(_chunks(*chunks), _on_error)])
+
+    return [json.loads(line) for line in asyncio.run(collect()).splitlines()]
+
+
+def test_ndjson_lines_joins_split_lines_and_skips_blanks():
+    async def collect():
+        return [lines async for lines in ndjson_lines(_chunks(b"1\n2", b"2\n\n", b"3"))]
+
+    assert asyncio.run(collect()) == [[b"1"], [b"22"], [b"3"]]
+
+
+def test_every_line_answered_in_order():
+    scorer = StreamScorer(_parse, _score, max_batch=2, queue_batches=1)
+    assert _run(scorer, b"1\n2\nx\n", b"4\n5") == [2, 4, {"line": 2, "error": "not an int"}, 8, 10]
+
+
+def test_scoring_failure_ends_with_a_fatal_line():
+    async def score(items):
+        if 3 in items:
+            raise RuntimeError("scoring failed")
+        return await _score(items)
+
+    scorer = StreamScorer(_parse, score, max_batch=1, queue_batches=1)
+    assert _run(scorer, b"1\n2\n3\n4\n") == [2, 4, {"error": "scoring failed", "fatal": True}]
+
+
+def test_overlong_line_ends_with_a_fatal_line():
+    scorer = StreamScorer(_parse, _score)
+    out = _run(scorer, b"1\n", b"9" * 70_000)
+    assert out[0] == 2 and out[-1]["fatal"] is True
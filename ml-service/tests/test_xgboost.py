@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from xgboost_model import CompiledBooster, XGBoostModel
+
+
+@pytest.fixture(scope="module")
+def model():
+    model = XGBoostModel()
+    model.train_on_synthetic()
+    return model
+
+
+def _rows(seed=5):
+    X, _ = XGBoostModel.synthetic_data(seed=seed)
+    X = X[:3000].astype(np.float64)
+    extremes = X[:50] * 100.0
+    missing = X[:50].copy()
+    missing[::2, 1] = np.nan  # default-direction branches
+    return np.vstack([X, extremes, missing])
+
+
+def test_compiled_booster_matches_predict_proba(model):
+    X = _rows()
+    expected = model._clf.predict_proba(X)[:, 1]
+    np.testing.assert_allclose(CompiledBooster(model._clf.get_booster()).predict_proba(X), expected, rtol=0, atol=1e-6)
+
+
+def test_every_engine_agrees_after_a_round_trip(model, tmp_path):
+    loaded = XGBoostModel()
+    loaded.load(model.save(str(tmp_path)))
+    assert loaded._compiled is not None and loaded._clf is None  # scored without loading xgboost's model
+    X = _rows(seed=6)
+    expected = model._clf.predict_proba(X)[:, 1]
+    np.testing.assert_allclose(loaded._compiled.predict_proba(X), expected, rtol=0, atol=1e-6)
+    np.testing.assert_allclose(loaded.score_batch(X[:64]), expected[:64], rtol=0, atol=1e-6)
+
+    loaded.load_deferred()  # large batches switch to the native booster
+    np.testing.assert_allclose(loaded.score_batch(X), expected, rtol=0, atol=1e-6)
@@ -0,0 +1,64 @@
+"""
+Parallel training of the model set.
+
+Each model trains in a worker process of its own, so the three fits run side by
+side instead of one after another. Every worker gets its own BLAS / OpenMP /
+torch thread budget, so together they do not oversubscribe the cores. Workers
+persist their artifacts and return them in the format EnsembleModel.load_artifacts
+takes; the caller loads and registers them. With a single worker (one core, or
+TRAIN_WORKERS=1) callers train in-process instead, where spawning a process and
+importing the libraries again would only add time.
+
+    TRAIN_WORKERS            models trained at once (default: min(3, CPUs))
+    TRAIN_THREADS_PER_MODEL  threads each worker may use (default: CPUs // workers, at least 1)
+"""
+from __future__ import annotations
+
+import logging
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Sequence
+
+logger = logging.getLogger(__name__)
+
+TRAIN_WORKERS = int(os.getenv("TRAIN_WORKERS", str(min(3, os.cpu_count() or 1))))
+TRAIN_THREADS_PER_MODEL = int(os.getenv("TRAIN_THREADS_PER_MODEL", "0"))
+
+
+def _init_worker(threads: int) -> None:
+    for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[var] = str(threads)
+
+
+def _train_one(name: str, directory: str) -> dict:
+    from ensemble import MODEL_CLASSES  # noqa: PLC0415
+    from registry import file_sha256  # noqa: PLC0415
+
+    started = time.perf_counter()
+    model = MODEL_CLASSES[name]()
+    model.train_on_synthetic()
+    path = model.save(directory)
+    return {
+        "version": model.version,
+        "path": path,
+        "sha256": file_sha256(path),
+        "trainSeconds": round(time.perf_counter() - started, 3),
+    }
+
+
+def train_in_parallel(names: Sequence[str], directory: str, workers: int = TRAIN_WORKERS) -> dict[str, dict]:
+    """Train the named models on synthetic data, one worker process each (at most workers at once)."""
+    workers = max(1, min(workers, len(names)))
+    threads = TRAIN_THREADS_PER_MODEL or max(1, (os.cpu_count() or 1) // workers)
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=mp.get_context("spawn"), initializer=_init_worker, initargs=(threads,),
+    ) as pool:
+        futures = {name: pool.submit(_train_one, name, directory) for name in names}
+        artifacts = {name: future.result() for name, future in futures.items()}
+    logger.info(
+        "Trained %s in %d workers × %d threads (%s)", ", ".join(names), workers, threads,
+        ", ".join(f"{name} {art['trainSeconds']}s" for name, art in artifacts.items()),
+    )
+    return artifacts
@@ -1,11 +1,183 @@
 """
 XGBoost binary classifier for fraud detection.
 Trained on synthetic labeled data: normal vs. anomalous feature vectors.
+
+Inference skips the sklearn wrapper. XGB_ENGINE selects the path:
+  numpy    (default) walk the dumped trees with NumPy (CompiledBooster) for batches
+           of up to XGB_NUMPY_MAX_ROWS rows, Booster.inplace_predict above that
+  booster  Booster.inplace_predict on preallocated float32 buffers
+  sklearn  XGBClassifier.predict_proba
+Each path falls back to the next one if it cannot be prepared.
+
+save() writes the CompiledBooster arrays next to the UBJSON artifact. With the
+numpy engine, load() serves from them and leaves xgboost unimported until
+something needs the booster: a batch above XGB_NUMPY_MAX_ROWS (scored by the
+walker until then), contributions, an update or a save.
 """
 from __future__ import annotations
 
+import json
+import logging
+import os
+import threading
+from typing import TYPE_CHECKING
+
 import numpy as np
-import xgboost as xgb
+
+from drift import DRIFT_REFERENCE_ROWS, DriftReference, fit_reference, load_reference, save_reference
+from feature_log import FeatureLogReader
+from labels import LabelStore
+from registry import artifact_path, load_compiled, save_compiled
+
+if TYPE_CHECKING:
+    import xgboost as xgb
+
+logger = logging.getLogger(__name__)
+
+XGB_ENGINE = os.getenv("XGB_ENGINE", "numpy")
+XGB_PREDICT_NTHREAD = int(os.getenv("XGB_PREDICT_NTHREAD", "1"))
+# Past this batch size the native predictor beats the NumPy walker
+XGB_NUMPY_MAX_ROWS = int(os.getenv("XGB_NUMPY_MAX_ROWS", "64"))
+XGB_TRAIN_CHUNK_ROWS = int(os.getenv("XGB_TRAIN_CHUNK_ROWS", "262144"))
+# Boosting rounds an incremental update adds on top of the previous booster
+XGB_INCREMENTAL_ROUNDS = int(os.getenv("XGB_INCREMENTAL_ROUNDS", "15"))
+
+_TRAIN_PARAMS = {
+    "objective": "binary:logistic",
+    "max_depth": 4,
+    "learning_rate": 0.1,
+    "subsample": 0.8,
+    "colsample_bytree": 0.8,
+    "eval_metric": "logloss",
+    "verbosity": 0,
+}
+
+
+def _parse_base_score(raw: str) -> float:
+    # Stored as "5E-1" in older releases and "[5E-1]" in newer ones
+    return float(str(raw).strip("[]"))
+
+
+def _log_chunks(reader: FeatureLogReader, labels: LabelStore, chunk_rows: int) -> xgb.DataIter:
+    """A DataIter feeding the labelled rows of feature-log chunks to XGBoost one chunk at a time."""
+    import xgboost as xgb  # noqa: PLC0415
+
+    class _LogChunks(xgb.DataIter):
+        def __init__(self) -> None:
+            self._chunks = None
+            super().__init__()
+
+        def next(self, input_data) -> bool:  # type: ignore[override]
+            if self._chunks is None:
+                self._chunks = reader.iter_chunks(chunk_rows)
+            for chunk in self._chunks:
+                mask, y = labels.join(chunk)
+                if mask.any():
+                    input_data(
+                        data=np.ascontiguousarray(chunk["features"][mask], dtype=np.float32),
+                        label=y.astype(np.float32),
+                    )
+                    return True
+            return False
+
+        def reset(self) -> None:
+            self._chunks = None
+
+    return _LogChunks()
+
+
+class CompiledBooster:
+    """
+    A binary:logistic booster's trees packed into contiguous node arrays.
+
+    Same layout as CompiledForest in isolation_forest_model: child[2*i] / child[2*i + 1]
+    are the yes / no children, leaves point to themselves and hold their leaf value.
+    XGBoost takes the "yes" branch when x < split_condition, and the default
+    branch when x is missing.
+    """
+
+    def __init__(self, booster: xgb.Booster) -> None:
+        model = json.loads(booster.save_raw("json"))
+        learner = model["learner"]
+        objective = learner["objective"]["name"]
+        if objective != "binary:logistic":
+            raise ValueError(f"unsupported objective {objective}")
+        trees = learner["gradient_booster"]["model"]["trees"]
+        if any(t.get("categories_nodes") for t in trees):
+            raise ValueError("categorical splits are not supported")
+
+        features, thresholds, children_yes, children_no, default_left, leaf_values, roots = [], [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        for tree in trees:
+            left = np.asarray(tree["left_children"], dtype=np.int64)
+            right = np.asarray(tree["right_children"], dtype=np.int64)
+            cond = np.asarray(tree["split_conditions"], dtype=np.float32)
+            n = left.shape[0]
+            is_leaf = left == -1
+
+            depth = np.zeros(n, dtype=np.int64)
+            for node in range(n):  # children always have larger ids than their parent
+                if not is_leaf[node]:
+                    depth[left[node]] = depth[node] + 1
+                    depth[right[node]] = depth[node] + 1
+            max_depth = max(max_depth, int(depth.max()))
+
+            own = np.arange(n, dtype=np.int64) + offset
+            features.append(np.where(is_leaf, 0, np.asarray(tree["split_indices"], dtype=np.int64)))
+            # For leaves split_conditions holds the leaf value
+            thresholds.append(np.where(is_leaf, np.float32(0), cond))
+            leaf_values.append(np.where(is_leaf, cond, np.float32(0)))
+            children_yes.append(np.where(is_leaf, own, left + offset))
+            children_no.append(np.where(is_leaf, own, right + offset))
+            default_left.append(np.asarray(tree["default_left"], dtype=bool))
+            roots.append(offset)
+            offset += n
+
+        self.feature = np.concatenate(features).astype(np.intp)
+        self.threshold = np.concatenate(thresholds).astype(np.float32)
+        self.default_right = ~np.concatenate(default_left)
+        self.child = np.empty(2 * offset, dtype=np.intp)
+        self.child[0::2] = np.concatenate(children_yes)
+        self.child[1::2] = np.concatenate(children_no)
+        self.leaf_value = np.concatenate(leaf_values).astype(np.float32)
+        self.roots = np.asarray(roots, dtype=np.intp)
+        self.max_depth = max_depth
+
+        base_score = _parse_base_score(learner["learner_model_param"]["base_score"])
+        self.base_margin = float(np.log(base_score / (1.0 - base_score)))
+
+    _ARRAYS = ("feature", "threshold", "default_right", "child", "leaf_value", "roots")
+
+    def to_arrays(self) -> dict[str, np.ndarray]:
+        return {
+            **{name: getattr(self, name) for name in self._ARRAYS},
+            "scalars": np.array([self.max_depth, self.base_margin], dtype=np.float64),
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays: dict[str, np.ndarray]) -> "CompiledBooster":
+        booster = cls.__new__(cls)
+        for name in cls._ARRAYS:
+            setattr(booster, name, arrays[name])
+        max_depth, booster.base_margin = (float(v) for v in arrays["scalars"])
+        booster.max_depth = int(max_depth)
+        return booster
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        """Probability of class 1 for each row of X."""
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        n_rows, n_features = X.shape
+        flat = X.ravel()
+        row_base = (np.arange(n_rows, dtype=np.intp) * n_features)[:, None]
+        node = np.empty((n_rows, self.roots.shape[0]), dtype=np.intp)
+        node[:] = self.roots
+        for _ in range(self.max_depth):
+            x = flat[row_base + self.feature[node]]
+            go_right = np.where(np.isnan(x), self.default_right[node], ~(x < self.threshold[node]))
+            node = self.child[2 * node + go_right]
+        margin = self.base_margin + self.leaf_value[node].sum(axis=1, dtype=np.float64)
+        return 1.0 / (1.0 + np.exp(-margin))
 
 
 class XGBoostModel:
@@ -14,16 +186,26 @@ class XGBoostModel:
     Outputs probability in [0, 1].
     """
 
+    # Needs confirmed outcomes to train from the feature log (labels.py)
+    supervised = True
+
     def __init__(self) -> None:
         self._clf: xgb.XGBClassifier | None = None
+        self._booster: xgb.Booster | None = None
+        self._compiled: CompiledBooster | None = None
+        self._path: str | None = None  # artifact the booster is loaded from on first use
+        self._buffers = threading.local()
+        self.reference: DriftReference | None = None  # training distribution, for drift
         self.is_fitted = False
         self.version = "1.0.0"
         self.name = "xgboost"
 
     # ------------------------------------------------------------------
     @staticmethod
-    def _generate_synthetic_data(n_normal: int = 4000, n_fraud: int = 400) -> tuple[np.ndarray, np.ndarray]:
-        rng = np.random.default_rng(42)
+    def _generate_synthetic_data(
+        n_normal: int = 4000, n_fraud: int = 400, seed: int = 42,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        rng = np.random.default_rng(seed)
 
         # Normal transactions: moderate amounts, low velocity, common locations
         X_normal = np.column_stack([
@@ -48,6 +230,8 @@ class XGBoostModel:
         return X, y
 
     def train_on_synthetic(self) -> None:
+        import xgboost as xgb  # noqa: PLC0415
+
         X, y = self._generate_synthetic_data()
         self._clf = xgb.XGBClassifier(
             n_estimators=150,
@@ -61,9 +245,13 @@ class XGBoostModel:
             verbosity=0,
         )
         self._clf.fit(X, y)
+        self._prepare_inference()
         self.is_fitted = True
+        self.reference = fit_reference(self, X)
 
     def train(self, X: np.ndarray, y: np.ndarray) -> None:
+        import xgboost as xgb  # noqa: PLC0415
+
         self._clf = xgb.XGBClassifier(
             n_estimators=150,
             max_depth=4,
@@ -76,13 +264,173 @@ class XGBoostModel:
             verbosity=0,
         )
         self._clf.fit(X, y)
+        self._prepare_inference()
+        self.is_fitted = True
+        self.reference = fit_reference(self, X)
+
+    def train_from_log(
+        self, reader: FeatureLogReader, labels: LabelStore | None, chunk_rows: int = XGB_TRAIN_CHUNK_ROWS,
+    ) -> int:
+        """
+        Train on the feature-log rows with a confirmed outcome in labels, through an
+        external-memory QuantileDMatrix: XGBoost pulls memmap chunks through a DataIter
+        and only keeps the quantised matrix. The logged is_fraud column is the
+        ensemble's own decision and is never used as a label. Returns the rows used.
+        """
+        import xgboost as xgb  # noqa: PLC0415
+
+        if labels is None:
+            raise ValueError("no confirmed labels to train on (RETRAIN_LABELS_PATH)")
+        n_rows = n_fraud = 0
+        for chunk in reader.iter_chunks(chunk_rows):
+            _, y = labels.join(chunk)
+            n_rows += len(y)
+            n_fraud += int(y.sum())
+        if n_fraud == 0 or n_fraud == n_rows:
+            raise ValueError(f"confirmed labels need both classes to train on ({n_fraud}/{n_rows} fraud)")
+
+        dtrain = xgb.QuantileDMatrix(_log_chunks(reader, labels, chunk_rows), max_bin=256)
+        self._adopt(xgb.train({**_TRAIN_PARAMS, "seed": 42}, dtrain, num_boost_round=150))
+        self.reference = fit_reference(self, reader.sample(DRIFT_REFERENCE_ROWS)["features"])
+        return n_rows
+
+    def update(self, X: np.ndarray, y: np.ndarray, seed: int = 0) -> dict:
+        """
+        Incremental update: continue boosting from the current booster for
+        XGB_INCREMENTAL_ROUNDS rounds on (X, y). The existing trees are kept as they are.
+        """
+        import xgboost as xgb  # noqa: PLC0415
+
+        self._load_booster()
+        dtrain = xgb.DMatrix(np.asarray(X, dtype=np.float32), label=np.asarray(y, dtype=np.float32))
+        booster = xgb.train(
+            {**_TRAIN_PARAMS, "seed": seed},
+            dtrain,
+            num_boost_round=XGB_INCREMENTAL_ROUNDS,
+            xgb_model=self._clf.get_booster(),
+        )
+        self._adopt(booster)
+        self.reference = fit_reference(self, X)
+        return {"boostRounds": XGB_INCREMENTAL_ROUNDS, "trees": booster.num_boosted_rounds()}
+
+    @classmethod
+    def synthetic_data(cls, seed: int = 42) -> tuple[np.ndarray, np.ndarray]:
+        return cls._generate_synthetic_data(seed=seed)
+
+    def _adopt(self, booster: xgb.Booster) -> None:
+        """Wrap a booster trained with the native API so save / predict_proba keep working."""
+        import xgboost as xgb  # noqa: PLC0415
+
+        clf = xgb.XGBClassifier()
+        clf.load_model(bytearray(booster.save_raw("ubj")))
+        self._clf = clf
+        self._prepare_inference()
         self.is_fitted = True
 
+    # ------------------------------------------------------------------
+    def save(self, directory: str) -> str:
+        """Persist the booster in XGBoost's native UBJSON format, plus the compiled trees and drift reference; returns the artifact path."""
+        self._load_booster()
+        os.makedirs(directory, exist_ok=True)
+        path = artifact_path(directory, self.name, self.version, "ubj")
+        tmp = path[: -len(".ubj")] + ".tmp.ubj"
+        self._clf.save_model(tmp)
+        os.replace(tmp, path)
+        if self._compiled is not None:
+            save_compiled(path, self._compiled.to_arrays())
+        save_reference(path, self.reference)
+        return path
+
+    def load(self, path: str) -> None:
+        self._clf = None
+        self._booster = None
+        self._compiled = None
+        self._path = path
+        arrays = load_compiled(path) if XGB_ENGINE == "numpy" else None
+        if arrays is not None:
+            self._compiled = CompiledBooster.from_arrays(arrays)
+        else:
+            self._load_booster()
+        self.reference = load_reference(path)
+        self.is_fitted = True
+
+    def _load_booster(self) -> None:
+        """Load the booster deferred by load(); keeps an already compiled walker."""
+        if self._clf is not None or self._path is None:
+            return
+        import xgboost as xgb  # noqa: PLC0415
+
+        clf = xgb.XGBClassifier()
+        clf.load_model(self._path)
+        if self._compiled is None:
+            self._clf = clf
+            self._prepare_inference()
+            return
+        # Already serving from the saved walker: only add the booster, publishing _clf last
+        # since score_batch keeps to the walker until it is set
+        booster = clf.get_booster()
+        booster.set_param({"nthread": XGB_PREDICT_NTHREAD})
+        self._booster = booster
+        self._clf = clf
+
+    def load_deferred(self) -> None:
+        """Load what load() left for later, so the first call that needs it does not pay for it."""
+        self._load_booster()
+
+    # ------------------------------------------------------------------
+    def _prepare_inference(self) -> None:
+        self._booster = None
+        self._compiled = None
+        if XGB_ENGINE == "sklearn":
+            return
+        self._booster = self._clf.get_booster()
+        self._booster.set_param({"nthread": XGB_PREDICT_NTHREAD})
+        if XGB_ENGINE != "numpy":
+            return
+        try:
+            self._compiled = CompiledBooster(self._booster)
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Could not compile XGBoost trees, using inplace_predict: %s", exc)
+
+    def _float32_rows(self, X: np.ndarray) -> np.ndarray:
+        """Copy X into this thread's preallocated float32 buffer (grown on demand) and return a view."""
+        n = X.shape[0]
+        buf = getattr(self._buffers, "rows", None)
+        if buf is None or buf.shape[0] < n or buf.shape[1] != X.shape[1]:
+            buf = np.empty((max(n, 1), X.shape[1]), dtype=np.float32)
+            self._buffers.rows = buf
+        out = buf[:n]
+        np.copyto(out, X, casting="unsafe")
+        return out
+
     # ------------------------------------------------------------------
     def score(self, features: list[float]) -> float:
         """Return fraud probability in [0, 1]."""
+        return float(self.score_batch(np.array([features]))[0])
+
+    def score_batch(self, X: np.ndarray) -> np.ndarray:
+        """Return fraud probabilities in [0, 1] for an (N, 5) feature matrix."""
+        if not self.is_fitted:
+            self.train_on_synthetic()
+        X = np.asarray(X)
+        if self._compiled is not None and (X.shape[0] <= XGB_NUMPY_MAX_ROWS or self._clf is None):
+            prob = self._compiled.predict_proba(X)
+        elif self._booster is not None:
+            prob = self._booster.inplace_predict(self._float32_rows(X)).astype(np.float64)
+        else:
+            prob = self._clf.predict_proba(X)[:, 1].astype(np.float64)
+        return np.clip(prob, 0.0, 1.0)
+
+    def contributions(self, X: np.ndarray) -> np.ndarray:
+        """
+        TreeSHAP contributions from the booster (pred_contribs) for an (N, 5) matrix:
+        (N, 6) in log-odds, one column per feature plus the bias; each row sums to the margin.
+        """
+        import xgboost as xgb  # noqa: PLC0415
+
         if not self.is_fitted:
             self.train_on_synthetic()
-        vec = np.array([features])
-        prob = float(self._clf.predict_proba(vec)[0][1])
-        return float(np.clip(prob, 0.0, 1.0))
+        self._load_booster()
+        booster = self._booster if self._booster is not None else self._clf.get_booster()
+        dmatrix = xgb.DMatrix(np.asarray(X, dtype=np.float32), nthread=XGB_PREDICT_NTHREAD)
+        return booster.predict(dmatrix, pred_contribs=True).astype(np.float64)